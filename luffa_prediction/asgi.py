@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'luffa_prediction.settings')
 
 application = get_asgi_application()
+
+# Load clients and models in the background so the worker accepts requests
+# immediately; /readyz reports when warm-up is done (see PREDICTION_WARMUP)
+from prediction.warmup import start_warmup  # noqa: E402
+
+start_warmup()
@@ -52,6 +52,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # add this line
+    'prediction.middleware.metrics_middleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -138,6 +139,15 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploads up to this size stay in memory and are forwarded to the prediction
+# API without being written to disk.
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(os.environ.get("FILE_UPLOAD_MAX_MEMORY_SIZE", 20 * 1024 * 1024))
+
+# Optionally archive uploads as content-addressed files under media/predictions/
+PREDICTION_ARCHIVE_ENABLED = os.environ.get("PREDICTION_ARCHIVE_ENABLED", "False").lower() == "true"
+# Uploads waiting to be written; further ones are not archived until the queue drains
+PREDICTION_ARCHIVE_MAX_PENDING = int(os.environ.get("PREDICTION_ARCHIVE_MAX_PENDING", 100))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -156,7 +166,227 @@ CORS_ALLOW_CREDENTIALS = True
 # Static files for production
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# collectstatic writes hashed names (served with a far-future immutable
+# Cache-Control), Brotli and gzip copies, and resized AVIF/WebP variants of the
+# images under STATIC_IMAGE_DIRS (prediction/staticfiles.py)
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "prediction.staticfiles.OptimizedStaticFilesStorage"},
+}
+STATIC_IMAGE_DIRS = os.environ.get("STATIC_IMAGE_DIRS", "asset/").split(",")
+STATIC_IMAGE_WIDTHS = [int(w) for w in os.environ.get("STATIC_IMAGE_WIDTHS", "80,160,320,640,1280").split(",")]
+STATIC_IMAGE_FORMATS = os.environ.get("STATIC_IMAGE_FORMATS", "avif,webp").split(",")
 
 # OpenRouter API Configuration
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "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")
+
+# Chatbot reply cache, keyed on the normalized question + system prompt + model.
+# "django" = the "chat" CACHES alias below, "local" = per-process LRU, "none" = disabled
+CHAT_CACHE_BACKEND = os.environ.get("CHAT_CACHE_BACKEND", "django")
+CHAT_CACHE_ALIAS = os.environ.get("CHAT_CACHE_ALIAS", "chat")
+CHAT_CACHE_MAX_ENTRIES = int(os.environ.get("CHAT_CACHE_MAX_ENTRIES", 2048))
+CHAT_CACHE_TTL = int(os.environ.get("CHAT_CACHE_TTL", 24 * 60 * 60))
+
+# Prediction cache keyed on (SHA-256 of image, category).
+# "local" = per-process LRU, "django" = the "predictions" CACHES alias below (shared by
+# workers only with REDIS_URL set; a LocMem alias logs a warning), "none" = disabled
+PREDICTION_CACHE_BACKEND = os.environ.get("PREDICTION_CACHE_BACKEND", "local")
+PREDICTION_CACHE_ALIAS = os.environ.get("PREDICTION_CACHE_ALIAS", "predictions")
+PREDICTION_CACHE_MAX_ENTRIES = int(os.environ.get("PREDICTION_CACHE_MAX_ENTRIES", 1024))
+PREDICTION_CACHE_TTL = int(os.environ.get("PREDICTION_CACHE_TTL", 24 * 60 * 60))
+
+# Set REDIS_URL (e.g. redis://localhost:6379/1) to share the chat and prediction caches
+# between workers; configure Redis with maxmemory-policy allkeys-lru to bound it.
+REDIS_URL = os.environ.get("REDIS_URL", "")
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "chat": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL,
+        "TIMEOUT": CHAT_CACHE_TTL,
+    } if REDIS_URL else {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "luffa-chat",
+        "TIMEOUT": CHAT_CACHE_TTL,
+        "OPTIONS": {"MAX_ENTRIES": CHAT_CACHE_MAX_ENTRIES},
+    },
+    "predictions": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL,
+        "TIMEOUT": PREDICTION_CACHE_TTL,
+    } if REDIS_URL else {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "luffa-predictions",
+        "TIMEOUT": PREDICTION_CACHE_TTL,
+        "OPTIONS": {"MAX_ENTRIES": PREDICTION_CACHE_MAX_ENTRIES},
+    },
+    # Rate-limit buckets: shared by all workers with Redis, per process otherwise
+    "ratelimit": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL,
+    } if REDIS_URL else {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "luffa-ratelimit",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+
+# Token-bucket rate limits for POSTs to /predict/ (with batch and jobs; a batch
+# takes one token per image) and /chat/api/, as "<tokens>/<s|m|h|d>": the bucket
+# holds that many tokens and refills over the period. "client" applies per IP,
+# "key" per X-API-Key listed in RATE_LIMIT_API_KEYS, "global" to everyone
+# together; an empty rate turns that bucket off. Over-limit requests get 429.
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "True").lower() == "true"
+RATE_LIMIT_CACHE_ALIAS = os.environ.get("RATE_LIMIT_CACHE_ALIAS", "ratelimit")
+RATE_LIMITS = {
+    "predict": {
+        "client": os.environ.get("RATE_LIMIT_PREDICT", "60/m"),
+        "key": os.environ.get("RATE_LIMIT_PREDICT_KEY", "600/m"),
+        "global": os.environ.get("RATE_LIMIT_PREDICT_GLOBAL", "1200/m"),
+    },
+    "chat": {
+        "client": os.environ.get("RATE_LIMIT_CHAT", "20/m"),
+        "key": os.environ.get("RATE_LIMIT_CHAT_KEY", "200/m"),
+        "global": os.environ.get("RATE_LIMIT_CHAT_GLOBAL", "300/m"),
+    },
+}
+RATE_LIMIT_API_KEYS = [key.strip() for key in os.environ.get("RATE_LIMIT_API_KEYS", "").split(",") if key.strip()]
+# Proxies in front of the app that append to X-Forwarded-For (0 = use REMOTE_ADDR). On
+# Render (which sets RENDER=true) every request comes through its proxy, so REMOTE_ADDR
+# is the proxy's and all users would share one bucket; default to one proxy there.
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get("RATE_LIMIT_TRUSTED_PROXIES", 1 if os.environ.get("RENDER") else 0))
+# Per-process caps on upstream calls in flight (0 = no cap); calls over the cap get
+# 503 with Retry-After: UPSTREAM_BUSY_RETRY_AFTER seconds
+HF_MAX_IN_FLIGHT = int(os.environ.get("HF_MAX_IN_FLIGHT", 128))
+OPENROUTER_MAX_IN_FLIGHT = int(os.environ.get("OPENROUTER_MAX_IN_FLIGHT", 32))
+UPSTREAM_BUSY_RETRY_AFTER = int(os.environ.get("UPSTREAM_BUSY_RETRY_AFTER", 1))
+
+# Hugging Face Space prediction API
+HF_API_BASE = os.environ.get("HF_API_BASE", "https://Abid1012-luffa-disease-api.hf.space/predict/image")
+HF_POOL_SIZE = int(os.environ.get("HF_POOL_SIZE", 10))
+HF_CONNECT_TIMEOUT = float(os.environ.get("HF_CONNECT_TIMEOUT", 3.05))
+HF_READ_TIMEOUT = float(os.environ.get("HF_READ_TIMEOUT", 60))
+HF_MAX_RETRIES = int(os.environ.get("HF_MAX_RETRIES", 2))
+HF_BACKOFF_BASE = float(os.environ.get("HF_BACKOFF_BASE", 0.5))
+HF_BACKOFF_MAX = float(os.environ.get("HF_BACKOFF_MAX", 8))
+# Circuit breaker around the Space: opens when, among the last WINDOW_SIZE calls within
+# WINDOW_SECONDS (at least MIN_CALLS), FAILURE_RATIO failed (connection error, 5xx, 429) or
+# SLOW_RATIO took over SLOW_CALL_MS. While open, predictions fail fast with 503 + Retry-After;
+# after OPEN_SECONDS one probe call decides whether it closes again.
+HF_BREAKER_ENABLED = os.environ.get("HF_BREAKER_ENABLED", "True").lower() == "true"
+HF_BREAKER_WINDOW_SIZE = int(os.environ.get("HF_BREAKER_WINDOW_SIZE", 20))
+HF_BREAKER_WINDOW_SECONDS = float(os.environ.get("HF_BREAKER_WINDOW_SECONDS", 60))
+HF_BREAKER_MIN_CALLS = int(os.environ.get("HF_BREAKER_MIN_CALLS", 10))
+HF_BREAKER_FAILURE_RATIO = float(os.environ.get("HF_BREAKER_FAILURE_RATIO", 0.5))
+HF_BREAKER_SLOW_CALL_MS = float(os.environ.get("HF_BREAKER_SLOW_CALL_MS", 30000))
+HF_BREAKER_SLOW_RATIO = float(os.environ.get("HF_BREAKER_SLOW_RATIO", 0.8))
+HF_BREAKER_OPEN_SECONDS = float(os.environ.get("HF_BREAKER_OPEN_SECONDS", 30))
+# Hedged requests: when a call has not answered by the observed PERCENTILE latency (at
+# least MIN_DELAY_MS), send a second one and use whichever succeeds first. At most
+# MAX_RATIO of calls are hedged. Sync calls race on a pool of WORKERS threads (room for
+# HF_POOL_SIZE calls plus their hedges); while all are busy a call runs unhedged in its own thread.
+HF_HEDGE_ENABLED = os.environ.get("HF_HEDGE_ENABLED", "False").lower() == "true"
+HF_HEDGE_PERCENTILE = float(os.environ.get("HF_HEDGE_PERCENTILE", 95))
+HF_HEDGE_MIN_DELAY_MS = float(os.environ.get("HF_HEDGE_MIN_DELAY_MS", 50))
+HF_HEDGE_MAX_RATIO = float(os.environ.get("HF_HEDGE_MAX_RATIO", 0.1))
+HF_HEDGE_WORKERS = int(os.environ.get("HF_HEDGE_WORKERS", HF_POOL_SIZE + 2))
+# Connection cap for the async client used by the ASGI views
+HF_ASYNC_MAX_CONNECTIONS = int(os.environ.get("HF_ASYNC_MAX_CONNECTIONS", 100))
+
+# Prediction backend per category: "remote" (the Hugging Face Space) or "local"
+# (in-process NumPy reference model, no network; see `manage.py train_reference_model`).
+PREDICTION_BACKEND = os.environ.get("PREDICTION_BACKEND", "remote")
+PREDICTION_BACKENDS = {
+    "Smooth": os.environ.get("PREDICTION_BACKEND_SMOOTH", PREDICTION_BACKEND),
+    "Spoonge": os.environ.get("PREDICTION_BACKEND_SPOONGE", PREDICTION_BACKEND),
+}
+# Decoded dataset images for `manage.py evaluate` (built by `manage.py build_dataset_cache`)
+DATASET_CACHE_DIR = os.environ.get("DATASET_CACHE_DIR", str(BASE_DIR / "dataset_cache"))
+# Holds one <category>.npz model per category
+PREDICTION_LOCAL_MODEL_DIR = os.environ.get("PREDICTION_LOCAL_MODEL_DIR", str(BASE_DIR / "prediction" / "reference_models"))
+# Local inference micro-batching: one forward pass per category for up to MAX_BATCH_SIZE
+# images or MAX_WAIT_MS. Beyond QUEUE_DEPTH waiting images requests get 503 + Retry-After.
+PREDICTION_LOCAL_MAX_BATCH_SIZE = int(os.environ.get("PREDICTION_LOCAL_MAX_BATCH_SIZE", 16))
+PREDICTION_LOCAL_MAX_WAIT_MS = float(os.environ.get("PREDICTION_LOCAL_MAX_WAIT_MS", 5))
+PREDICTION_LOCAL_QUEUE_DEPTH = int(os.environ.get("PREDICTION_LOCAL_QUEUE_DEPTH", 64))
+PREDICTION_LOCAL_RETRY_AFTER = int(os.environ.get("PREDICTION_LOCAL_RETRY_AFTER", 1))
+
+# model_type used when a request sends none: "Smooth", "Spoonge" or "auto" (ask
+# both models concurrently and keep the more confident answer).
+PREDICTION_DEFAULT_MODEL_TYPE = os.environ.get("PREDICTION_DEFAULT_MODEL_TYPE", "Smooth")
+# Threads running the second category of sync model_type=auto requests
+PREDICTION_AUTO_WORKERS = int(os.environ.get("PREDICTION_AUTO_WORKERS", 16))
+# Leaf-type model deciding auto requests when the backends return no confidence;
+# defaults to leaf_type.npz in PREDICTION_LOCAL_MODEL_DIR
+PREDICTION_LEAF_TYPE_MODEL = os.environ.get("PREDICTION_LEAF_TYPE_MODEL", "")
+
+# Pre-upload normalization: reject non-images by magic bytes, then apply EXIF
+# orientation, downscale to MAX_SIDE (JPEG draft mode) and re-encode at QUALITY
+# before a cache miss is sent to the Space (the model itself works at 224x224).
+PREDICTION_NORMALIZE_ENABLED = os.environ.get("PREDICTION_NORMALIZE_ENABLED", "True").lower() == "true"
+PREDICTION_NORMALIZE_MAX_SIDE = int(os.environ.get("PREDICTION_NORMALIZE_MAX_SIDE", 512))
+PREDICTION_NORMALIZE_QUALITY = int(os.environ.get("PREDICTION_NORMALIZE_QUALITY", 90))
+
+# Perceptual-hash near-duplicate lookup (phash or dhash), searched after an exact cache miss.
+# See `manage.py bench_phash` for recall / false-match rates per distance.
+PREDICTION_PHASH_ENABLED = os.environ.get("PREDICTION_PHASH_ENABLED", "True").lower() == "true"
+PREDICTION_PHASH_ALGORITHM = os.environ.get("PREDICTION_PHASH_ALGORITHM", "phash")
+PREDICTION_PHASH_MAX_DISTANCE = int(os.environ.get("PREDICTION_PHASH_MAX_DISTANCE", 4))
+PREDICTION_PHASH_MAX_ENTRIES = int(os.environ.get("PREDICTION_PHASH_MAX_ENTRIES", 4096))
+
+# Single-flight: identical (image, category) cache misses that are in flight at the same
+# time share one backend call within each process. Set LOCK_DIR (e.g. /tmp/luffa-singleflight)
+# on multi-worker deploys to also coalesce across gunicorn workers with flock files; this
+# costs a lock file open per miss and a result file per call. A worker waits up to WAIT
+# seconds for another's call.
+PREDICTION_SINGLEFLIGHT_ENABLED = os.environ.get("PREDICTION_SINGLEFLIGHT_ENABLED", "True").lower() == "true"
+PREDICTION_SINGLEFLIGHT_LOCK_DIR = os.environ.get("PREDICTION_SINGLEFLIGHT_LOCK_DIR", "")
+PREDICTION_SINGLEFLIGHT_WAIT = float(os.environ.get("PREDICTION_SINGLEFLIGHT_WAIT", 120))
+
+# Batch prediction endpoint (/predict/batch/)
+PREDICTION_BATCH_MAX_IMAGES = int(os.environ.get("PREDICTION_BATCH_MAX_IMAGES", 50))
+PREDICTION_BATCH_CONCURRENCY = int(os.environ.get("PREDICTION_BATCH_CONCURRENCY", 8))
+# Threads shared by all batch requests; each request uses at most BATCH_CONCURRENCY of them
+PREDICTION_BATCH_WORKERS = int(os.environ.get("PREDICTION_BATCH_WORKERS", 32))
+
+# Warm the chat client, prediction backends and caches in a background thread when a
+# WSGI / ASGI worker starts; /readyz answers 503 until it is done. Off = load on first use.
+PREDICTION_WARMUP = os.environ.get("PREDICTION_WARMUP", "True").lower() == "true"
+
+# Prediction jobs (/predict/jobs/): uploads are queued in the PredictionJob table and run by
+# WORKERS threads per web process (0 = only by `manage.py run_prediction_jobs`). Upstream
+# 5xx are retried up to MAX_ATTEMPTS with RETRY_DELAY doubling; RUNNING jobs older than
+# STALE_AFTER seconds are requeued when a pool starts.
+PREDICTION_JOBS_WORKERS = int(os.environ.get("PREDICTION_JOBS_WORKERS", 2))
+PREDICTION_JOBS_POLL_INTERVAL = float(os.environ.get("PREDICTION_JOBS_POLL_INTERVAL", 1.0))
+PREDICTION_JOBS_MAX_ATTEMPTS = int(os.environ.get("PREDICTION_JOBS_MAX_ATTEMPTS", 3))
+PREDICTION_JOBS_RETRY_DELAY = float(os.environ.get("PREDICTION_JOBS_RETRY_DELAY", 5))
+PREDICTION_JOBS_STALE_AFTER = int(os.environ.get("PREDICTION_JOBS_STALE_AFTER", 600))
+PREDICTION_JOBS_CALLBACK_TIMEOUT = float(os.environ.get("PREDICTION_JOBS_CALLBACK_TIMEOUT", 10))
+PREDICTION_JOBS_CALLBACK_RETRIES = int(os.environ.get("PREDICTION_JOBS_CALLBACK_RETRIES", 2))
+# Hosts callback_url may point at (comma-separated; ".example.com" matches subdomains).
+# Empty disables callbacks, so the server never POSTs to addresses chosen by a caller.
+PREDICTION_JOBS_CALLBACK_HOSTS = [host for host in os.environ.get("PREDICTION_JOBS_CALLBACK_HOSTS", "").split(",") if host]
+
+# Prediction history: every answered prediction is buffered in memory and written to the
+# Prediction table (plus hourly PredictionRollup counts) by a background thread, in batches of
+# BATCH_SIZE or every FLUSH_INTERVAL seconds. At most MAX_PENDING records wait while the DB is down.
+PREDICTION_HISTORY_ENABLED = os.environ.get("PREDICTION_HISTORY_ENABLED", "True").lower() == "true"
+PREDICTION_HISTORY_BATCH_SIZE = int(os.environ.get("PREDICTION_HISTORY_BATCH_SIZE", 200))
+PREDICTION_HISTORY_FLUSH_INTERVAL = float(os.environ.get("PREDICTION_HISTORY_FLUSH_INTERVAL", 5.0))
+PREDICTION_HISTORY_MAX_PENDING = int(os.environ.get("PREDICTION_HISTORY_MAX_PENDING", 10000))
+
+# Disease info comes from an in-memory catalog (LuffaDisease rows over built-in defaults).
+# Edits are picked up at once by the process that saved them, and by the others within
+# CHECK_INTERVAL seconds (one version-stamp query per interval).
+DISEASE_CATALOG_CHECK_INTERVAL = float(os.environ.get("DISEASE_CATALOG_CHECK_INTERVAL", 30))
+
+# Prometheus metrics at /metrics (per process). Request counts and latencies are
+# recorded by prediction.middleware.metrics_middleware; off = no middleware and a 404.
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "True").lower() == "true"
+
+# Serve /predict/ and /chat/api/ with native async views. Enable together with an
+# ASGI server: gunicorn luffa_prediction.asgi:application -k uvicorn_worker.UvicornWorker
+ASYNC_VIEWS = os.environ.get("ASYNC_VIEWS", "False").lower() == "true"
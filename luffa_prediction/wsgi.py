@@ -5,3 +5,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'luffa_prediction.settings')
 
 application = get_wsgi_application()
+
+# Load clients and models in the background so the worker accepts requests
+# immediately; /readyz reports when warm-up is done (see PREDICTION_WARMUP)
+from prediction.warmup import start_warmup  # noqa: E402
+
+start_warmup()
@@ -0,0 +1,36 @@
+from django.contrib import admin
+
+from .models import LuffaDisease, Prediction, PredictionJob, PredictionRollup
+
+
+@admin.register(LuffaDisease)
+class LuffaDiseaseAdmin(admin.ModelAdmin):
+    # Saving or deleting reloads the disease catalog (prediction/catalog.py)
+    list_display = ('disease_name', 'category', 'updated_at')
+    list_filter = ('category',)
+    search_fields = ('disease_name', 'info')
+
+
+@admin.register(PredictionJob)
+class PredictionJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'category', 'status', 'attempts', 'callback_status', 'created_at', 'finished_at')
+    list_filter = ('status', 'category')
+    readonly_fields = ('id', 'created_at', 'started_at', 'finished_at')
+    exclude = ('image',)
+
+
+@admin.register(Prediction)
+class PredictionAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'category', 'disease', 'cache_status', 'latency_ms')
+    list_filter = ('category', 'disease', 'cache_status')
+    search_fields = ('image_hash',)
+    date_hierarchy = 'created_at'
+    # Counting a large history table on every page load is itself a full scan
+    show_full_result_count = False
+
+
+@admin.register(PredictionRollup)
+class PredictionRollupAdmin(admin.ModelAdmin):
+    list_display = ('hour', 'category', 'disease', 'count', 'cache_hits', 'average_latency_ms')
+    list_filter = ('category', 'disease')
+    date_hierarchy = 'hour'
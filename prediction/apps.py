@@ -6,5 +6,8 @@ class PredictionConfig(AppConfig):
     name = 'prediction'
 
     def ready(self):
-        # No model preloading needed since using external API
-        print("✅ Using Hugging Face API for predictions")
+        # Models are loaded lazily by the local backend on first use
+        from django.conf import settings
+        for category, backend in settings.PREDICTION_BACKENDS.items():
+            source = "Hugging Face API" if backend == "remote" else f"{backend} model"
+            print(f"✅ Using {source} for {category} predictions")
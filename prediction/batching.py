@@ -0,0 +1,92 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# ====================================================
+# Micro-batching
+# ====================================================
+# Callers submit one item each and get a Future back; a worker thread gathers
+# items for up to ``max_wait_ms`` or ``max_batch_size`` items, makes one
+# ``run_batch`` call and resolves every caller's future. Sync views block on
+# ``future.result()``, async views await ``asyncio.wrap_future(future)``.
+_STOP = object()
+
+
+class Overloaded(Exception):
+    """Raised by ``submit`` when the queue already holds ``max_queue`` items."""
+
+
+class MicroBatcher:
+    def __init__(self, run_batch, max_batch_size=16, max_wait_ms=5, max_queue=64, name="micro-batcher"):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Queue ``item``; the returned Future resolves to its entry of ``run_batch``'s result."""
+        future = Future()
+        try:
+            self._queue.put_nowait((item, future))
+        except queue.Full:
+            raise Overloaded(f"{self.name} queue is full ({self.max_queue} waiting)")
+        return future
+
+    def close(self):
+        """Stop the worker after the items already queued have run."""
+        self._queue.put(_STOP)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize(),
+        }
+
+    def _loop(self):
+        while True:
+            entry = self._queue.get()
+            if entry is _STOP:
+                return
+            batch = [entry]
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    entry = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stop = True
+                    break
+                batch.append(entry)
+            self._run(batch)
+            if stop:
+                return
+
+    def _run(self, batch):
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+        self.batches += 1
+        self.items += len(items)
+        try:
+            results = self.run_batch(items)
+        except Exception as e:
+            logger.error(f"{self.name}: batch of {len(items)} failed: {e}")
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            future.set_result(result)
@@ -0,0 +1,228 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# ====================================================
+# Prediction and Chat Caches
+# ====================================================
+# Predictions are keyed on (SHA-256 of the image bytes, category); chatbot
+# replies on the normalized question, system prompt and model. The "local"
+# backend is an in-process LRU with TTL; the "django" backend goes through
+# Django's cache framework so gunicorn workers can share entries (size bounds
+# then come from the cache's own MAX_ENTRIES / maxmemory policy).
+
+
+class LocalLRUBackend:
+    def __init__(self, max_entries=1024, ttl=86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DjangoCacheBackend:
+    def __init__(self, alias="default", ttl=86400):
+        self.alias = alias
+        self.cache = caches[alias]
+        self.ttl = ttl
+        # A LocMem alias is per process, like the "local" backend
+        self.local_cache = isinstance(self.cache, LocMemCache)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.ttl)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class NullBackend:
+    """Backend that never stores anything (``*_CACHE_BACKEND = "none"``)."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+
+def build_backend(backend, alias, max_entries, ttl, setting):
+    if backend == 'local':
+        return LocalLRUBackend(max_entries, ttl)
+    if backend == 'django':
+        return DjangoCacheBackend(alias, ttl)
+    if backend == 'none':
+        return NullBackend()
+    raise ValueError(f"Unknown {setting}: {backend!r}")
+
+
+class CountingCache:
+    """Cache front-end that counts hits and misses."""
+
+    def __init__(self, backend, prefix):
+        self.backend = backend
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        value = self.backend.get(key)
+        # Counter updates are not locked; an occasional lost increment is
+        # acceptable for statistics.
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def store(self, key, value):
+        self.backend.set(key, value)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class PredictionCache(CountingCache):
+    def __init__(self, backend, prefix="prediction"):
+        super().__init__(backend, prefix)
+
+    def key(self, digest, category):
+        return f"{self.prefix}:{category}:{digest}"
+
+    def get(self, digest, category):
+        return self.lookup(self.key(digest, category))
+
+    def set(self, digest, category, value):
+        self.store(self.key(digest, category), value)
+
+
+def normalize_message(message):
+    """Case- and whitespace-insensitive form of a chat question ("How  do I...?" == "how do i...")."""
+    return " ".join(message.casefold().split()).rstrip("?!. ")
+
+
+class ChatCache(CountingCache):
+    """Chatbot replies keyed on the normalized message, system prompt and model."""
+
+    def __init__(self, backend, prefix="chat"):
+        super().__init__(backend, prefix)
+
+    def key(self, message, system_prompt, model):
+        material = "\0".join((model, system_prompt, normalize_message(message)))
+        return f"{self.prefix}:{hashlib.sha256(material.encode()).hexdigest()}"
+
+    def get(self, message, system_prompt, model):
+        return self.lookup(self.key(message, system_prompt, model))
+
+    def set(self, message, system_prompt, model, reply):
+        self.store(self.key(message, system_prompt, model), reply)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def build_prediction_cache():
+    backend = build_backend(
+        getattr(settings, 'PREDICTION_CACHE_BACKEND', 'local'),
+        getattr(settings, 'PREDICTION_CACHE_ALIAS', 'predictions'),
+        getattr(settings, 'PREDICTION_CACHE_MAX_ENTRIES', 1024),
+        getattr(settings, 'PREDICTION_CACHE_TTL', 86400),
+        'PREDICTION_CACHE_BACKEND',
+    )
+    if getattr(backend, 'local_cache', False):
+        logger.warning(f"PREDICTION_CACHE_BACKEND=django uses the {backend.alias!r} cache alias, which is a "
+                       f"per-process LocMemCache: workers will not share predictions (set REDIS_URL)")
+    return PredictionCache(backend)
+
+
+def get_prediction_cache():
+    """Return the process-wide ``PredictionCache`` configured from settings."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = build_prediction_cache()
+    return _cache
+
+
+@receiver(setting_changed)
+def _reset_prediction_cache(setting, **kwargs):
+    global _cache
+    if setting.startswith('PREDICTION_CACHE'):
+        _cache = None
+
+
+_chat_cache = None
+
+
+def get_chat_cache():
+    """Return the process-wide ``ChatCache`` configured from settings."""
+    global _chat_cache
+    if _chat_cache is None:
+        with _cache_lock:
+            if _chat_cache is None:
+                _chat_cache = ChatCache(build_backend(
+                    getattr(settings, 'CHAT_CACHE_BACKEND', 'django'),
+                    getattr(settings, 'CHAT_CACHE_ALIAS', 'chat'),
+                    getattr(settings, 'CHAT_CACHE_MAX_ENTRIES', 2048),
+                    getattr(settings, 'CHAT_CACHE_TTL', 86400),
+                    'CHAT_CACHE_BACKEND',
+                ))
+    return _chat_cache
+
+
+@receiver(setting_changed)
+def _reset_chat_cache(setting, **kwargs):
+    global _chat_cache
+    if setting.startswith('CHAT_CACHE') or setting == 'CACHES':
+        _chat_cache = None
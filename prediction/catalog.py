@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DatabaseError, transaction
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import LuffaDisease
+
+logger = logging.getLogger(__name__)
+
+# ====================================================
+# Disease Catalog
+# ====================================================
+# Disease names, per-category class lists and info text, loaded once per
+# process into an immutable snapshot so a prediction's lookup costs no query.
+# LuffaDisease rows (editable in the admin) override the built-in defaults
+# below. Saving or deleting a row drops this process's snapshot at once; other
+# processes compare a version stamp (row count and latest update) at most every
+# DISEASE_CATALOG_CHECK_INTERVAL seconds and reload when it has changed.
+DiseaseEntry = namedtuple("DiseaseEntry", "name category info")
+
+UNKNOWN_INFO = "No info available."
+
+# category "" = predicted for both luffa types
+DEFAULT_DISEASES = (
+    DiseaseEntry("Alternaria", "Smooth", "Alternaria leaf spot is a fungal disease that causes dark spots on leaves. It thrives in warm, humid conditions."),
+    DiseaseEntry("Angular Spot", "Smooth", "Angular leaf spot is a bacterial disease causing angular water-soaked lesions on leaves."),
+    DiseaseEntry("Fresh", "", "The leaf appears healthy and fresh with no visible signs of disease."),
+    DiseaseEntry("Holed", "Smooth", "Holes in leaves may be caused by insect damage or physical injury."),
+    DiseaseEntry("Mosaic Virus", "Smooth", "Mosaic virus causes mottled patterns on leaves and can stunt plant growth."),
+    DiseaseEntry("Others", "", "Other unidentified diseases or conditions affecting the plant."),
+    DiseaseEntry("Bacteria Leaf Spot", "Spoonge", "Bacterial leaf spot causes small, dark lesions on leaves that may have a yellow halo."),
+    DiseaseEntry("Downy Mildew", "Spoonge", "Downy mildew is a fungal disease that appears as white or gray patches on the underside of leaves."),
+    DiseaseEntry("Insect", "Spoonge", "Signs of insect damage such as holes, chewing marks, or discoloration."),
+    DiseaseEntry("Mosaic disease", "Spoonge", "Mosaic disease causes irregular patterns and discoloration on leaves."),
+)
+
+
+class DiseaseCatalog:
+    """An immutable snapshot of the disease records."""
+
+    def __init__(self, entries, version=None):
+        self.entries = MappingProxyType({entry.name: entry for entry in entries})
+        self.version = version
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def info(self, name):
+        entry = self.entries.get(name)
+        return entry.info if entry is not None else UNKNOWN_INFO
+
+    def classes(self, category=None):
+        """Sorted disease names, optionally only those predicted for ``category``."""
+        return tuple(sorted(name for name, entry in self.entries.items()
+                            if category is None or entry.category in ("", category)))
+
+
+def catalog_version():
+    """The stamp other processes compare to notice admin edits; ``None`` when the table can't be read."""
+    try:
+        stamp = LuffaDisease.objects.aggregate(count=Count("id"), updated=Max("updated_at"))
+    except DatabaseError as e:
+        logger.warning(f"Could not read the disease catalog version: {e}")
+        return None
+    return stamp["count"], stamp["updated"]
+
+
+def load_catalog(version=None):
+    entries = {entry.name: entry for entry in DEFAULT_DISEASES}
+    try:
+        for name, category, info in LuffaDisease.objects.values_list("disease_name", "category", "info"):
+            entries[name] = DiseaseEntry(name, category, info)
+    except DatabaseError as e:
+        # e.g. migrations not applied yet: serve the defaults and retry at the next check
+        logger.warning(f"Could not load the disease catalog, using the built-in defaults: {e}")
+        version = None
+    logger.info(f"Loaded disease catalog: {len(entries)} diseases")
+    return DiseaseCatalog(entries.values(), version)
+
+
+_catalog = None
+_checked_at = 0.0
+_catalog_lock = threading.Lock()
+
+
+def _fresh_catalog():
+    catalog = _catalog
+    if catalog is not None and time.monotonic() - _checked_at < settings.DISEASE_CATALOG_CHECK_INTERVAL:
+        return catalog
+    return None
+
+
+def get_disease_catalog():
+    """Return the process-wide ``DiseaseCatalog``; runs at most one query per check interval."""
+    global _catalog, _checked_at
+    catalog = _fresh_catalog()
+    if catalog is not None:
+        return catalog
+    with _catalog_lock:
+        catalog = _fresh_catalog()
+        if catalog is None:
+            version = catalog_version()
+            catalog = _catalog
+            if catalog is None or version is None or version != catalog.version:
+                catalog = _catalog = load_catalog(version)
+            _checked_at = time.monotonic()
+    return catalog
+
+
+async def aget_disease_catalog():
+    """Async ``get_disease_catalog``: only leaves the event loop when a check is due."""
+    catalog = _fresh_catalog()
+    if catalog is not None:
+        return catalog
+    # Thread-sensitive: the query then runs on the request's sync thread, whose
+    # connection Django closes at the end of the request
+    return await sync_to_async(get_disease_catalog)()
+
+
+@receiver(post_save, sender=LuffaDisease)
+@receiver(post_delete, sender=LuffaDisease)
+def _reset_disease_catalog(**kwargs):
+    # After commit, so a reload in another thread can't read the row before the edit lands
+    transaction.on_commit(clear_disease_catalog)
+
+
+def clear_disease_catalog():
+    global _catalog
+    _catalog = None
+
+
+@receiver(setting_changed)
+def _reset_catalog_interval(setting, **kwargs):
+    if setting.startswith('DISEASE_CATALOG'):
+        clear_disease_catalog()
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import threading
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .cache import get_chat_cache
+from .metrics import CHAT_REPLIES, STAGE_SECONDS, UPSTREAM_SECONDS
+from .plaintext import MarkdownStripper, remove_markdown
+from .ratelimit import get_inflight_limiter
+
+logger = logging.getLogger(__name__)
+
+# ====================================================
+# OpenRouter Chat Configuration
+# ====================================================
+# One OpenAI client (and so one keep-alive connection pool) per process, and
+# replies cached on the normalized question so repeated FAQs skip the LLM.
+# ``openai`` is imported when the first client is built (or by the warm-up
+# thread): it accounts for most of the app's import time.
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+CHAT_MODEL = "deepseek/deepseek-r1-0528:free"
+CHAT_SYSTEM_PROMPT = "You are a specialized assistant for Luffa plant information. You can only provide information about Luffa plants, their cultivation, diseases, health, and related topics. If the user asks about anything else, politely decline and redirect the conversation back to Luffa plants. Always respond in plain text without using markdown formatting, bold text, italics, or special characters like emojis."
+
+def chat_messages(user_message):
+    return [
+        {
+            "role": "system",
+            "content": CHAT_SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": user_message
+        }
+    ]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_chat_client():
+    """Return the process-wide ``openai.OpenAI`` client for OpenRouter."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import openai
+                _client = openai.OpenAI(
+                    api_key=settings.OPENROUTER_API_KEY,
+                    base_url=OPENROUTER_BASE_URL
+                )
+    return _client
+
+
+# Like the HF async client, AsyncOpenAI's connection pool is tied to one event loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_chat_client():
+    """Return the ``openai.AsyncOpenAI`` client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        import openai
+        client = _async_clients[loop] = openai.AsyncOpenAI(
+            api_key=settings.OPENROUTER_API_KEY,
+            base_url=OPENROUTER_BASE_URL
+        )
+    return client
+
+
+@receiver(setting_changed)
+def _reset_chat_client(setting, **kwargs):
+    global _client
+    if setting.startswith('OPENROUTER_'):
+        _client = None
+        _async_clients.clear()
+
+
+# ====================================================
+# Cached Completions
+# ====================================================
+def cached_reply(user_message):
+    """Return the cached plain-text reply for ``user_message``, or ``None``."""
+    chat_cache = get_chat_cache()
+    reply = chat_cache.get(user_message, CHAT_SYSTEM_PROMPT, CHAT_MODEL)
+    stats = chat_cache.stats()
+    logger.info(f"Chat cache {'hit' if reply is not None else 'miss'}: "
+                f"hit_rate={stats['hit_rate']:.1%} ({stats['hits']}/{stats['hits'] + stats['misses']})")
+    return reply
+
+
+def store_reply(user_message, reply):
+    if reply:
+        get_chat_cache().set(user_message, CHAT_SYSTEM_PROMPT, CHAT_MODEL, reply)
+
+
+def complete_chat(user_message):
+    """Return ``(reply, cache_status)`` with markdown removed; cache_status is HIT or MISS."""
+    reply = cached_reply(user_message)
+    if reply is not None:
+        CHAT_REPLIES.inc("HIT", "complete")
+        return reply, "HIT"
+    # Raises ``Saturated`` when OPENROUTER_MAX_IN_FLIGHT calls are already running
+    with get_inflight_limiter("openrouter"), UPSTREAM_SECONDS.time_outcome("openrouter"):
+        response = get_chat_client().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=chat_messages(user_message),
+            stream=False
+        )
+    reply = remove_markdown(response.choices[0].message.content)
+    store_reply(user_message, reply)
+    CHAT_REPLIES.inc("MISS", "complete")
+    return reply, "MISS"
+
+
+async def acomplete_chat(user_message):
+    reply = await sync_to_async(cached_reply, thread_sensitive=False)(user_message)
+    if reply is not None:
+        CHAT_REPLIES.inc("HIT", "complete")
+        return reply, "HIT"
+    # Raises ``Saturated`` when OPENROUTER_MAX_IN_FLIGHT calls are already running
+    with get_inflight_limiter("openrouter"), UPSTREAM_SECONDS.time_outcome("openrouter"):
+        response = await get_async_chat_client().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=chat_messages(user_message),
+            stream=False
+        )
+    reply = remove_markdown(response.choices[0].message.content)
+    await sync_to_async(store_reply, thread_sensitive=False)(user_message, reply)
+    CHAT_REPLIES.inc("MISS", "complete")
+    return reply, "MISS"
+
+
+def stream_chat(user_message):
+    """Yield plain-text pieces of the reply; a cached reply is yielded whole."""
+    reply = cached_reply(user_message)
+    if reply is not None:
+        CHAT_REPLIES.inc("HIT", "stream")
+        yield reply
+        return
+    stripper = MarkdownStripper()
+    pieces = []
+    with get_inflight_limiter("openrouter"), UPSTREAM_SECONDS.time_outcome("openrouter") as timer:
+        stream = get_chat_client().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=chat_messages(user_message),
+            stream=True
+        )
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            text = stripper.feed(delta) if delta else ""
+            if text:
+                if not pieces:
+                    STAGE_SECONDS.observe(time.perf_counter() - timer.start, "chat_first_token")
+                pieces.append(text)
+                yield text
+    text = stripper.flush()
+    if text:
+        pieces.append(text)
+        yield text
+    # Only completed streams reach this point, so partial replies are never cached
+    store_reply(user_message, "".join(pieces))
+    CHAT_REPLIES.inc("MISS", "stream")
+
+
+async def astream_chat(user_message):
+    reply = await sync_to_async(cached_reply, thread_sensitive=False)(user_message)
+    if reply is not None:
+        CHAT_REPLIES.inc("HIT", "stream")
+        yield reply
+        return
+    stripper = MarkdownStripper()
+    pieces = []
+    with get_inflight_limiter("openrouter"), UPSTREAM_SECONDS.time_outcome("openrouter") as timer:
+        stream = await get_async_chat_client().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=chat_messages(user_message),
+            stream=True
+        )
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            text = stripper.feed(delta) if delta else ""
+            if text:
+                if not pieces:
+                    STAGE_SECONDS.observe(time.perf_counter() - timer.start, "chat_first_token")
+                pieces.append(text)
+                yield text
+    text = stripper.flush()
+    if text:
+        pieces.append(text)
+        yield text
+    await sync_to_async(store_reply, thread_sensitive=False)(user_message, "".join(pieces))
+    CHAT_REPLIES.inc("MISS", "stream")
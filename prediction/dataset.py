@@ -0,0 +1,188 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+
+import numpy as np
+from django.conf import settings
+
+from .inference import IMAGE_SIZE, decode_image
+
+# ====================================================
+# Bundled Leaf Datasets
+# ====================================================
+# Folder layout: "<dataset dir>/<disease label>/<image>.jpg"
+DATASET_DIRS = {
+    'Smooth': 'Luffa Smooth',
+    'Spoonge': 'Luffa Spoonge',
+}
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def dataset_dir(category):
+    return os.path.join(settings.BASE_DIR, DATASET_DIRS[category])
+
+
+def iter_dataset(categories=None):
+    """Yield ``(path, category, label)`` for every bundled dataset image, sorted."""
+    for category in categories or DATASET_DIRS:
+        root = dataset_dir(category)
+        if not os.path.isdir(root):
+            continue
+        for label in sorted(os.listdir(root)):
+            label_dir = os.path.join(root, label)
+            if not os.path.isdir(label_dir):
+                continue
+            for name in sorted(os.listdir(label_dir)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(label_dir, name), category, label
+
+
+# ====================================================
+# Preprocessed Dataset Cache
+# ====================================================
+# `manage.py build_dataset_cache` decodes every dataset image once (EXIF
+# orientation applied, resized to 224×224) into one uint8 (N, 224, 224, 3)
+# array, images.npy, opened memory-mapped so evaluation and training read
+# pixels without decoding. index.json holds each row's path, category, label,
+# SHA-256 and file stat. A rebuild reuses rows whose file is unchanged (same
+# stat, or same content hash after a move) and only decodes the rest.
+CACHE_IMAGES = "images.npy"
+CACHE_INDEX = "index.json"
+CACHE_VERSION = 1
+IMAGE_SHAPE = (*IMAGE_SIZE, 3)
+
+
+def default_cache_dir():
+    return str(settings.DATASET_CACHE_DIR)
+
+
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _decode_file(path):
+    # Runs in the worker processes: needs PIL and NumPy, not a configured Django
+    with open(path, 'rb') as f:
+        return decode_image(f.read())
+
+
+class DatasetCache:
+    """A built cache: ``images`` is the read-only memmap, ``entries`` its index rows."""
+
+    def __init__(self, cache_dir, images, entries):
+        self.cache_dir = cache_dir
+        self.images = images
+        self.entries = entries
+        self.by_hash = {entry['sha256']: row for row, entry in enumerate(entries)}
+
+    @classmethod
+    def open(cls, cache_dir=None):
+        """Open the cache in ``cache_dir``; ``None`` when it is missing or incomplete."""
+        cache_dir = cache_dir or default_cache_dir()
+        try:
+            with open(os.path.join(cache_dir, CACHE_INDEX)) as f:
+                index = json.load(f)
+            images = np.load(os.path.join(cache_dir, CACHE_IMAGES), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if index.get('version') != CACHE_VERSION or images.shape[0] != len(index['entries']):
+            return None
+        return cls(cache_dir, images, index['entries'])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def rows(self, categories=None):
+        """Row numbers of the given categories' images, in index order."""
+        return [row for row, entry in enumerate(self.entries) if categories is None or entry['category'] in categories]
+
+    def batches(self, rows, batch_size=32):
+        """Yield ``(rows, uint8 array)`` chunks; only the chunk being read is paged in."""
+        for start in range(0, len(rows), batch_size):
+            chunk = rows[start:start + batch_size]
+            yield chunk, self.images[chunk]
+
+
+def build_dataset_cache(cache_dir=None, images=None, workers=None, force=False, progress=None):
+    """Decode the dataset into ``cache_dir``; returns ``(DatasetCache, stats)``.
+
+    ``images`` defaults to ``iter_dataset()``. Rows of an existing cache are
+    reused unless ``force``; the rest are decoded by a pool of ``workers``
+    processes. ``progress(done, total)`` is called as images are decoded.
+    """
+    cache_dir = cache_dir or default_cache_dir()
+    images = list(iter_dataset() if images is None else images)
+    old = None if force else DatasetCache.open(cache_dir)
+    old_by_path = {entry['path']: row for row, entry in enumerate(old.entries)} if old is not None else {}
+
+    entries, sources, pending = [], [], []
+    for path, category, label in images:
+        stat = os.stat(path)
+        entry = {'path': os.path.relpath(path, settings.BASE_DIR), 'category': category, 'label': label,
+                 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        row = old_by_path.get(entry['path'])
+        if row is not None and (old.entries[row]['size'], old.entries[row]['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            entry['sha256'] = old.entries[row]['sha256']
+        else:
+            entry['sha256'] = _file_hash(path)
+            row = old.by_hash.get(entry['sha256']) if old is not None else None
+        if row is None:
+            pending.append((len(entries), path))
+        entries.append(entry)
+        sources.append(row)
+
+    stats = {'images': len(entries), 'decoded': len(pending), 'reused': len(entries) - len(pending)}
+    if old is not None and not pending and sources == list(range(len(old))):
+        stats['rewritten'] = False
+        if entries != old.entries:
+            # Only file stats changed (e.g. a fresh checkout): refresh the index
+            _write_index(cache_dir, entries)
+        return DatasetCache.open(cache_dir), stats
+
+    os.makedirs(cache_dir, exist_ok=True)
+    images_path = os.path.join(cache_dir, CACHE_IMAGES)
+    temp_path = images_path + '.tmp.npy'
+    start = time.perf_counter()
+    array = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.uint8, shape=(len(entries), *IMAGE_SHAPE))
+    try:
+        for row, source in enumerate(sources):
+            if source is not None:
+                array[row] = old.images[source]
+        if pending:
+            with ExitStack() as stack:
+                paths = [path for _, path in pending]
+                if workers == 1:
+                    decoded = map(_decode_file, paths)
+                else:
+                    # spawn: the caller may be a threaded Django process, where fork is unsafe
+                    executor = stack.enter_context(ProcessPoolExecutor(
+                        max_workers=workers, mp_context=multiprocessing.get_context('spawn')))
+                    decoded = executor.map(_decode_file, paths, chunksize=16)
+                for done, ((row, _), pixels) in enumerate(zip(pending, decoded), 1):
+                    array[row] = pixels
+                    if progress is not None:
+                        progress(done, len(pending))
+        array.flush()
+    except BaseException:
+        del array
+        os.remove(temp_path)
+        raise
+    del array
+    old = None  # release the old memmap before replacing its file
+    os.replace(temp_path, images_path)
+    _write_index(cache_dir, entries)
+    stats.update(rewritten=True, seconds=round(time.perf_counter() - start, 2))
+    return DatasetCache.open(cache_dir), stats
+
+
+def _write_index(cache_dir, entries):
+    path = os.path.join(cache_dir, CACHE_INDEX)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'image_shape': list(IMAGE_SHAPE), 'entries': entries}, f)
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,196 @@
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Prediction, PredictionRollup
+
+logger = logging.getLogger(__name__)
+
+# ====================================================
+# Prediction History
+# ====================================================
+# Every answered prediction is appended to an in-memory buffer; a background
+# thread writes the buffer with one bulk_create when it reaches ``batch_size``
+# or every ``flush_interval`` seconds, so the request path never waits on the
+# database. Each flush also adds the batch to the hourly PredictionRollup rows
+# the summary view reads. Records are lost if the process is killed before a
+# flush; when the database is down, at most ``max_pending`` are kept.
+CACHED_STATUSES = ("HIT", "NEAR", "COALESCED")
+
+
+class HistoryRecorder:
+    def __init__(self, batch_size=200, flush_interval=5.0, max_pending=10000, name="prediction-history"):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.name = name
+        self.written = 0
+        self.dropped = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def record(self, image_hash, category, disease, cache_status, latency_ms):
+        """Queue one prediction; never touches the database."""
+        entry = Prediction(image_hash=image_hash, category=category, disease=disease, cache_status=cache_status,
+                           latency_ms=round(latency_ms, 3), created_at=timezone.now())
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(entry)
+            full = len(self._pending) >= self.batch_size
+        if self._thread is None:
+            self.start()
+        if full:
+            self._wake.set()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stop the thread and write whatever is still buffered."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def flush(self):
+        """Write the buffered predictions and update the rollups; returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                with transaction.atomic():
+                    Prediction.objects.bulk_create(batch, batch_size=500)
+                    update_rollups(batch)
+            except Exception as e:
+                logger.error(f"Could not write {len(batch)} prediction history records: {e}")
+                with self._lock:
+                    # Keep them for the next flush, oldest first, within max_pending
+                    keep = batch[:max(0, self.max_pending - len(self._pending))]
+                    self.dropped += len(batch) - len(keep)
+                    self._pending[:0] = keep
+                return 0
+            self.written += len(batch)
+            logger.info(f"Wrote {len(batch)} prediction history records")
+            return len(batch)
+
+    def _loop(self):
+        try:
+            while not self._stopping.is_set():
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+                close_old_connections()
+                self.flush()
+        finally:
+            connection.close()
+
+    def stats(self):
+        return {"pending": len(self._pending), "written": self.written, "dropped": self.dropped}
+
+
+def update_rollups(batch):
+    """Add a batch of ``Prediction`` rows to the hourly rollups (inside the caller's transaction)."""
+    totals = defaultdict(lambda: [0, 0, 0.0])
+    for entry in batch:
+        hour = entry.created_at.replace(minute=0, second=0, microsecond=0)
+        total = totals[(hour, entry.category, entry.disease)]
+        total[0] += 1
+        total[1] += entry.cache_status in CACHED_STATUSES
+        total[2] += entry.latency_ms
+    for (hour, category, disease), (count, cache_hits, latency_ms) in totals.items():
+        increment = {
+            "count": F("count") + count,
+            "cache_hits": F("cache_hits") + cache_hits,
+            "total_latency_ms": F("total_latency_ms") + latency_ms,
+        }
+        rows = PredictionRollup.objects.filter(hour=hour, category=category, disease=disease)
+        if rows.update(**increment):
+            continue
+        try:
+            with transaction.atomic():
+                PredictionRollup.objects.create(hour=hour, category=category, disease=disease, count=count,
+                                                cache_hits=cache_hits, total_latency_ms=latency_ms)
+        except IntegrityError:
+            # Another process created the row since our UPDATE
+            rows.update(**increment)
+
+
+def summarize(since, category=None):
+    """Prediction counts per disease and per day since ``since``, read from the rollups."""
+    rows = PredictionRollup.objects.filter(hour__gte=since)
+    if category:
+        rows = rows.filter(category=category)
+    diseases = list(rows.values("category", "disease")
+                    .annotate(count=Sum("count"), cache_hits=Sum("cache_hits"), latency_ms=Sum("total_latency_ms"))
+                    .order_by("-count", "category", "disease"))
+    days = rows.annotate(day=TruncDate("hour")).values("day").annotate(count=Sum("count")).order_by("day")
+    total = sum(row["count"] for row in diseases)
+    cache_hits = sum(row["cache_hits"] for row in diseases)
+    return {
+        "since": since.isoformat(),
+        "total": total,
+        "cache_hit_rate": round(cache_hits / total, 4) if total else 0.0,
+        "diseases": [
+            {
+                "category": row["category"],
+                "disease": row["disease"],
+                "count": row["count"],
+                "share": round(row["count"] / total, 4),
+                "avg_latency_ms": round(row["latency_ms"] / row["count"], 1),
+            }
+            for row in diseases
+        ],
+        "days": [{"day": row["day"].isoformat(), "count": row["count"]} for row in days],
+    }
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_history_recorder():
+    """Return the process-wide ``HistoryRecorder``, or ``None`` when PREDICTION_HISTORY_ENABLED is off."""
+    global _recorder
+    if not getattr(settings, 'PREDICTION_HISTORY_ENABLED', True):
+        return None
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = HistoryRecorder(
+                    batch_size=settings.PREDICTION_HISTORY_BATCH_SIZE,
+                    flush_interval=settings.PREDICTION_HISTORY_FLUSH_INTERVAL,
+                    max_pending=settings.PREDICTION_HISTORY_MAX_PENDING,
+                )
+                atexit.register(_recorder.stop, 5)
+    return _recorder
+
+
+@receiver(setting_changed)
+def _reset_history_recorder(setting, **kwargs):
+    global _recorder
+    if setting.startswith('PREDICTION_HISTORY'):
+        if _recorder is not None:
+            atexit.unregister(_recorder.stop)
+            _recorder.stop(timeout=5)
+        _recorder = None
@@ -0,0 +1,103 @@
+import io
+import logging
+import time
+
+from PIL import ExifTags, Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# ====================================================
+# Upload Normalization
+# ====================================================
+# Phone photos arrive as multi-megabyte JPEGs while the model behind the Space
+# works at 224×224. Before a cache miss goes upstream the upload is decoded
+# with JPEG draft mode (DCT-domain downscaling), rotated per its EXIF
+# orientation, reduced to PREDICTION_NORMALIZE_MAX_SIDE and re-encoded.
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+# ISO base media brands (bytes 8-12 after "ftyp") used by HEIC / AVIF photos
+HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"heim", b"heis", b"mif1", b"msf1", b"avif", b"avis"}
+
+
+def sniff_image_type(data):
+    """Return the image format named by the leading magic bytes, or ``None``."""
+    for signature, image_type in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return image_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[4:8] == b"ftyp" and data[8:12] in HEIF_BRANDS:
+        return "heif"
+    return None
+
+
+def normalize_image(data, max_side=512, quality=90):
+    """Downscale and re-encode an image for the prediction API.
+
+    Returns ``(data, content_type, timings)`` where ``timings`` maps stage name
+    to milliseconds. Images that are already small, upright JPEGs are returned
+    unchanged. Raises ``UnidentifiedImageError`` / ``OSError`` when Pillow
+    cannot decode the bytes.
+    """
+    timings = {}
+    start = time.perf_counter()
+
+    def lap(stage):
+        nonlocal start
+        now = time.perf_counter()
+        timings[stage] = (now - start) * 1000
+        start = now
+
+    image = Image.open(io.BytesIO(data))
+    orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+    if image.format == "JPEG" and max(image.size) <= max_side and orientation == 1:
+        lap("open")
+        return data, "image/jpeg", timings
+
+    # draft() picks the largest DCT scale (1/2 .. 1/8) that still covers the target
+    scale = max_side / max(image.size)
+    if scale < 1:
+        image.draft("RGB", (max(1, round(image.width * scale)), max(1, round(image.height * scale))))
+    image.load()
+    lap("decode")
+
+    image = ImageOps.exif_transpose(image)
+    lap("orient")
+
+    # thumbnail() reduces by whole factors with reduce() before the final resample
+    image.thumbnail((max_side, max_side), Image.Resampling.BICUBIC, reducing_gap=2.0)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    lap("resize")
+
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    lap("encode")
+    return buffer.getvalue(), "image/jpeg", timings
+
+
+def prepare_upload(data, filename, content_type, max_side=512, quality=90):
+    """Normalize an upload for the Space, returning ``(data, filename, content_type)``.
+
+    Bytes Pillow cannot decode (e.g. HEIC without a plugin) are forwarded as-is.
+    """
+    try:
+        normalized, new_content_type, timings = normalize_image(data, max_side, quality)
+    except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning(f"Could not normalize upload {filename!r}, forwarding original: {e}")
+        return data, filename, content_type
+
+    stages = " ".join(f"{stage}={ms:.1f}ms" for stage, ms in timings.items())
+    if normalized is data:
+        logger.info(f"Upload already normalized ({len(data)} bytes): {stages}")
+        return data, filename, content_type
+    logger.info(f"Normalized upload: {len(data)} -> {len(normalized)} bytes {stages}")
+    stem = filename.rsplit(".", 1)[0] if "." in filename else filename
+    return normalized, f"{stem or 'image'}.jpg", new_content_type
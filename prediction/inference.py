@@ -0,0 +1,134 @@
+import io
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# ====================================================
+# Local Reference Model
+# ====================================================
+# A NumPy-only classifier for offline inference. Images are preprocessed as in
+# the old VGG16 path (RGB, 224×224, scaled to [0, 1]); instead of a CNN the
+# model reads pooled colour, gradient and histogram features and applies a
+# softmax layer trained on the bundled dataset folders. Every step works on a
+# whole (N, 224, 224, 3) batch so one forward pass serves many images.
+IMAGE_SIZE = (224, 224)
+GRID = 8            # colour means on an 8×8 grid
+TEXTURE_GRID = 4    # gradient energy and colour spread on a 4×4 grid
+HISTOGRAM_BINS = 16
+# Model whose labels are the luffa categories themselves, used by model_type=auto
+LEAF_TYPE_MODEL = "leaf_type"
+
+
+def decode_image(data):
+    """Decode image bytes to a uint8 (224, 224, 3) RGB array, EXIF orientation applied."""
+    image = Image.open(io.BytesIO(data))
+    image.draft("RGB", IMAGE_SIZE)
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("RGB").resize(IMAGE_SIZE, Image.Resampling.BILINEAR)
+    return np.asarray(image, dtype=np.uint8)
+
+
+def preprocess(data):
+    """Decode image bytes to a float32 (224, 224, 3) array in [0, 1]."""
+    return decode_image(data).astype(np.float32) / 255.0
+
+
+def _crop(values, cells):
+    """Crop an (N, H, W, ...) array so H and W are multiples of ``cells``."""
+    return values[:, :values.shape[1] // cells * cells, :values.shape[2] // cells * cells]
+
+
+def _grid_mean(values, cells):
+    """Mean over a cells×cells grid of an (N, H, W, ...) array; H and W divide evenly."""
+    n, height, width = values.shape[:3]
+    rest = values.shape[3:]
+    # Reduce rows, then columns, so both sums run over contiguous memory
+    sums = values.reshape(n, cells, height // cells, -1).sum(axis=2)
+    sums = sums.reshape(n, cells, cells, width // cells, *rest).sum(axis=3)
+    return sums / ((height // cells) * (width // cells))
+
+
+def extract_features(batch):
+    """Feature matrix (N, F) for a preprocessed (N, 224, 224, 3) batch."""
+    n = len(batch)
+    gray = batch @ np.full(3, 1 / 3, dtype=np.float32)
+    colour = _grid_mean(batch, GRID)
+    squares = _grid_mean(batch * batch, GRID)
+    # The 4×4 statistics are means of 2×2 blocks of the 8×8 grid
+    coarse = colour.reshape(n, TEXTURE_GRID, 2, TEXTURE_GRID, 2, 3).mean(axis=(2, 4))
+    coarse_squares = squares.reshape(n, TEXTURE_GRID, 2, TEXTURE_GRID, 2, 3).mean(axis=(2, 4))
+    spread = np.sqrt(np.maximum(coarse_squares - coarse ** 2, 0))
+    gradient_x = _grid_mean(_crop(np.abs(np.diff(gray, axis=2)), TEXTURE_GRID), TEXTURE_GRID)
+    gradient_y = _grid_mean(_crop(np.abs(np.diff(gray, axis=1)), TEXTURE_GRID), TEXTURE_GRID)
+
+    # Per-channel histograms with one bincount per image
+    bins = (batch * (HISTOGRAM_BINS - 1e-3)).astype(np.uint8)
+    bins += np.arange(0, 3 * HISTOGRAM_BINS, HISTOGRAM_BINS, dtype=np.uint8)
+    histogram = np.stack([np.bincount(image.ravel(), minlength=3 * HISTOGRAM_BINS) for image in bins])
+    histogram = histogram / (batch.shape[1] * batch.shape[2])
+
+    return np.concatenate([
+        colour.reshape(n, -1),
+        spread.reshape(n, -1),
+        gradient_x.reshape(n, -1),
+        gradient_y.reshape(n, -1),
+        histogram,
+    ], axis=1).astype(np.float32)
+
+
+def softmax(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class ReferenceModel:
+    """Standardized features followed by one softmax layer."""
+
+    def __init__(self, labels, mean, scale, weights, bias):
+        self.labels = list(labels)
+        self.mean = mean
+        self.scale = scale
+        self.weights = weights
+        self.bias = bias
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as archive:
+            return cls(archive["labels"].tolist(), archive["mean"], archive["scale"],
+                       archive["weights"], archive["bias"])
+
+    def save(self, path):
+        np.savez_compressed(path, labels=np.array(self.labels), mean=self.mean, scale=self.scale,
+                            weights=self.weights, bias=self.bias)
+
+    def predict_proba(self, batch):
+        """Class probabilities (N, classes) for a preprocessed batch."""
+        features = (extract_features(batch) - self.mean) / self.scale
+        return softmax(features @ self.weights + self.bias)
+
+    def predict(self, batch):
+        """``[(label, confidence), ...]`` for a preprocessed batch."""
+        probabilities = self.predict_proba(batch)
+        best = probabilities.argmax(axis=1)
+        return [(self.labels[i], float(probabilities[row, i])) for row, i in enumerate(best)]
+
+
+def train_reference_model(batch, targets, labels, epochs=500, learning_rate=0.5, l2=1e-2):
+    """Fit a ``ReferenceModel`` by full-batch gradient descent on softmax cross-entropy.
+
+    ``targets`` holds one index into ``labels`` per image of ``batch``.
+    """
+    features = extract_features(batch)
+    mean = features.mean(axis=0)
+    scale = features.std(axis=0) + 1e-6
+    features = (features - mean) / scale
+    one_hot = np.eye(len(labels), dtype=np.float32)[targets]
+
+    weights = np.zeros((features.shape[1], len(labels)), dtype=np.float32)
+    bias = np.zeros(len(labels), dtype=np.float32)
+    for _ in range(epochs):
+        error = softmax(features @ weights + bias) - one_hot
+        weights -= learning_rate * (features.T @ error / len(features) + l2 * weights)
+        bias -= learning_rate * error.mean(axis=0)
+    return ReferenceModel(labels, mean, scale, weights, bias)
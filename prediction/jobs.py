@@ -0,0 +1,265 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections, connection
+from django.db.models import F
+from django.dispatch import receiver
+from django.http.request import validate_host
+from django.utils import timezone
+
+from .models import PredictionJob
+from .services import PredictionError, predict_image, prediction_payload
+
+logger = logging.getLogger(__name__)
+
+# ====================================================
+# Prediction Jobs
+# ====================================================
+# POST /predict/jobs/ stores the upload as a PredictionJob row and returns at
+# once; worker threads (in the web process, or `manage.py run_prediction_jobs`)
+# claim due rows with a conditional UPDATE, so any number of processes can
+# share the table as a queue without a broker. Upstream failures (5xx) are
+# retried with backoff, then the optional callback URL gets the final status.
+def submit_job(image_bytes, category, filename="image.jpg", content_type="application/octet-stream", callback_url=""):
+    job = PredictionJob.objects.create(
+        image=image_bytes,
+        category=category,
+        filename=filename,
+        content_type=content_type,
+        callback_url=callback_url,
+        available_at=timezone.now(),
+    )
+    logger.info(f"Queued prediction job {job.id}: category={category} ({len(image_bytes)} bytes)")
+    pool = get_job_pool()
+    if pool is not None:
+        pool.wake()
+    return job
+
+
+def job_payload(job):
+    """The JSON body for ``GET /predict/jobs/<id>/`` and job callbacks."""
+    payload = {
+        "job_id": str(job.id),
+        "status": job.status,
+        "category": job.category,
+        "attempts": job.attempts,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.status == PredictionJob.SUCCEEDED:
+        payload["result"] = job.result
+    elif job.status == PredictionJob.FAILED:
+        payload["error"] = job.error
+        payload["code"] = job.error_status
+    return payload
+
+
+def claim_next_job():
+    """Mark the oldest due job as running and return it, or ``None`` when the queue is empty."""
+    now = timezone.now()
+    candidates = (PredictionJob.objects
+                  .filter(status=PredictionJob.QUEUED, available_at__lte=now)
+                  .order_by("created_at")
+                  .values_list("id", flat=True)[:5])
+    for job_id in candidates:
+        # Only one worker's UPDATE can match while the row is still queued
+        claimed = (PredictionJob.objects
+                   .filter(id=job_id, status=PredictionJob.QUEUED)
+                   .update(status=PredictionJob.RUNNING, started_at=now, attempts=F("attempts") + 1))
+        if claimed:
+            return PredictionJob.objects.get(id=job_id)
+    return None
+
+
+def requeue_stale_jobs(older_than):
+    """Return jobs left running by a worker that died (e.g. on redeploy) to the queue."""
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    count = (PredictionJob.objects
+             .filter(status=PredictionJob.RUNNING, started_at__lt=cutoff)
+             .update(status=PredictionJob.QUEUED, available_at=timezone.now()))
+    if count:
+        logger.warning(f"Requeued {count} stale prediction jobs")
+    return count
+
+
+def run_job(job):
+    """Run a claimed job to completion (or back into the queue for a retry)."""
+    start = time.perf_counter()
+    try:
+        result, cache_status = predict_image(bytes(job.image), job.category,
+                                             filename=job.filename, content_type=job.content_type)
+    except PredictionError as e:
+        if e.status >= 500 and job.attempts < settings.PREDICTION_JOBS_MAX_ATTEMPTS:
+            delay = e.retry_after or settings.PREDICTION_JOBS_RETRY_DELAY * 2 ** (job.attempts - 1)
+            logger.warning(f"Prediction job {job.id} attempt {job.attempts} failed ({e.message}), retrying in {delay}s")
+            job.status = PredictionJob.QUEUED
+            job.available_at = timezone.now() + timedelta(seconds=delay)
+            job.save(update_fields=["status", "available_at"])
+            return job
+        job.status = PredictionJob.FAILED
+        job.error = e.message
+        job.error_status = e.status
+    except Exception as e:
+        logger.error(f"Unexpected error in prediction job {job.id}: {str(e)}", exc_info=True)
+        job.status = PredictionJob.FAILED
+        job.error = "An unexpected error occurred"
+        job.error_status = 500
+    else:
+        job.status = PredictionJob.SUCCEEDED
+        job.result = dict(prediction_payload(result), cache=cache_status)
+        job.cache_status = cache_status
+
+    job.finished_at = timezone.now()
+    job.image = b""
+    job.save(update_fields=["status", "result", "cache_status", "error", "error_status", "finished_at", "image"])
+    logger.info(f"Prediction job {job.id} {job.status} after {job.attempts} attempt(s) "
+                f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+    if job.callback_url:
+        deliver_callback(job)
+    return job
+
+
+def callback_allowed(url):
+    """Whether ``url`` is an http(s) URL on one of the PREDICTION_JOBS_CALLBACK_HOSTS."""
+    try:
+        parts = urlsplit(url)
+        hostname = parts.hostname
+    except ValueError:
+        return False
+    return parts.scheme in ("http", "https") and bool(hostname) and \
+        validate_host(hostname, settings.PREDICTION_JOBS_CALLBACK_HOSTS)
+
+
+def deliver_callback(job):
+    """POST the job payload to its callback URL, retrying connection errors and 5xx."""
+    if not callback_allowed(job.callback_url):
+        # PREDICTION_JOBS_CALLBACK_HOSTS changed since the job was queued
+        logger.warning(f"Not delivering the callback for job {job.id}: host not in PREDICTION_JOBS_CALLBACK_HOSTS")
+        job.callback_status = "failed"
+        job.save(update_fields=["callback_status"])
+        return
+    attempts = settings.PREDICTION_JOBS_CALLBACK_RETRIES + 1
+    delivered = False
+    for attempt in range(1, attempts + 1):
+        try:
+            # A redirect could lead anywhere, including past the host allowlist
+            response = requests.post(job.callback_url, json=job_payload(job),
+                                     headers={"X-Prediction-Job": str(job.id)},
+                                     timeout=settings.PREDICTION_JOBS_CALLBACK_TIMEOUT, allow_redirects=False)
+        except requests.RequestException as e:
+            logger.warning(f"Callback for job {job.id} attempt {attempt}/{attempts} failed: {e}")
+        else:
+            if response.status_code < 500:
+                delivered = response.status_code < 400
+                logger.info(f"Callback for job {job.id}: status={response.status_code}")
+                break
+            logger.warning(f"Callback for job {job.id} attempt {attempt}/{attempts}: status={response.status_code}")
+        if attempt < attempts:
+            time.sleep(2 ** (attempt - 1))
+    job.callback_status = "delivered" if delivered else "failed"
+    job.save(update_fields=["callback_status"])
+
+
+# ====================================================
+# Worker Pool
+# ====================================================
+class JobWorkerPool:
+    """Threads that claim and run jobs until stopped.
+
+    ``wake()`` lets a job submitted in this process start immediately; jobs
+    submitted by other processes are picked up within ``poll_interval``.
+    """
+
+    def __init__(self, workers=2, poll_interval=1.0, stale_after=600, name="prediction-jobs"):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.name = name
+        self.completed = 0
+        self._wake = threading.Semaphore(0)
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        requeue_stale_jobs(self.stale_after)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} prediction job workers")
+        return self
+
+    def wake(self):
+        self._wake.release()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        for _ in self._threads:
+            self._wake.release()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run_pending(self):
+        """Run queued jobs that are due in the calling thread; returns how many ran."""
+        count = 0
+        while (job := claim_next_job()) is not None:
+            run_job(job)
+            count += 1
+        return count
+
+    def _loop(self):
+        try:
+            while not self._stopping.is_set():
+                close_old_connections()
+                try:
+                    job = claim_next_job()
+                except Exception as e:
+                    logger.error(f"Could not claim a prediction job: {e}")
+                    job = None
+                if job is None:
+                    self._wake.acquire(timeout=self.poll_interval)
+                    continue
+                try:
+                    run_job(job)
+                except Exception as e:
+                    # e.g. the database went away while saving; the job is requeued once stale
+                    logger.error(f"Prediction job {job.id} could not be completed: {e}", exc_info=True)
+                    continue
+                self.completed += 1
+        finally:
+            connection.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_job_pool():
+    """Return this process's worker pool, starting it on first use; ``None`` when
+    PREDICTION_JOBS_WORKERS is 0 (jobs then run in `manage.py run_prediction_jobs`)."""
+    global _pool
+    if _pool is None and settings.PREDICTION_JOBS_WORKERS > 0:
+        with _pool_lock:
+            if _pool is None:
+                _pool = JobWorkerPool(
+                    workers=settings.PREDICTION_JOBS_WORKERS,
+                    poll_interval=settings.PREDICTION_JOBS_POLL_INTERVAL,
+                    stale_after=settings.PREDICTION_JOBS_STALE_AFTER,
+                ).start()
+    return _pool
+
+
+@receiver(setting_changed)
+def _reset_job_pool(setting, **kwargs):
+    global _pool
+    if setting.startswith('PREDICTION_JOBS'):
+        if _pool is not None:
+            _pool.stop(timeout=5)
+        _pool = None
@@ -0,0 +1,198 @@
+import json
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime, timezone
+
+import numpy as np
+import requests
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+
+from prediction.dataset import iter_dataset
+from prediction.stubserver import StubHFServer
+
+MODEL_TYPES = {'Smooth': 'Smooth', 'Spoonge': 'Sponge'}
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _percentiles(latencies):
+    latencies = np.array(latencies) * 1000
+    return {
+        'mean': round(float(latencies.mean()), 2),
+        'p50': round(float(np.percentile(latencies, 50)), 2),
+        'p95': round(float(np.percentile(latencies, 95)), 2),
+        'p99': round(float(np.percentile(latencies, 99)), 2),
+        'max': round(float(latencies.max()), 2),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Replay the bundled leaf datasets through /predict/ at a fixed concurrency, against a stub '
+            'Hugging Face Space with configurable latency and errors, and report throughput and latency')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight at once')
+        parser.add_argument('--limit', type=int, default=0, help='Only use the first N images')
+        parser.add_argument('--repeat', type=int, default=1, help='Replay the images N times')
+        parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests sent first')
+        parser.add_argument('--shuffle', action='store_true', help='Send images in random order (see --seed)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--latency-ms', type=float, default=200, help='Stub Space latency per request')
+        parser.add_argument('--jitter-ms', type=float, default=100, help='Extra random stub latency, up to this')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of stub calls that fail')
+        parser.add_argument('--error-status', type=int, default=503)
+        parser.add_argument('--backend', choices=['remote', 'local'], default='remote',
+                            help='Prediction backend for both categories (in-process runs only)')
+        parser.add_argument('--cache', action='store_true',
+                            help='Keep the prediction cache and near-duplicate index on (off by default, '
+                                 'so every request reaches the backend)')
+        parser.add_argument('--url', help='Benchmark a running server (e.g. http://127.0.0.1:8000) instead of '
+                                          'in-process; it calls whatever Space it is configured with')
+        parser.add_argument('--output', help='Write the JSON result to this file')
+        parser.add_argument('--json', action='store_true', help='Print the JSON result instead of a summary')
+
+    def handle(self, *args, **options):
+        images = list(iter_dataset())
+        if not images:
+            raise CommandError("No dataset images found")
+        if options['limit']:
+            images = images[:options['limit']]
+        bodies = []
+        for path, category, label in images:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Pre-encode every request so encoding is not part of the measured time
+            bodies.append(encode_multipart(BOUNDARY, {
+                'image': SimpleUploadedFile(os.path.basename(path), data),
+                'model_type': MODEL_TYPES[category],
+            }))
+        order = list(range(len(bodies))) * options['repeat']
+        if options['shuffle']:
+            random.Random(options['seed']).shuffle(order)
+
+        with ExitStack() as stack:
+            stub = None
+            if options['url']:
+                send = self.http_sender(options['url'].rstrip('/') + '/predict/')
+            else:
+                stub = stack.enter_context(StubHFServer(
+                    delay=options['latency_ms'] / 1000,
+                    jitter=options['jitter_ms'] / 1000,
+                    error_rate=options['error_rate'],
+                    error_status=options['error_status'],
+                    seed=options['seed'],
+                ))
+                overrides = {
+                    'HF_API_BASE': stub.url,
+                    'PREDICTION_BACKENDS': {category: options['backend'] for category in MODEL_TYPES},
+                    'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+                    # Every request comes from one client address
+                    'RATE_LIMIT_ENABLED': False,
+                    # Synthetic traffic stays out of the prediction history and /predict/summary/
+                    'PREDICTION_HISTORY_ENABLED': False,
+                }
+                if not options['cache']:
+                    overrides.update(PREDICTION_CACHE_BACKEND='none', PREDICTION_PHASH_ENABLED=False)
+                stack.enter_context(override_settings(**overrides))
+                send = self.client_sender()
+
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                list(executor.map(lambda i: send(bodies[i]), order[:options['warmup']]))
+                upstream_before = (len(stub.requests), stub.bytes_received, stub.errors_injected) if stub else None
+                start = time.perf_counter()
+                samples = list(executor.map(lambda i: send(bodies[i]), order))
+                duration = time.perf_counter() - start
+
+        latencies = [latency for latency, status, cache in samples]
+        result = {
+            'commit': _commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'config': {
+                key: options[key] for key in ('concurrency', 'limit', 'repeat', 'warmup', 'shuffle', 'seed',
+                                              'latency_ms', 'jitter_ms', 'error_rate', 'error_status',
+                                              'backend', 'cache', 'url')
+            },
+            'images': len(images),
+            'requests': len(samples),
+            'duration_s': round(duration, 3),
+            'throughput_rps': round(len(samples) / duration, 2),
+            'latency_ms': _percentiles(latencies),
+            'status_codes': dict(sorted(Counter(str(status) for _, status, _ in samples).items())),
+            'cache': dict(sorted(Counter(cache for _, _, cache in samples if cache).items())),
+            'bytes_sent': sum(len(bodies[i]) for i in order),
+        }
+        if stub is not None:
+            requests_before, bytes_before, errors_before = upstream_before
+            result['upstream'] = {
+                'requests': len(stub.requests) - requests_before,
+                'bytes_received': stub.bytes_received - bytes_before,
+                'errors_injected': stub.errors_injected - errors_before,
+            }
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(result, f, indent=2)
+                f.write('\n')
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+
+        latency = result['latency_ms']
+        self.stdout.write(f"{result['requests']} requests ({result['images']} images) at concurrency "
+                          f"{options['concurrency']} in {result['duration_s']} s: {result['throughput_rps']} req/s")
+        self.stdout.write(f"Latency: p50={latency['p50']} ms p95={latency['p95']} ms p99={latency['p99']} ms "
+                          f"max={latency['max']} ms")
+        self.stdout.write(f"Status codes: {result['status_codes']}  cache: {result['cache']}")
+        self.stdout.write(f"Sent {result['bytes_sent'] / 1e6:.1f} MB")
+        if 'upstream' in result:
+            upstream = result['upstream']
+            self.stdout.write(f"Stub Space: {upstream['requests']} requests, "
+                              f"{upstream['bytes_received'] / 1e6:.1f} MB received, "
+                              f"{upstream['errors_injected']} errors injected")
+
+    def client_sender(self):
+        """Send through Django's test client: the full middleware and view stack, no socket."""
+        local = threading.local()
+
+        def send(body):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client()
+            start = time.perf_counter()
+            response = client.generic('POST', '/predict/', body, content_type=MULTIPART_CONTENT)
+            return time.perf_counter() - start, response.status_code, response.get('X-Cache')
+        return send
+
+    def http_sender(self, url):
+        local = threading.local()
+
+        def send(body):
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = requests.Session()
+            start = time.perf_counter()
+            try:
+                response = session.post(url, data=body, headers={'Content-Type': MULTIPART_CONTENT}, timeout=120)
+            except requests.RequestException:
+                return time.perf_counter() - start, 'connection_error', None
+            return time.perf_counter() - start, response.status_code, response.headers.get('X-Cache')
+        return send
+
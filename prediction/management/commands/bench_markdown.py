@@ -0,0 +1,72 @@
+import json
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from prediction.plaintext import MarkdownStripper, remove_markdown
+from prediction.plaintext_reference import remove_markdown_regex
+
+MARKDOWN_REPLY = (
+    "## Downy Mildew on Luffa\n\n"
+    "**Symptoms:** yellow *angular* spots on the upper leaf surface, grey growth underneath.\n"
+    "- Remove infected leaves and keep the `canopy` dry\n"
+    "- Spray a copper fungicide every 7 days\n"
+    "1. Improve drainage between rows\n"
+    "2. Rotate crops, see [the extension guide](https://example.org/luffa/downy-mildew)\n\n\n"
+)
+PLAIN_REPLY = (
+    "Downy mildew shows as yellow angular spots on the upper leaf surface. Remove infected leaves,\n"
+    "keep the canopy dry and spray a copper fungicide every seven days during humid weather.\n\n"
+)
+
+
+def _sized(unit, size):
+    return (unit * (size // len(unit) + 1))[:size]
+
+
+def _stream(text, chunk_size):
+    stripper = MarkdownStripper()
+    pieces = [stripper.feed(text[i:i + chunk_size]) for i in range(0, len(text), chunk_size)]
+    pieces.append(stripper.flush())
+    return "".join(pieces)
+
+
+def _best_ms(function, repeat, number):
+    return min(timeit.repeat(function, repeat=repeat, number=number)) * 1000 / number
+
+
+class Command(BaseCommand):
+    help = 'Benchmark markdown stripping of chatbot replies against the original regex implementation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50], help='Reply sizes in KB')
+        parser.add_argument('--chunk-size', type=int, default=16, help='Characters per streamed chunk')
+        parser.add_argument('--number', type=int, default=50)
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+
+    def handle(self, *args, **options):
+        number = options['number']
+        results = []
+        for kind, unit in (('markdown', MARKDOWN_REPLY), ('plain', PLAIN_REPLY)):
+            for size_kb in options['sizes']:
+                text = _sized(unit, size_kb * 1024)
+                expected = remove_markdown_regex(text)
+                if remove_markdown(text) != expected or _stream(text, options['chunk_size']) != expected:
+                    self.stderr.write(f"Output mismatch for {kind} {size_kb} KB")
+                results.append({
+                    'kind': kind,
+                    'size_kb': size_kb,
+                    'regex_ms': round(_best_ms(lambda: remove_markdown_regex(text), 5, number), 3),
+                    'remove_markdown_ms': round(_best_ms(lambda: remove_markdown(text), 5, number), 3),
+                    'stream_ms': round(_best_ms(lambda: _stream(text, options['chunk_size']), 3, max(number // 10, 1)), 3),
+                })
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"kind      size  regex_ms  remove_markdown_ms  speedup  stream_ms ({options['chunk_size']}-char chunks)")
+        for row in results:
+            speedup = row['regex_ms'] / row['remove_markdown_ms']
+            self.stdout.write(f"{row['kind']:<8}  {row['size_kb']:>2} KB  {row['regex_ms']:>8}  "
+                              f"{row['remove_markdown_ms']:>18}  {speedup:>6.1f}x  {row['stream_ms']:>9}")
@@ -0,0 +1,123 @@
+import io
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from prediction.dataset import iter_dataset
+from prediction.phash import HASH_FUNCTIONS, HASH_SIZE, PerceptualIndex
+
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+
+def _variants(path):
+    """Re-encoded copies of an image as a phone or screenshot tool would produce them."""
+    with Image.open(path) as original:
+        original = original.convert("RGB")
+        variants = {}
+        for name, transform, quality in (
+            ("resized_50", lambda im: im.resize((im.width // 2, im.height // 2)), 85),
+            ("jpeg_q40", lambda im: im, 40),
+            ("resized_75_q70", lambda im: im.resize((im.width * 3 // 4, im.height * 3 // 4)), 70),
+        ):
+            buffer = io.BytesIO()
+            transform(original).save(buffer, "JPEG", quality=quality)
+            variants[name] = buffer.getvalue()
+        buffer = io.BytesIO()
+        original.save(buffer, "PNG")
+        variants["png"] = buffer.getvalue()
+    return variants
+
+
+class Command(BaseCommand):
+    help = 'Benchmark perceptual-hash near-duplicate lookup over the bundled leaf datasets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--algorithm', choices=sorted(HASH_FUNCTIONS), default='phash')
+        parser.add_argument('--max-distance', type=int, nargs='+', default=[2, 4, 6, 8, 10])
+        parser.add_argument('--limit', type=int, default=0, help='Only use the first N images')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+
+    def handle(self, *args, **options):
+        hash_function = HASH_FUNCTIONS[options['algorithm']]
+        images = list(iter_dataset())
+        if options['limit']:
+            images = images[:options['limit']]
+
+        index = PerceptualIndex(max_entries=len(images))
+        labels = []
+        original_hashes = []
+        variant_hashes = []
+        offsets = {}
+        hash_seconds = 0.0
+        for position, (path, category, label) in enumerate(images):
+            offsets.setdefault(category, position)
+            with open(path, 'rb') as f:
+                data = f.read()
+            t0 = time.perf_counter()
+            original_hashes.append(hash_function(data))
+            hash_seconds += time.perf_counter() - t0
+            index.add(original_hashes[-1], category, position)
+            labels.append(label)
+            variant_hashes.append({name: hash_function(data) for name, data in _variants(path).items()})
+        hash_ms = hash_seconds * 1000 / len(images)
+
+        # Lookup latency against the full index
+        lookups = []
+        for position, (path, category, label) in enumerate(images):
+            for value_hash in variant_hashes[position].values():
+                t0 = time.perf_counter()
+                index.search(value_hash, category, max(options['max_distance']))
+                lookups.append((time.perf_counter() - t0) * 1e6)
+        lookups = np.array(lookups)
+
+        results = {
+            'algorithm': options['algorithm'],
+            'images': len(images),
+            'hash_ms_per_image': round(hash_ms, 3),
+            'lookup_us': {
+                'p50': round(float(np.percentile(lookups, 50)), 2),
+                'p95': round(float(np.percentile(lookups, 95)), 2),
+                'p99': round(float(np.percentile(lookups, 99)), 2),
+            },
+            'thresholds': [],
+        }
+        for max_distance in options['max_distance']:
+            found = total = 0
+            false_matches = wrong_label = 0
+            for position, (path, category, label) in enumerate(images):
+                for value_hash in variant_hashes[position].values():
+                    total += 1
+                    match = index.search(value_hash, category, max_distance)
+                    if match is not None and match[1] == position:
+                        found += 1
+                # False match: a *different* image of the same category within range
+                distances = index.distances(original_hashes[position], category).astype(np.int64)
+                distances[position - offsets[category]] = HASH_BITS + 1
+                nearest = int(np.argmin(distances))
+                if distances[nearest] <= max_distance:
+                    false_matches += 1
+                    if labels[offsets[category] + nearest] != label:
+                        wrong_label += 1
+            results['thresholds'].append({
+                'max_distance': max_distance,
+                'recall': round(found / total, 4),
+                'false_match_rate': round(false_matches / len(images), 4),
+                'wrong_label_rate': round(wrong_label / len(images), 4),
+            })
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{results['images']} images, {results['algorithm']}, "
+                          f"{results['hash_ms_per_image']} ms per hash")
+        lookup = results['lookup_us']
+        self.stdout.write(f"Lookup latency: p50={lookup['p50']} us p95={lookup['p95']} us p99={lookup['p99']} us")
+        self.stdout.write("max_distance  recall  false_match  wrong_label")
+        for row in results['thresholds']:
+            self.stdout.write(f"{row['max_distance']:>12}  {row['recall']:>6.2%}  "
+                              f"{row['false_match_rate']:>11.2%}  {row['wrong_label_rate']:>11.2%}")
+
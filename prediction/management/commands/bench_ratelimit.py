@@ -0,0 +1,86 @@
+import json
+import time
+import uuid
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+
+from prediction.ratelimit import InFlightLimiter, RateLimited, RateLimiter, rate_limit
+
+
+def _time_us(function, arguments):
+    samples = np.empty(len(arguments))
+    for i, argument in enumerate(arguments):
+        start = time.perf_counter_ns()
+        function(argument)
+        samples[i] = time.perf_counter_ns() - start
+    samples /= 1000
+    return {
+        'mean_us': round(float(samples.mean()), 2),
+        'p50_us': round(float(np.percentile(samples, 50)), 2),
+        'p99_us': round(float(np.percentile(samples, 99)), 2),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request overhead of the rate limiter and the upstream in-flight cap'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+        parser.add_argument('--clients', type=int, default=1000, help='Distinct client IPs in the many-clients run')
+        parser.add_argument('--cache', default=None, help='Cache alias holding the buckets '
+                                                          '(defaults to RATE_LIMIT_CACHE_ALIAS)')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+
+    def handle(self, *args, **options):
+        alias = options['cache'] or settings.RATE_LIMIT_CACHE_ALIAS
+        iterations = options['iterations']
+        factory = RequestFactory()
+        requests = [factory.post('/predict/', REMOTE_ADDR=f"10.0.{i // 256 % 256}.{i % 256}")
+                    for i in range(options['clients'])]
+        one_client = [requests[0]] * iterations
+        many_clients = [requests[i % len(requests)] for i in range(iterations)]
+
+        def limiter(client, global_=None):
+            # A fresh scope per run so buckets left by earlier runs don't matter
+            return RateLimiter(f"bench-{uuid.uuid4().hex[:8]}", client=client, global_=global_, cache_alias=alias)
+
+        def rejected(check):
+            def call(request):
+                try:
+                    check(request)
+                except RateLimited:
+                    pass
+            return call
+
+        generous = limiter('1000000/s', global_='1000000/s')
+        strict = limiter('1/h')
+        strict.check(requests[0])
+        with override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMIT_CACHE_ALIAS=alias, RATE_LIMITS={
+                'bench': {'client': '1000000/s', 'global': '1000000/s'}}):
+            view = rate_limit('bench')(lambda request: HttpResponse())
+            runs = [
+                ('allowed, one client', _time_us(generous.check, one_client)),
+                (f"allowed, {len(requests)} clients", _time_us(generous.check, many_clients)),
+                ('refused (429)', _time_us(rejected(strict.check), one_client)),
+                ('decorated view', _time_us(view, many_clients)),
+            ]
+        slots = InFlightLimiter('bench', limit=64)
+
+        def slot(_):
+            with slots:
+                pass
+        runs.append(('in-flight slot', _time_us(slot, one_client)))
+
+        results = [{'case': case, **timing} for case, timing in runs]
+        if options['json']:
+            self.stdout.write(json.dumps({'cache': alias, 'iterations': iterations, 'results': results}, indent=2))
+            return
+        backend = settings.CACHES[alias]['BACKEND'].rsplit('.', 1)[-1]
+        self.stdout.write(f"{iterations} iterations, buckets in the {alias!r} cache ({backend})")
+        self.stdout.write(f"{'case':<24}  {'mean µs':>8}  {'p50 µs':>8}  {'p99 µs':>8}")
+        for row in results:
+            self.stdout.write(f"{row['case']:<24}  {row['mean_us']:>8}  {row['p50_us']:>8}  {row['p99_us']:>8}")
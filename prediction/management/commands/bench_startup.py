@@ -0,0 +1,84 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter: import the WSGI / ASGI application (what a
+# gunicorn worker does at boot), then wait for the background warm-up.
+BOOT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+__import__("luffa_prediction." + sys.argv[1])
+boot = time.perf_counter() - start
+from prediction.warmup import get_warmup
+warmup = get_warmup()
+warmup.wait(float(sys.argv[2]))
+print(json.dumps({"boot_ms": boot * 1000, "ready_ms": (time.perf_counter() - start) * 1000,
+                  "warmup": warmup.status()}))
+"""
+
+
+def _summary(values):
+    return {
+        "median_ms": round(statistics.median(values), 1),
+        "min_ms": round(min(values), 1),
+        "max_ms": round(max(values), 1),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Measure process start-up: `manage.py check` and WSGI/ASGI worker boot to readiness'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--entry', choices=['wsgi', 'asgi'], default='wsgi')
+        parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for warm-up per run')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+
+    def run(self, args):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, *args], cwd=settings.BASE_DIR, env=os.environ.copy(),
+                                   capture_output=True, text=True)
+        elapsed = (time.perf_counter() - start) * 1000
+        if completed.returncode != 0:
+            raise CommandError(f"{' '.join(args)} failed:\n{completed.stderr}")
+        return elapsed, completed.stdout
+
+    def handle(self, *args, **options):
+        check = [self.run(['manage.py', 'check'])[0] for _ in range(options['runs'])]
+
+        process, boot, ready, warmup = [], [], [], None
+        for _ in range(options['runs']):
+            elapsed, stdout = self.run(['-c', BOOT_SCRIPT, options['entry'], str(options['timeout'])])
+            row = json.loads(stdout.strip().splitlines()[-1])
+            process.append(elapsed)
+            boot.append(row['boot_ms'])
+            ready.append(row['ready_ms'])
+            warmup = row['warmup']
+
+        results = {
+            'runs': options['runs'],
+            'entry': options['entry'],
+            'check': _summary(check),
+            'worker_process': _summary(process),
+            'worker_boot': _summary(boot),
+            'worker_ready': _summary(ready),
+            'warmup': warmup,
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{options['runs']} runs, median (min-max):")
+        for key, label in [('check', 'manage.py check'),
+                           ('worker_boot', f"{options['entry']} application import"),
+                           ('worker_ready', 'import + warm-up'),
+                           ('worker_process', 'worker process (incl. interpreter)')]:
+            row = results[key]
+            self.stdout.write(f"  {label:<36} {row['median_ms']:>8.1f} ms ({row['min_ms']:.1f}-{row['max_ms']:.1f})")
+        steps = ", ".join(f"{name}={step.get('ms', step['status'])}" for name, step in warmup['steps'].items())
+        self.stdout.write(f"  warm-up state: {warmup['state']} ({steps})")
@@ -0,0 +1,119 @@
+import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from PIL import Image
+
+from prediction.dataset import DATASET_DIRS, DatasetCache, default_cache_dir
+from prediction.services import PredictionError, get_backend
+
+
+def _jpeg(pixels):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=95)
+    return buffer.getvalue()
+
+
+def confusion_matrix(truth, predicted):
+    """``(labels, matrix)`` with ``matrix[i][j]`` = images of ``labels[i]`` predicted as ``labels[j]``."""
+    labels = sorted(set(truth) | set(predicted))
+    position = {label: i for i, label in enumerate(labels)}
+    matrix = np.zeros((len(labels), len(labels)), dtype=int)
+    for true, guess in zip(truth, predicted):
+        matrix[position[true], position[guess]] += 1
+    return labels, matrix
+
+
+class Command(BaseCommand):
+    help = ('Score a prediction backend on the dataset cache (see build_dataset_cache): accuracy, '
+            'a per-class confusion matrix and throughput')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', choices=sorted(DATASET_DIRS), nargs='+', default=sorted(DATASET_DIRS))
+        parser.add_argument('--backend', choices=['local', 'remote'],
+                            help='Defaults to the configured PREDICTION_BACKENDS')
+        parser.add_argument('--batch-size', type=int, default=32, help='Images read from the cache at a time')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Requests in flight for backends without batch inference (remote)')
+        parser.add_argument('--every', type=int, default=1, help='Only score every Nth image of a category')
+        parser.add_argument('--limit', type=int, default=0, help='Score at most N images per category')
+        parser.add_argument('--cache-dir', default=None, help='Defaults to DATASET_CACHE_DIR')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+
+    def handle(self, *args, **options):
+        cache = DatasetCache.open(options['cache_dir'] or default_cache_dir())
+        if cache is None:
+            raise CommandError("No dataset cache found, run `manage.py build_dataset_cache` first")
+
+        overrides = {}
+        if options['backend']:
+            overrides['PREDICTION_BACKENDS'] = {category: options['backend'] for category in DATASET_DIRS}
+        with override_settings(**overrides):
+            results = [self.evaluate(cache, category, options) for category in options['category']]
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for row in results:
+            self.stdout.write(f"{row['category']} ({row['backend']}): {row['images']} images, "
+                              f"accuracy {row['accuracy']:.1%}, {row['errors']} errors, "
+                              f"{row['images_per_second']} images/s")
+            # Rows are true labels, columns the predicted ones in the same order
+            width = max(len(label) for label in row['labels'])
+            columns = "".join(f"{i:>5}" for i in range(len(row['labels'])))
+            self.stdout.write(f"  {'':>2} {'':<{width}}{columns}  recall")
+            for i, (label, counts) in enumerate(zip(row['labels'], row['confusion'])):
+                recall = row['recall'].get(label)
+                self.stdout.write(f"  {i:>2} {label:<{width}}" + "".join(f"{n:>5}" for n in counts)
+                                  + (f"  {recall:.1%}" if recall is not None else ""))
+
+    def evaluate(self, cache, category, options):
+        rows = cache.rows([category])[::options['every']]
+        if options['limit']:
+            rows = rows[:options['limit']]
+        if not rows:
+            raise CommandError(f"No cached images for {category}")
+        backend = get_backend(category)
+        truth = [cache.entries[row]['label'] for row in rows]
+        predicted = []
+        errors = 0
+        start = time.perf_counter()
+        if hasattr(backend, 'predict_arrays'):
+            # In-process models take the cached pixels directly: no decode, one forward pass per batch
+            for _, pixels in cache.batches(rows, options['batch_size']):
+                arrays = list(pixels.astype(np.float32) / 255.0)
+                predicted.extend(result['prediction'] for result in backend.predict_arrays(arrays, category))
+        else:
+            def predict(pixels):
+                try:
+                    return backend.predict(_jpeg(pixels), category, filename='image.jpg',
+                                           content_type='image/jpeg')['prediction']
+                except PredictionError:
+                    return None
+
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                for _, pixels in cache.batches(rows, options['batch_size']):
+                    predicted.extend(executor.map(predict, pixels))
+            errors = predicted.count(None)
+            predicted = ['(error)' if label is None else label for label in predicted]
+        duration = time.perf_counter() - start
+
+        labels, matrix = confusion_matrix(truth, predicted)
+        support = matrix.sum(axis=1)
+        return {
+            'category': category,
+            'backend': backend.name,
+            'images': len(rows),
+            'errors': errors,
+            'accuracy': round(float(np.trace(matrix) / len(rows)), 4),
+            'recall': {label: round(float(matrix[i, i] / support[i]), 4)
+                       for i, label in enumerate(labels) if support[i]},
+            'labels': labels,
+            'confusion': matrix.tolist(),
+            'seconds': round(duration, 3),
+            'images_per_second': round(len(rows) / duration, 1),
+        }
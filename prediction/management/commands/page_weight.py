@@ -0,0 +1,205 @@
+import json
+import os
+import re
+from html.parser import HTMLParser
+from urllib.parse import unquote, urljoin, urlsplit
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from prediction.staticfiles import MIME_TYPES, SOURCE_FORMATS, VARIANT_RE
+
+IMAGE_SET_RE = re.compile(r"image-set\((.*?)\)\s*[;}]", re.S)
+CANDIDATE_RE = re.compile(r"""url\(\s*["']?([^"')]+)["']?\s*\)(?:\s*type\(\s*["']([^"']+)["']\s*\))?""")
+URL_RE = re.compile(r"""url\(\s*["']?([^"')]+)["']?\s*\)""")
+
+
+def parse_srcset(srcset):
+    """``"a.webp 80w, b.webp 160w"`` -> ``[("a.webp", 80), ("b.webp", 160)]``."""
+    candidates = []
+    for candidate in srcset.split(","):
+        url, _, descriptor = candidate.strip().partition(" ")
+        if url:
+            descriptor = descriptor.strip()
+            candidates.append((url, int(descriptor[:-1]) if descriptor.endswith("w") else 0))
+    return candidates
+
+
+def pick_candidate(candidates, slot, dpr):
+    """The candidate a browser picks for a ``slot`` CSS pixels wide: the narrowest at least ``slot * dpr`` wide."""
+    candidates = sorted(candidates, key=lambda candidate: candidate[1])
+    for url, width in candidates:
+        if width >= slot * dpr:
+            return url
+    return candidates[-1][0]
+
+
+class PageParser(HTMLParser):
+    """Collects the stylesheets, scripts, icons, images and inline CSS a page loads."""
+
+    def __init__(self):
+        super().__init__()
+        self.links = []       # stylesheets, scripts and icons
+        self.pictures = []    # (img attrs, [attrs of the <source>s before it in a <picture>])
+        self.styles = []
+        self.sources = None
+        self.in_style = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "picture":
+            self.sources = []
+        elif tag == "source" and self.sources is not None:
+            self.sources.append(attrs)
+        elif tag == "img" and attrs.get("src"):
+            if self.sources is not None:
+                self.pictures.append((attrs, self.sources))
+            else:
+                self.pictures.append((attrs, []))
+        elif tag == "link" and attrs.get("href") and {"stylesheet", "icon"} & set(attrs.get("rel", "").split()):
+            self.links.append(attrs["href"])
+        elif tag == "script" and attrs.get("src"):
+            self.links.append(attrs["src"])
+        elif tag == "style":
+            self.in_style = True
+
+    def handle_endtag(self, tag):
+        if tag == "picture":
+            self.sources = None
+        elif tag == "style":
+            self.in_style = False
+
+    def handle_data(self, data):
+        if self.in_style:
+            self.styles.append(data)
+
+
+class Command(BaseCommand):
+    help = ('Report the bytes a browser downloads for each page: "before" with the original images and '
+            'uncompressed assets, "after" with the AVIF/WebP variants and Brotli copies from collectstatic')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=['/', '/predict/', '/chat/'], help='Pages to weigh')
+        parser.add_argument('--accept', default='avif,webp',
+                            help='Image formats the simulated browser supports, in order of preference')
+        parser.add_argument('--dpr', type=float, default=2, help='Device pixel ratio of the simulated screen')
+        parser.add_argument('--viewport', type=int, default=412, help='Viewport width in CSS pixels')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+
+    def handle(self, *args, **options):
+        if not getattr(staticfiles_storage, 'hashed_files', None):
+            raise CommandError("No staticfiles manifest found, run `manage.py collectstatic` first")
+        self.accept = [MIME_TYPES[ext] for ext in options['accept'].split(',') if ext]
+        self.options = options
+        # The original name of every hashed file, to size what the page loaded before
+        self.originals = {hashed: name for name, hashed in staticfiles_storage.hashed_files.items()}
+        host = next((host for host in settings.ALLOWED_HOSTS if host and not host.startswith(('*', '.'))), 'localhost')
+        client = Client(SERVER_NAME=host)
+
+        pages = []
+        for path in options['paths']:
+            response = client.get(path, secure=True)
+            if response.status_code != 200:
+                raise CommandError(f"GET {path} returned {response.status_code}")
+            pages.append(self.weigh(path, response.content))
+
+        if options['json']:
+            self.stdout.write(json.dumps({'dpr': options['dpr'], 'viewport': options['viewport'],
+                                         'accept': options['accept'], 'pages': pages}, indent=2))
+            return
+        for page in pages:
+            saved = 1 - page['after'] / page['before'] if page['before'] else 0
+            self.stdout.write(f"{page['path']}: {page['before']:,} B -> {page['after']:,} B ({saved:.0%} less), "
+                              f"{len(page['resources'])} resources"
+                              + (f", {len(page['external'])} external not counted" if page['external'] else ""))
+            if options['verbosity'] > 1:
+                for resource in page['resources']:
+                    self.stdout.write(f"  {resource['before']:>10,} -> {resource['after']:>10,}  {resource['url']}")
+
+    def weigh(self, path, html):
+        parser = PageParser()
+        parser.feed(html.decode('utf-8'))
+        resources = [{'url': path, 'before': len(html), 'after': len(html)}]
+        external = []
+        # A file used twice on a page is downloaded once
+        seen_before, seen_after = set(), set()
+
+        def add(before_url, after_url, base=path):
+            before, after = urljoin(base, before_url), urljoin(base, after_url)
+            if not before.startswith(settings.STATIC_URL):
+                external.append(before)
+                return
+            original = self.file(before, original=True)
+            if after in seen_after and original in seen_before:
+                return
+            resources.append({
+                'url': after,
+                'before': 0 if original in seen_before else os.path.getsize(original),
+                'after': 0 if after in seen_after else self.size(after),
+            })
+            seen_before.add(original)
+            seen_after.add(after)
+
+        for attrs, sources in parser.pictures:
+            add(attrs['src'], self.pick_picture(attrs, sources))
+        for url in parser.links:
+            add(url, url)
+            if urlsplit(url).path.endswith('.css') and url.startswith(settings.STATIC_URL):
+                with open(self.file(url), encoding='utf-8') as f:
+                    for ref in URL_RE.findall(f.read()):
+                        if not ref.startswith('data:'):
+                            add(ref, ref, base=url)
+        for css in parser.styles:
+            # The browser takes the first image-set() candidate it supports and never fetches the
+            # plain url() fallback declared before it
+            overridden = set()
+            for image_set in IMAGE_SET_RE.findall(css):
+                candidates = CANDIDATE_RE.findall(image_set)
+                supported = [url for url, mime in candidates if not mime or mime in self.accept]
+                add(candidates[-1][0], supported[0] if supported else candidates[-1][0])
+                overridden.add(candidates[-1][0])
+            for ref in URL_RE.findall(IMAGE_SET_RE.sub('', css)):
+                if ref not in overridden and not ref.startswith('data:'):
+                    add(ref, ref)
+        return {
+            'path': path,
+            'before': sum(resource['before'] for resource in resources),
+            'after': sum(resource['after'] for resource in resources),
+            'resources': resources,
+            'external': external,
+        }
+
+    def pick_picture(self, img, sources):
+        sizes = img.get('sizes', '')
+        slot = float(sizes[:-2]) if sizes.endswith('px') else float(img.get('width') or self.options['viewport'])
+        for source in sources:
+            if source.get('type') in self.accept:
+                return pick_candidate(parse_srcset(source['srcset']), slot, self.options['dpr'])
+        if img.get('srcset'):
+            return pick_candidate(parse_srcset(img['srcset']), slot, self.options['dpr'])
+        return img['src']
+
+    def file(self, url, original=False):
+        name = unquote(urlsplit(url).path[len(settings.STATIC_URL):])
+        if original:
+            name = self.originals.get(name, name)
+            match = VARIANT_RE.search(name)
+            if match:
+                # A resized variant stands in for its full-size source image
+                name = next((name[:match.start()] + extension for extension in SOURCE_FORMATS
+                             if name[:match.start()] + extension in staticfiles_storage.hashed_files), name)
+        path = os.path.join(settings.STATIC_ROOT, name)
+        if not os.path.exists(path):
+            path = finders.find(name)
+        if not path:
+            raise CommandError(f"{url} is not a collected static file")
+        return path
+
+    def size(self, url):
+        """Bytes on the wire: the smallest encoding WhiteNoise would serve."""
+        path = self.file(url)
+        return min(os.path.getsize(candidate) for candidate in (path, path + '.br', path + '.gz')
+                   if os.path.exists(candidate))
@@ -0,0 +1,198 @@
+import csv
+import json
+import mimetypes
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from prediction.catalog import get_disease_catalog
+from prediction.services import CATEGORIES, PredictionError, normalize_category, predict_image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.tif', '.tiff', '.heic', '.heif')
+FIELDS = ['path', 'status', 'model_type', 'category', 'prediction', 'confidence', 'selected_by', 'disease_info',
+          'cache', 'error', 'code', 'latency_ms', 'finished_at']
+
+
+def walk_images(root, extensions=IMAGE_EXTENSIONS):
+    """Yield image paths under ``root`` one directory at a time, in sorted order."""
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as scan:
+                entries = sorted(scan, key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"Skipping {directory}: {e}", file=sys.stderr)
+            continue
+        subdirectories = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif entry.name.lower().endswith(extensions):
+                yield entry.path
+        pending.extend(reversed(subdirectories))
+
+
+def finished_paths(output, fmt):
+    """Paths already recorded in ``output`` that need no retry.
+
+    Successes and client errors (4xx: not an image, undecodable) are final;
+    server-side failures are tried again. A line cut short by a crash is
+    dropped so appending starts on a fresh line.
+    """
+    if not os.path.exists(output):
+        return set()
+    with open(output, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+    lines = data[:end].decode('utf-8').splitlines()
+    if fmt == 'csv':
+        records = list(csv.DictReader(lines))
+    else:
+        records = [json.loads(line) for line in lines if line.strip()]
+    done = set()
+    for record in records:
+        code = int(record['code']) if record.get('code') not in (None, '') else None
+        if record['status'] == 'success' or (code is not None and 400 <= code < 500):
+            done.add(record['path'])
+        else:
+            done.discard(record['path'])
+    return done
+
+
+class Command(BaseCommand):
+    help = ('Predict every image under a directory with the configured backend, streaming results to JSONL '
+            'or CSV. Interrupted runs resume where they stopped: files already in the output are skipped')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Directory to walk (recursively)')
+        parser.add_argument('--output', '-o', default='predictions.jsonl',
+                            help='Results file, appended to; also the checkpoint for resuming')
+        parser.add_argument('--format', choices=['jsonl', 'csv'],
+                            help='Defaults to the output file extension (.csv, else jsonl)')
+        parser.add_argument('--model-type', default=None,
+                            help='Smooth, Spoonge or auto (default PREDICTION_DEFAULT_MODEL_TYPE)')
+        parser.add_argument('--backend', choices=['local', 'remote'],
+                            help='Defaults to the configured PREDICTION_BACKENDS')
+        parser.add_argument('--concurrency', type=int, default=8, help='Predictions in flight at once')
+        parser.add_argument('--record', action='store_true',
+                            help='Add the predictions to the prediction history (off for bulk runs)')
+        parser.add_argument('--progress-interval', type=float, default=5, help='Seconds between progress lines')
+
+    def handle(self, *args, **options):
+        root = os.path.abspath(options['path'])
+        if not os.path.isdir(root):
+            raise CommandError(f"Not a directory: {options['path']}")
+        try:
+            category = normalize_category(options['model_type'], allow_auto=True)
+        except PredictionError as e:
+            raise CommandError(e.message)
+        output = options['output']
+        fmt = options['format'] or ('csv' if output.lower().endswith('.csv') else 'jsonl')
+
+        done = finished_paths(output, fmt)
+        if done:
+            self.stderr.write(f"Resuming: {len(done)} files in {output} already finished")
+        overrides = {}
+        if options['backend']:
+            overrides['PREDICTION_BACKENDS'] = {name: options['backend'] for name in CATEGORIES}
+
+        with override_settings(**overrides), open(output, 'a', newline='', encoding='utf-8') as f:
+            if fmt == 'csv':
+                writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction='ignore')
+                if f.tell() == 0:
+                    writer.writeheader()
+                write = writer.writerow
+            else:
+                def write(record):
+                    f.write(json.dumps(record) + '\n')
+            stats = self.run(root, category, done, write, f, options)
+
+        rate = stats['finished'] / stats['seconds'] if stats['seconds'] else 0
+        message = (f"{stats['finished']} images in {stats['seconds']:.1f} s ({rate:.1f} images/s): "
+                   f"{stats['succeeded']} predicted, {stats['failed']} failed, {stats['skipped']} already done "
+                   f"-> {output}")
+        if stats['interrupted']:
+            self.stderr.write(f"Interrupted. {message}. Run the same command again to resume.")
+        else:
+            self.stdout.write(message)
+
+    def run(self, root, category, done, write, f, options):
+        catalog = get_disease_catalog()
+        stats = {'finished': 0, 'succeeded': 0, 'failed': 0, 'skipped': 0, 'interrupted': False}
+        start = last_report = time.perf_counter()
+
+        def predict(path):
+            started = time.perf_counter()
+            record = {'path': os.path.relpath(path, root), 'model_type': category}
+            try:
+                with open(path, 'rb') as image:
+                    data = image.read()
+                result, cache_status = predict_image(
+                    data, category, filename=os.path.basename(path),
+                    content_type=mimetypes.guess_type(path)[0] or 'application/octet-stream',
+                    record=options['record'],
+                )
+            except PredictionError as e:
+                record.update(status='error', error=e.message, code=e.status)
+            except OSError as e:
+                record.update(status='error', error=str(e), code=None)
+            else:
+                record.update(status='success', category=result['category'], prediction=result['prediction'],
+                              confidence=result.get('confidence'), disease_info=catalog.info(result['prediction']),
+                              cache=cache_status)
+                if 'auto' in result:
+                    record['selected_by'] = result['auto']['selected_by']
+            record['latency_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            record['finished_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+            return record
+
+        def collect(futures):
+            for future in futures:
+                record = future.result()
+                write(record)
+                stats['finished'] += 1
+                stats['succeeded' if record['status'] == 'success' else 'failed'] += 1
+            # Each result is on disk before it counts as done
+            f.flush()
+
+        # Bounded window: only a few batches' worth of paths are ever queued, however big the tree
+        executor = ThreadPoolExecutor(max_workers=options['concurrency'], thread_name_prefix='predict-dir')
+        in_flight = set()
+        try:
+            for path in walk_images(root):
+                if os.path.relpath(path, root) in done:
+                    stats['skipped'] += 1
+                    continue
+                in_flight.add(executor.submit(predict, path))
+                if len(in_flight) >= 2 * options['concurrency']:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                now = time.perf_counter()
+                if now - last_report >= options['progress_interval']:
+                    last_report = now
+                    os.fsync(f.fileno())
+                    self.report(stats, now - start)
+            collect(in_flight)
+        except KeyboardInterrupt:
+            stats['interrupted'] = True
+            executor.shutdown(wait=False, cancel_futures=True)
+            # Keep what already finished; the rest is picked up by the next run
+            collect(future for future in in_flight if future.done() and not future.cancelled())
+        finally:
+            executor.shutdown(wait=True)
+            f.flush()
+            os.fsync(f.fileno())
+        stats['seconds'] = time.perf_counter() - start
+        return stats
+
+    def report(self, stats, elapsed):
+        self.stderr.write(f"{stats['finished']} done ({stats['failed']} failed, {stats['skipped']} skipped), "
+                          f"{stats['finished'] / elapsed:.1f} images/s")
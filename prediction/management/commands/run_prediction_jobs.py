@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from prediction.jobs import JobWorkerPool
+
+
+class Command(BaseCommand):
+    help = 'Run queued prediction jobs (/predict/jobs/) outside the web process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=max(settings.PREDICTION_JOBS_WORKERS, 1))
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due now, then exit')
+
+    def handle(self, *args, **options):
+        pool = JobWorkerPool(
+            workers=options['workers'],
+            poll_interval=settings.PREDICTION_JOBS_POLL_INTERVAL,
+            stale_after=settings.PREDICTION_JOBS_STALE_AFTER,
+        )
+        if options['once']:
+            count = pool.run_pending()
+            self.stdout.write(f"Ran {count} prediction jobs")
+            return
+
+        pool.start()
+        self.stdout.write(f"Running prediction jobs with {options['workers']} workers (Ctrl-C to stop)")
+        try:
+            while True:
+                time.sleep(60)
+                self.stdout.write(f"{pool.completed} jobs completed")
+        except KeyboardInterrupt:
+            pool.stop(timeout=30)
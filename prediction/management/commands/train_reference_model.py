@@ -0,0 +1,76 @@
+import json
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from prediction.dataset import DATASET_DIRS, iter_dataset
+from prediction.inference import LEAF_TYPE_MODEL, preprocess, train_reference_model
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class Command(BaseCommand):
+    help = ('Train the NumPy reference models used by the local prediction backend from the bundled datasets, '
+            'plus the leaf-type model that tells the luffa categories apart for model_type=auto')
+
+    def add_arguments(self, parser):
+        models = [*sorted(DATASET_DIRS), LEAF_TYPE_MODEL]
+        parser.add_argument('--category', choices=models, nargs='+', default=models)
+        parser.add_argument('--holdout', type=int, default=5,
+                            help='Evaluate on every Nth image of a model trained on the rest (0 = skip)')
+        parser.add_argument('--epochs', type=int, default=500)
+        parser.add_argument('--output-dir', default=None,
+                            help='Defaults to PREDICTION_LOCAL_MODEL_DIR')
+        parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+
+    def handle(self, *args, **options):
+        output_dir = options['output_dir'] or settings.PREDICTION_LOCAL_MODEL_DIR
+        os.makedirs(output_dir, exist_ok=True)
+
+        results = []
+        for category in options['category']:
+            if category == LEAF_TYPE_MODEL:
+                # Every image, labelled with the dataset it came from
+                images = [(path, label, label) for path, label, _ in iter_dataset()]
+            else:
+                images = list(iter_dataset([category]))
+            labels = sorted({label for _, _, label in images})
+            t0 = time.perf_counter()
+            batch = np.stack([preprocess(_read(path)) for path, _, _ in images])
+            targets = np.array([labels.index(label) for _, _, label in images])
+            preprocess_seconds = time.perf_counter() - t0
+
+            row = {'category': category, 'images': len(images), 'labels': labels,
+                   'preprocess_ms_per_image': round(preprocess_seconds * 1000 / len(images), 2)}
+            if options['holdout']:
+                test = np.arange(len(images)) % options['holdout'] == 0
+                model = train_reference_model(batch[~test], targets[~test], labels, epochs=options['epochs'])
+                predicted = model.predict_proba(batch[test]).argmax(axis=1)
+                row['holdout_accuracy'] = round(float((predicted == targets[test]).mean()), 4)
+
+            t0 = time.perf_counter()
+            model = train_reference_model(batch, targets, labels, epochs=options['epochs'])
+            row['train_seconds'] = round(time.perf_counter() - t0, 2)
+            t0 = time.perf_counter()
+            model.predict_proba(batch)
+            row['forward_ms_per_image'] = round((time.perf_counter() - t0) * 1000 / len(images), 3)
+
+            path = os.path.join(output_dir, f"{category}.npz")
+            model.save(path)
+            row['path'] = path
+            results.append(row)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for row in results:
+            accuracy = f", holdout accuracy {row['holdout_accuracy']:.1%}" if 'holdout_accuracy' in row else ""
+            self.stdout.write(f"{row['category']}: {row['images']} images, {len(row['labels'])} labels{accuracy}, "
+                              f"preprocess {row['preprocess_ms_per_image']} ms/image, "
+                              f"forward {row['forward_ms_per_image']} ms/image -> {row['path']}")
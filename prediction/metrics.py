@@ -0,0 +1,363 @@
+import bisect
+import threading
+import time
+import weakref
+
+# ====================================================
+# Metrics
+# ====================================================
+# A small Prometheus-compatible registry. Counters and histograms are sharded
+# per thread: recording touches only the calling thread's dict, so the hot path
+# takes no lock. GET /metrics merges the shards and renders the text format.
+# When a thread exits its shard is folded into a shared total, so short-lived
+# threads (executors, request threads) don't leave shards behind.
+# Values are per process; with several gunicorn workers each scrape sees the
+# worker that answered it.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _ShardHolder:
+    """Thread-local owner of a shard; its finalizer runs when the thread's locals are cleared."""
+    __slots__ = ("shard", "__weakref__")
+
+    def __init__(self):
+        self.shard = {}
+
+
+class _Sharded:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = {}
+        self._retired = {}              # totals of the threads that have exited
+        self._lock = threading.Lock()   # only taken when a thread records for the first time or exits
+
+    def _shard(self):
+        try:
+            return self._local.holder.shard
+        except AttributeError:
+            holder = self._local.holder = _ShardHolder()
+            with self._lock:
+                self._shards[id(holder.shard)] = holder.shard
+            weakref.finalize(holder, self._retire, holder.shard)
+            return holder.shard
+
+    def _retire(self, shard):
+        with self._lock:
+            self._merge(self._retired, shard)
+            del self._shards[id(shard)]
+
+    def _snapshots(self):
+        with self._lock:
+            shards = list(self._shards.values())
+            # dict.copy() runs without releasing the GIL, so a shard cannot change under it
+            return [self._copy(self._retired)] + [shard.copy() for shard in shards]
+
+    @staticmethod
+    def _copy(shard):
+        return dict(shard)
+
+    @staticmethod
+    def _merge(total, shard):
+        raise NotImplementedError
+
+    def _header(self, kind):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {kind}"]
+
+
+class Counter(_Sharded):
+    def inc(self, *labelvalues, amount=1):
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    @staticmethod
+    def _merge(total, shard):
+        for labels, value in shard.items():
+            total[labels] = total.get(labels, 0) + value
+
+    def values(self):
+        totals = {}
+        for shard in self._snapshots():
+            self._merge(totals, shard)
+        return totals
+
+    def render(self):
+        lines = self._header("counter")
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labelvalues", "start")
+
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+
+
+class _OutcomeTimer(_Timer):
+    __slots__ = ()
+
+    def __exit__(self, exc_type, *exc):
+        outcome = "ok" if exc_type is None else "error"
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues, outcome)
+
+
+class Histogram(_Sharded):
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labelvalues):
+        shard = self._shard()
+        # [count per bucket..., count above the last bucket, sum]
+        entry = shard.get(labelvalues)
+        if entry is None:
+            entry = shard[labelvalues] = [0] * (len(self.buckets) + 2)
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def time(self, *labelvalues):
+        """Context manager observing the elapsed seconds of its block."""
+        return _Timer(self, labelvalues)
+
+    def time_outcome(self, *labelvalues):
+        """Like ``time``, with a last label of "ok", or "error" when the block raised."""
+        return _OutcomeTimer(self, labelvalues)
+
+    @staticmethod
+    def _copy(shard):
+        return {labels: list(entry) for labels, entry in shard.items()}
+
+    @staticmethod
+    def _merge(total, shard):
+        for labels, entry in shard.items():
+            merged = total.get(labels)
+            if merged is None:
+                total[labels] = list(entry)
+            else:
+                for i, value in enumerate(entry):
+                    merged[i] += value
+
+    def values(self):
+        totals = {}
+        for shard in self._snapshots():
+            self._merge(totals, shard)
+        return totals
+
+    def render(self):
+        lines = self._header("histogram")
+        for labels, entry in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), entry):
+                cumulative += count
+                bucket = _labels(self.labelnames, labels, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(entry[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Callback:
+    """A gauge or counter read from other state at scrape time; ``fn`` returns ``{labelvalues: value}``."""
+
+    def __init__(self, name, documentation, kind, labelnames, fn):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.fn().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, kind, labelnames, fn):
+        return self._register(Callback(name, documentation, kind, labelnames, fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:  # one broken collector must not hide the others
+                lines.append(f"# {metric.name} unavailable: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "luffa_http_requests_total", "HTTP responses by view, method and status code", ("view", "method", "status"))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "luffa_http_request_duration_seconds", "Total time spent handling a request", ("view",))
+STAGE_SECONDS = REGISTRY.histogram(
+    "luffa_stage_duration_seconds",
+    "Time per processing stage (upload_read, cache_lookup, preprocess, local_inference, json_parse, ...)",
+    ("stage",))
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "luffa_upstream_request_duration_seconds", "Latency of calls to the HF Space and OpenRouter",
+    ("upstream", "outcome"))
+PREDICTIONS = REGISTRY.counter(
+    "luffa_predictions_total", "Successful predictions by category, predicted disease and cache status",
+    ("category", "disease", "cache"))
+PREDICTION_ERRORS = REGISTRY.counter(
+    "luffa_prediction_errors_total", "Failed predictions by category and HTTP status", ("category", "status"))
+CHAT_REPLIES = REGISTRY.counter(
+    "luffa_chat_replies_total", "Chat replies by cache status and mode", ("cache", "mode"))
+RATE_LIMITED = REGISTRY.counter(
+    "luffa_rate_limited_total", "Requests refused with 429 by scope and bucket (client, key, global)",
+    ("scope", "bucket"))
+
+
+# ====================================================
+# Scrape-time Collectors
+# ====================================================
+# State that other modules already keep (breaker, hedger, single-flight, caches,
+# job queue) is read when /metrics is scraped rather than counted twice.
+def _circuit_state():
+    from .resilience import CLOSED, HALF_OPEN, OPEN, get_upstream_breaker
+    breaker = get_upstream_breaker()
+    if breaker is None:
+        return {}
+    return {("hf", state): int(breaker.state == state) for state in (CLOSED, OPEN, HALF_OPEN)}
+
+
+def _circuit_transitions():
+    from .resilience import get_upstream_breaker
+    breaker = get_upstream_breaker()
+    if breaker is None:
+        return {}
+    return {("hf", transition): count for transition, count in breaker.transitions.items()}
+
+
+def _circuit_rejected():
+    from .resilience import get_upstream_breaker
+    breaker = get_upstream_breaker()
+    return {("hf",): breaker.rejected} if breaker is not None else {}
+
+
+def _hedges():
+    from .resilience import get_upstream_hedger
+    hedger = get_upstream_hedger()
+    return {("hf", "sent"): hedger.hedges, ("hf", "won"): hedger.hedge_wins}
+
+
+def _single_flight():
+    from .singleflight import COALESCED, LEADER, SHARED, get_single_flight
+    single_flight = get_single_flight()
+    if single_flight is None:
+        return {}
+    stats = single_flight.stats()
+    return {(LEADER,): stats["leaders"], (COALESCED,): stats["coalesced"], (SHARED,): stats["shared"]}
+
+
+def _cache_lookups():
+    from .cache import get_chat_cache, get_prediction_cache
+    values = {}
+    for name, cache in (("prediction", get_prediction_cache()), ("chat", get_chat_cache())):
+        values[(name, "hit")] = cache.hits
+        values[(name, "miss")] = cache.misses
+    return values
+
+
+def _jobs():
+    from django.db.models import Count
+
+    from .models import PredictionJob
+    counts = dict(PredictionJob.objects.filter(status__in=[PredictionJob.QUEUED, PredictionJob.RUNNING])
+                  .values_list("status").annotate(n=Count("id")).order_by())
+    return {(status,): counts.get(status, 0) for status in (PredictionJob.QUEUED, PredictionJob.RUNNING)}
+
+
+def _history():
+    from .history import get_history_recorder
+    recorder = get_history_recorder()
+    if recorder is None:
+        return {}
+    stats = recorder.stats()
+    return {("pending",): stats["pending"], ("written",): stats["written"], ("dropped",): stats["dropped"]}
+
+
+def _upstream_in_flight():
+    from .ratelimit import UPSTREAM_LIMIT_SETTINGS, get_inflight_limiter
+    return {(name,): get_inflight_limiter(name).in_flight for name in UPSTREAM_LIMIT_SETTINGS}
+
+
+def _upstream_saturated():
+    from .ratelimit import UPSTREAM_LIMIT_SETTINGS, get_inflight_limiter
+    return {(name,): get_inflight_limiter(name).rejected for name in UPSTREAM_LIMIT_SETTINGS}
+
+
+def _ready():
+    from .warmup import get_warmup
+    return {(): int(get_warmup().ready)}
+
+
+REGISTRY.callback("luffa_upstream_circuit_state", "1 for the circuit breaker's current state",
+                  "gauge", ("upstream", "state"), _circuit_state)
+REGISTRY.callback("luffa_upstream_circuit_transitions_total", "Circuit breaker state changes",
+                  "counter", ("upstream", "transition"), _circuit_transitions)
+REGISTRY.callback("luffa_upstream_circuit_rejected_total", "Calls failed fast by an open circuit",
+                  "counter", ("upstream",), _circuit_rejected)
+REGISTRY.callback("luffa_upstream_hedges_total", "Hedged requests sent, and those that answered first",
+                  "counter", ("upstream", "result"), _hedges)
+REGISTRY.callback("luffa_upstream_in_flight", "Upstream calls in flight in this process",
+                  "gauge", ("upstream",), _upstream_in_flight)
+REGISTRY.callback("luffa_upstream_saturated_total", "Calls refused with 503 by the in-flight cap",
+                  "counter", ("upstream",), _upstream_saturated)
+REGISTRY.callback("luffa_singleflight_total", "Prediction misses by single-flight role",
+                  "counter", ("role",), _single_flight)
+REGISTRY.callback("luffa_cache_lookups_total", "Cache lookups by cache and result",
+                  "counter", ("cache", "result"), _cache_lookups)
+REGISTRY.callback("luffa_prediction_jobs", "Prediction jobs waiting or running (all processes)",
+                  "gauge", ("status",), _jobs)
+REGISTRY.callback("luffa_prediction_history_records", "Prediction history records buffered, written and dropped",
+                  "gauge", ("state",), _history)
+REGISTRY.callback("luffa_ready", "1 once warm-up has finished", "gauge", (), _ready)
@@ -0,0 +1,36 @@
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+
+from .metrics import HTTP_REQUEST_SECONDS, HTTP_REQUESTS
+
+
+def record_request(request, response, start):
+    match = request.resolver_match
+    view = match.url_name if match is not None and match.url_name else "unmatched"
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, view)
+    HTTP_REQUESTS.inc(view, request.method, str(response.status_code))
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Count responses and time requests per URL name (streamed bodies: until the headers)."""
+    if not getattr(settings, 'METRICS_ENABLED', True):
+        raise MiddlewareNotUsed
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            start = time.perf_counter()
+            response = await get_response(request)
+            record_request(request, response, start)
+            return response
+    else:
+        def middleware(request):
+            start = time.perf_counter()
+            response = get_response(request)
+            record_request(request, response, start)
+            return response
+    return middleware
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:55
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0008_delete_luffadisease_delete_luffamodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PredictionJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('category', models.CharField(max_length=20)),
+                ('filename', models.CharField(default='image.jpg', max_length=255)),
+                ('content_type', models.CharField(default='application/octet-stream', max_length=100)),
+                ('image', models.BinaryField(help_text='Uploaded image, cleared once the job has finished')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('available_at', models.DateTimeField(help_text='Earliest time a worker may (re)try the job')),
+                ('result', models.JSONField(blank=True, help_text='Response body of a successful prediction', null=True)),
+                ('cache_status', models.CharField(blank=True, max_length=10)),
+                ('error', models.TextField(blank=True)),
+                ('error_status', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('callback_url', models.URLField(blank=True, help_text='Notified with the job status when it finishes', max_length=500)),
+                ('callback_status', models.CharField(blank=True, help_text='delivered or failed', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Prediction Job',
+                'verbose_name_plural': 'Prediction Jobs',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'available_at', 'created_at'], name='prediction_job_queue_idx')],
+            },
+        ),
+    ]
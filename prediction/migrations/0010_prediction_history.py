@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0009_predictionjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Prediction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image_hash', models.CharField(help_text='SHA-256 of the uploaded bytes', max_length=64)),
+                ('category', models.CharField(max_length=20)),
+                ('disease', models.CharField(max_length=100)),
+                ('cache_status', models.CharField(blank=True, max_length=10)),
+                ('latency_ms', models.FloatField()),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Prediction',
+                'verbose_name_plural': 'Predictions',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['created_at'], name='prediction_created_idx'), models.Index(fields=['disease', 'created_at'], name='prediction_disease_idx'), models.Index(fields=['category', 'created_at'], name='prediction_category_idx'), models.Index(fields=['image_hash'], name='prediction_hash_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PredictionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('category', models.CharField(max_length=20)),
+                ('disease', models.CharField(max_length=100)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('cache_hits', models.PositiveIntegerField(default=0, help_text='Answered from the cache (HIT, NEAR or COALESCED)')),
+                ('total_latency_ms', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Prediction Rollup',
+                'verbose_name_plural': 'Prediction Rollups',
+                'ordering': ['-hour', 'category', 'disease'],
+                'constraints': [models.UniqueConstraint(fields=('hour', 'category', 'disease'), name='prediction_rollup_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prediction', '0010_prediction_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LuffaDisease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('disease_name', models.CharField(help_text='Name of the disease', max_length=100, unique=True)),
+                ('category', models.CharField(blank=True, choices=[('', 'Both'), ('Smooth', 'Smooth'), ('Spoonge', 'Spoonge')], help_text='Luffa type whose model predicts this class; blank for both', max_length=20)),
+                ('info', models.TextField(default="info isn't available", help_text='Detailed information about this disease')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Luffa Disease',
+                'verbose_name_plural': 'Luffa Diseases',
+                'ordering': ['disease_name'],
+            },
+        ),
+    ]
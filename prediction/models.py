@@ -0,0 +1,129 @@
+import uuid
+
+from django.db import models
+
+
+class LuffaDisease(models.Model):
+    """Disease text shown with predictions, served from the in-memory catalog (prediction/catalog.py)."""
+
+    CATEGORY_CHOICES = [
+        ('', 'Both'),
+        ('Smooth', 'Smooth'),
+        ('Spoonge', 'Spoonge'),
+    ]
+
+    disease_name = models.CharField(max_length=100, unique=True, help_text='Name of the disease')
+    category = models.CharField(max_length=20, blank=True, choices=CATEGORY_CHOICES,
+                                help_text='Luffa type whose model predicts this class; blank for both')
+    info = models.TextField(default="info isn't available", help_text='Detailed information about this disease')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Luffa Disease'
+        verbose_name_plural = 'Luffa Diseases'
+        ordering = ['disease_name']
+
+    def __str__(self):
+        return self.disease_name
+
+
+class PredictionJob(models.Model):
+    """A queued prediction; the table itself is the queue (see prediction/jobs.py)."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    category = models.CharField(max_length=20)
+    filename = models.CharField(max_length=255, default='image.jpg')
+    content_type = models.CharField(max_length=100, default='application/octet-stream')
+    image = models.BinaryField(help_text='Uploaded image, cleared once the job has finished')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(help_text='Earliest time a worker may (re)try the job')
+    result = models.JSONField(null=True, blank=True, help_text='Response body of a successful prediction')
+    cache_status = models.CharField(max_length=10, blank=True)
+    error = models.TextField(blank=True)
+    error_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    callback_url = models.URLField(max_length=500, blank=True, help_text='Notified with the job status when it finishes')
+    callback_status = models.CharField(max_length=10, blank=True, help_text='delivered or failed')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Prediction Job'
+        verbose_name_plural = 'Prediction Jobs'
+        ordering = ['-created_at']
+        indexes = [
+            # Workers claim the oldest job that is due
+            models.Index(fields=['status', 'available_at', 'created_at'], name='prediction_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.category} job {self.id} ({self.status})"
+
+    @property
+    def finished(self):
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+
+class Prediction(models.Model):
+    """One answered prediction, written in batches by prediction/history.py."""
+
+    image_hash = models.CharField(max_length=64, help_text='SHA-256 of the uploaded bytes')
+    category = models.CharField(max_length=20)
+    disease = models.CharField(max_length=100)
+    cache_status = models.CharField(max_length=10, blank=True)
+    latency_ms = models.FloatField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Prediction'
+        verbose_name_plural = 'Predictions'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at'], name='prediction_created_idx'),
+            models.Index(fields=['disease', 'created_at'], name='prediction_disease_idx'),
+            models.Index(fields=['category', 'created_at'], name='prediction_category_idx'),
+            models.Index(fields=['image_hash'], name='prediction_hash_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.category}: {self.disease} ({self.created_at:%Y-%m-%d %H:%M})"
+
+
+class PredictionRollup(models.Model):
+    """Hourly prediction counts per category and disease, kept up to date on each
+    history flush so summaries never scan the Prediction table."""
+
+    hour = models.DateTimeField()
+    category = models.CharField(max_length=20)
+    disease = models.CharField(max_length=100)
+    count = models.PositiveIntegerField(default=0)
+    cache_hits = models.PositiveIntegerField(default=0, help_text='Answered from the cache (HIT, NEAR or COALESCED)')
+    total_latency_ms = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name = 'Prediction Rollup'
+        verbose_name_plural = 'Prediction Rollups'
+        ordering = ['-hour', 'category', 'disease']
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'category', 'disease'], name='prediction_rollup_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H:00} {self.category}: {self.disease} x{self.count}"
+
+    @property
+    def average_latency_ms(self):
+        return self.total_latency_ms / self.count if self.count else 0.0
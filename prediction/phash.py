@@ -0,0 +1,162 @@
+import io
+import logging
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from PIL import Image, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# ====================================================
+# Perceptual Hashing
+# ====================================================
+# 64-bit dHash/pHash fingerprints survive resizing and JPEG re-encoding, so a
+# phone-resized copy of a leaf photo lands within a few bits of the original.
+# The index keeps one uint64 per entry in a ring buffer and answers lookups
+# with a vectorised XOR + popcount scan over the whole array.
+HASH_SIZE = 8
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(values):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _grayscale(image, size):
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(image))
+    # draft() lets the JPEG decoder downscale by up to 8x while decoding
+    image.draft("L", (size[0] * 4, size[1] * 4))
+    return image.convert("L").resize(size, Image.Resampling.BILINEAR)
+
+
+def _pack_bits(bits):
+    return int(np.packbits(bits.astype(np.uint8).ravel()).view(">u8")[0])
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """Difference hash: sign of horizontal gradients on a (hash_size+1)×hash_size thumbnail."""
+    pixels = np.asarray(_grayscale(image, (hash_size + 1, hash_size)), dtype=np.int16)
+    return _pack_bits(pixels[:, 1:] > pixels[:, :-1])
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix * np.sqrt(2 / n)
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def phash(image, hash_size=HASH_SIZE):
+    """DCT hash: low-frequency 8×8 DCT coefficients of a 32×32 thumbnail against their median."""
+    pixels = np.asarray(_grayscale(image, (32, 32)), dtype=np.float64)
+    low = (_DCT_32 @ pixels @ _DCT_32.T)[:hash_size, :hash_size]
+    return _pack_bits(low > np.median(low))
+
+
+HASH_FUNCTIONS = {'dhash': dhash, 'phash': phash}
+
+
+def image_hash(data, algorithm='dhash'):
+    """Hash raw image bytes, returning ``None`` when the bytes are not a decodable image."""
+    try:
+        return HASH_FUNCTIONS[algorithm](data)
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        logger.warning(f"Could not compute {algorithm} for upload: {e}")
+        return None
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+class PerceptualIndex:
+    """Fixed-capacity ring buffer of 64-bit hashes and their stored values, per category."""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._hashes = {}
+        self._values = {}
+        self._sizes = {}
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def add(self, value_hash, category, value):
+        with self._lock:
+            if category not in self._hashes:
+                self._hashes[category] = np.zeros(self.max_entries, dtype=np.uint64)
+                self._values[category] = [None] * self.max_entries
+                self._sizes[category] = 0
+                self._next[category] = 0
+            slot = self._next[category]
+            self._hashes[category][slot] = value_hash
+            self._values[category][slot] = value
+            self._next[category] = (slot + 1) % self.max_entries
+            self._sizes[category] = min(self._sizes[category] + 1, self.max_entries)
+
+    def distances(self, value_hash, category):
+        """Hamming distance from ``value_hash`` to every stored hash of ``category``."""
+        with self._lock:
+            return self._distances(value_hash, category)
+
+    def _distances(self, value_hash, category):
+        size = self._sizes.get(category, 0)
+        if not size:
+            return np.empty(0, dtype=np.uint8)
+        return _popcount(self._hashes[category][:size] ^ np.uint64(value_hash))
+
+    def search(self, value_hash, category, max_distance):
+        """Return ``(distance, value)`` of the nearest entry within ``max_distance``, or ``None``."""
+        # Held for the whole lookup so a concurrent ``add`` cannot overwrite the matched
+        # slot between the distance scan and reading its value; the scan is a few µs
+        with self._lock:
+            distances = self._distances(value_hash, category)
+            if not len(distances):
+                return None
+            best = int(np.argmin(distances))
+            distance = int(distances[best])
+            if distance > max_distance:
+                return None
+            return distance, self._values[category][best]
+
+    def clear(self):
+        with self._lock:
+            self._hashes.clear()
+            self._values.clear()
+            self._sizes.clear()
+            self._next.clear()
+
+    def __len__(self):
+        return sum(self._sizes.values())
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_perceptual_index():
+    """Return the process-wide ``PerceptualIndex``, or ``None`` when disabled."""
+    global _index
+    if not getattr(settings, 'PREDICTION_PHASH_ENABLED', True):
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = PerceptualIndex(getattr(settings, 'PREDICTION_PHASH_MAX_ENTRIES', 4096))
+    return _index
+
+
+@receiver(setting_changed)
+def _reset_perceptual_index(setting, **kwargs):
+    global _index
+    if setting.startswith('PREDICTION_PHASH'):
+        _index = None
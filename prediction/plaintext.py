@@ -0,0 +1,231 @@
+import re
+
+# ====================================================
+# Markdown Removal
+# ====================================================
+# The chatbot is asked for plain text but still emits markdown now and then.
+# ``remove_markdown`` strips it from a complete reply and ``MarkdownStripper``
+# does the same for a streamed reply, releasing text as soon as its output is
+# known. Both reproduce the original nine-pass regex implementation, kept as
+# ``remove_markdown_regex`` in plaintext_reference.py for tests and benchmarks.
+
+
+BOLD = re.compile(r'\*\*(.*?)\*\*')
+ITALIC = re.compile(r'\*(.*?)\*')
+UNDERSCORE = re.compile(r'_(.*?)_')
+CODE = re.compile(r'`(.*?)`')
+# Header, bullet and numbered-list markers removed in one pass. Each marker's
+# trailing \s* may run over newlines, exactly like the three separate passes.
+LINE_PREFIX = re.compile(r'^(?:#+\s*(?:[*\-+]\s*)?(?:\d+\.\s*)?|[*\-+]\s*(?:\d+\.\s*)?|\d+\.\s*)', re.MULTILINE)
+LINK = re.compile(r'\[([^\]]+)\]\([^\)]+\)')
+BLANK_LINES = re.compile(r'\n\s*\n')
+
+
+def strip_inline(text):
+    """Remove paired ``**``, ``*``, ``_`` and backtick markers (line-local)."""
+    # Skip passes whose marker does not occur: plain-text replies pay for none
+    if '*' in text:
+        if '**' in text:
+            text = BOLD.sub(r'\1', text)
+        if '*' in text:
+            text = ITALIC.sub(r'\1', text)
+    if '_' in text:
+        text = UNDERSCORE.sub(r'\1', text)
+    if '`' in text:
+        text = CODE.sub(r'\1', text)
+    return text
+
+
+def remove_markdown(text):
+    """Convert a markdown chatbot reply to plain text."""
+    text = LINE_PREFIX.sub('', strip_inline(text))
+    if '](' in text:
+        text = LINK.sub(r'\1', text)
+    if '\n' in text:
+        text = BLANK_LINES.sub('\n\n', text)
+    return text.strip()
+
+
+# ----------------------------------------------------
+# Incremental stripping
+# ----------------------------------------------------
+STAR_RUN = re.compile(r'\*+')
+# Line prefixes in order of removal; a level's trailing whitespace may consume
+# the following lines, after which only the later levels still apply.
+HEADER, BULLET, NUMBER = 0, 1, 2
+PREFIX_PATTERNS = (r'(?P<h>#+[^\S\n]*)?', r'(?P<b>[*\-+][^\S\n]*)?', r'(?P<n>\d+\.[^\S\n]*)?')
+PARTIAL_PREFIX_PATTERNS = (r'(?:#+[^\S\n]*)?', r'(?:[*\-+][^\S\n]*)?', r'(?:\d+(?:\.[^\S\n]*)?)?')
+PREFIX = [re.compile(''.join(PREFIX_PATTERNS[level:])) for level in range(3)] + [re.compile('')]
+PARTIAL_PREFIX = [re.compile(''.join(PARTIAL_PREFIX_PATTERNS[level:])) for level in range(3)] + [re.compile('')]
+MARKUP = re.compile(r'[\n*_`\[]')
+PARTIAL_LINK = re.compile(r'\[(?:[^\]]+(?:\](?:\([^\)]*)?)?)?')
+
+
+def _pairs(positions, width=1):
+    """Consecutive (opener, end-of-closer) pairs and the unpaired last position, if any."""
+    pairs = [(positions[i], positions[i + 1] + width) for i in range(0, len(positions) - 1, 2)]
+    return pairs, positions[-1] if len(positions) % 2 else None
+
+
+def _inline_cut(text):
+    """Length of the prefix of an unfinished line whose inline markers are all resolved."""
+    unresolved = [len(text)]
+    intervals = []
+    for marker in '_`':
+        if marker in text:
+            positions = [m.start() for m in re.finditer(re.escape(marker), text)]
+            pairs, last = _pairs(positions)
+            intervals += pairs
+            if last is not None:
+                unresolved.append(last)
+    if '*' in text:
+        doubles, singles = [], []
+        for run in STAR_RUN.finditer(text):
+            start, end = run.span()
+            doubles.extend(range(start, end - 1, 2))
+            if (end - start) % 2:
+                singles.append(end - 1)
+        if singles and singles[-1] == len(text) - 1:
+            # A trailing lone star may still become half of a "**"
+            unresolved.append(singles[-1])
+        pairs, open_double = _pairs(doubles, width=2)
+        intervals += pairs
+        if open_double is not None:
+            # Until it closes, an open "**" might fall back to two single stars
+            unresolved.append(open_double)
+            singles = [position for position in singles if position < open_double]
+        if singles:
+            pairs, last = _pairs(singles)
+            intervals += pairs
+            if last is not None:
+                unresolved.append(last)
+
+    cut = min(unresolved)
+    moved = True
+    while moved:
+        moved = False
+        for opener, end in intervals:
+            if opener < cut < end:
+                cut = opener
+                moved = True
+    return cut
+
+
+class MarkdownStripper:
+    """Incremental ``remove_markdown`` for streamed replies.
+
+    ``feed`` returns the plain text that can already be released; only an
+    unterminated marker (``**``, ``*``, ``_``, backtick, link) or a possible
+    line prefix is held back. ``flush`` returns the rest at the end of the
+    stream. Output matches ``remove_markdown`` except for links whose text or
+    URL spans a newline, which are left as-is.
+    """
+
+    def __init__(self):
+        self._line = ""        # inline: unresolved raw text of the current line
+        self._head = ""        # prefix: line start that may still be a prefix
+        self._in_head = True
+        self._carry = None     # prefix level whose \s* is consuming whitespace
+        self._link = ""        # links: text from a "[" that may start a link
+        self._space = ""       # blank lines / strip(): trailing whitespace
+        self._started = False
+
+    def feed(self, chunk):
+        out = []
+        if not (self._line or self._link or self._in_head or MARKUP.search(chunk)):
+            # Mid-line plain text: nothing to hold back or remove
+            self._output(chunk, out)
+            return ''.join(out)
+        for i, piece in enumerate(chunk.split('\n')):
+            if i:
+                self._end_line(out)
+            self._line += piece
+            cut = _inline_cut(self._line)
+            if cut:
+                self._prefix(strip_inline(self._line[:cut]), out, final=False)
+                self._line = self._line[cut:]
+        return ''.join(out)
+
+    def flush(self):
+        out = []
+        self._end_line(out, newline=False)
+        self._space = ""
+        return ''.join(out)
+
+    def _end_line(self, out, newline=True):
+        text, self._line = strip_inline(self._line), ""
+        consumed = self._prefix(text, out, final=True)
+        self._links("", out, final=True)
+        if newline and not consumed:
+            self._output("\n", out)
+        self._head, self._in_head = "", True
+
+    def _prefix(self, text, out, final):
+        """Remove header / bullet / number markers; returns True if the whole line was consumed."""
+        if not self._in_head:
+            self._links(text, out, final)
+            return False
+        head = self._head = self._head + text
+
+        level = HEADER
+        if self._carry is not None:
+            stripped = head.lstrip()
+            if not stripped:
+                if final:
+                    return True  # whitespace-only line swallowed by the previous marker
+                return False
+            if head[0].isspace():
+                level = self._carry + 1
+            head = stripped
+
+        if not final and PARTIAL_PREFIX[level].fullmatch(head):
+            return False
+        match = PREFIX[level].match(head)
+        self._in_head = False
+        if final and match.end() == len(head) and (match.end() or self._carry is not None):
+            # Line is nothing but markers: their \s* runs on into the next line
+            groups = [name for name, value in match.groupdict().items() if value is not None]
+            if groups:
+                self._carry = 'hbn'.index(groups[-1])
+            return True
+        self._carry = None
+        self._links(head[match.end():], out, final)
+        return False
+
+    def _links(self, text, out, final):
+        work = self._link + text
+        self._link = ""
+        parts = []
+        position = 0
+        while True:
+            i = work.find('[', position)
+            if i < 0:
+                parts.append(work[position:])
+                break
+            match = LINK.match(work, i)
+            if match:
+                parts.append(work[position:i])
+                parts.append(match.group(1))
+                position = match.end()
+            elif not final and PARTIAL_LINK.fullmatch(work, i):
+                parts.append(work[position:i])
+                self._link = work[i:]
+                break
+            else:
+                parts.append(work[position:i + 1])
+                position = i + 1
+        self._output(''.join(parts), out)
+
+    def _output(self, text, out):
+        text = self._space + text
+        end = len(text.rstrip())
+        self._space = text[end:]
+        if not end:
+            return
+        text = text[:end]
+        if not self._started:
+            text = text.lstrip()
+            self._started = True
+        if '\n' in text:
+            text = BLANK_LINES.sub('\n\n', text)
+        out.append(text)
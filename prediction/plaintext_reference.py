@@ -0,0 +1,28 @@
+import re
+
+# ====================================================
+# Reference Markdown Removal
+# ====================================================
+# The original nine-pass implementation that ``remove_markdown`` and
+# ``MarkdownStripper`` (plaintext.py) must reproduce. Not used to serve
+# replies: it is the oracle for the equivalence tests and the baseline of
+# ``manage.py bench_markdown``.
+
+
+def remove_markdown_regex(text):
+    # Remove bold/italic markdown
+    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)  # Bold
+    text = re.sub(r'\*(.*?)\*', r'\1', text)      # Italic
+    text = re.sub(r'_(.*?)_', r'\1', text)        # Italic underscore
+    text = re.sub(r'`(.*?)`', r'\1', text)        # Inline code
+    # Remove headers
+    text = re.sub(r'^#+\s*', '', text, flags=re.MULTILINE)
+    # Remove bullet points
+    text = re.sub(r'^[\*\-\+]\s*', '', text, flags=re.MULTILINE)
+    # Remove numbered lists
+    text = re.sub(r'^\d+\.\s*', '', text, flags=re.MULTILINE)
+    # Remove links
+    text = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', text)
+    # Remove extra newlines
+    text = re.sub(r'\n\s*\n', '\n\n', text)
+    return text.strip()
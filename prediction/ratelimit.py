@@ -0,0 +1,277 @@
+import functools
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import JsonResponse
+
+from .metrics import RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+# ====================================================
+# Rate Limiting
+# ====================================================
+# Token buckets kept in the RATE_LIMIT_CACHE_ALIAS cache, so every worker sharing
+# that cache (Redis, memcached) shares the buckets. Each bucket is one integer,
+# its "theoretical arrival time" in microseconds (GCRA): a request adds its cost
+# with one atomic incr and is refused when the value runs more than the bucket
+# capacity ahead of the clock. A request that is refused gives its tokens back.
+# When the cache is unreachable requests are let through (fail open).
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+class RateLimited(Exception):
+    def __init__(self, scope, bucket, retry_after):
+        super().__init__(f"{scope} rate limit ({bucket}) exceeded, retry in {retry_after:.1f}s")
+        self.scope = scope
+        self.bucket = bucket
+        self.retry_after = retry_after
+
+
+def parse_rate(rate):
+    """``"30/m"`` -> ``(30, 60)``: a capacity of 30 tokens refilled over 60 seconds."""
+    count, _, period = rate.partition("/")
+    seconds = PERIODS.get(period[-1:].lower())
+    if seconds is None:
+        raise ValueError(f"Invalid rate {rate!r}, expected e.g. '30/m'")
+    return int(count), seconds * int(period[:-1] or 1)
+
+
+class TokenBucket:
+    def __init__(self, rate, cache_alias="default", prefix="ratelimit"):
+        self.rate = rate
+        self.capacity, period = parse_rate(rate)
+        self.interval = period * 1_000_000 // self.capacity   # µs per token
+        self.tolerance = self.interval * self.capacity         # µs the bucket may run ahead
+        # A busy key's expiry is not refreshed by incr; when it lapses the bucket refills early
+        self.timeout = max(3600, 2 * math.ceil(self.tolerance / 1_000_000))
+        self.cache = caches[cache_alias]
+        self.prefix = prefix
+
+    def hit(self, key, cost=1):
+        """Take ``cost`` tokens; returns 0 when allowed, else seconds until they are available."""
+        key = f"{self.prefix}:{key}"
+        increment = self.interval * min(cost, self.capacity)
+        now = time.time_ns() // 1000
+        try:
+            arrival = self.cache.incr(key, increment)
+        except ValueError:
+            if self.cache.add(key, now + increment, self.timeout):
+                return 0
+            arrival = self.cache.incr(key, increment)
+        if arrival < now + increment:
+            # The bucket had refilled completely: restart it from now
+            self.cache.set(key, now + increment, self.timeout)
+            return 0
+        if arrival - now > self.tolerance:
+            self.cache.decr(key, increment)
+            self.cache.touch(key, self.timeout)
+            return (arrival - now - self.tolerance) / 1_000_000
+        return 0
+
+    def refund(self, key, cost=1):
+        try:
+            self.cache.decr(f"{self.prefix}:{key}", self.interval * min(cost, self.capacity))
+        except ValueError:
+            pass
+
+
+def client_ip(request):
+    """The client address, read from X-Forwarded-For behind RATE_LIMIT_TRUSTED_PROXIES proxies."""
+    proxies = getattr(settings, 'RATE_LIMIT_TRUSTED_PROXIES', 0)
+    if proxies:
+        forwarded = [hop.strip() for hop in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",") if hop.strip()]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+class RateLimiter:
+    """The client (per IP, or per API key) and global buckets of one scope."""
+
+    def __init__(self, scope, client=None, key=None, global_=None, api_keys=(), cache_alias="default"):
+        self.scope = scope
+        self.api_keys = frozenset(api_keys)
+        self.client = TokenBucket(client, cache_alias) if client else None
+        self.key = TokenBucket(key, cache_alias) if key else self.client
+        self.global_ = TokenBucket(global_, cache_alias) if global_ else None
+        self.local_cache = isinstance(caches[cache_alias], LocMemCache)
+
+    def identify(self, request):
+        """``(kind, bucket, key)`` for the caller: a known X-API-Key, else the client IP."""
+        api_key = request.headers.get("X-API-Key")
+        if api_key and api_key in self.api_keys:
+            return "key", self.key, f"{self.scope}:key:{hashlib.sha256(api_key.encode()).hexdigest()[:16]}"
+        return "client", self.client, f"{self.scope}:ip:{client_ip(request)}"
+
+    def check(self, request, cost=1):
+        """Take ``cost`` tokens from the caller's and the global bucket, or raise ``RateLimited``."""
+        kind, bucket, key = self.identify(request)
+        try:
+            if bucket is not None:
+                retry_after = bucket.hit(key, cost)
+                if retry_after:
+                    raise RateLimited(self.scope, kind, retry_after)
+            if self.global_ is not None:
+                retry_after = self.global_.hit(f"{self.scope}:global", cost)
+                if retry_after:
+                    if bucket is not None:
+                        bucket.refund(key, cost)
+                    raise RateLimited(self.scope, "global", retry_after)
+        except RateLimited as e:
+            RATE_LIMITED.inc(self.scope, e.bucket)
+            raise
+        except Exception as e:
+            logger.warning(f"Rate limit check failed, letting the request through: {e}")
+
+    async def acheck(self, request, cost=1):
+        # Local-memory buckets take microseconds; only network caches leave the event loop
+        if self.local_cache:
+            return self.check(request, cost)
+        return await sync_to_async(self.check, thread_sensitive=False)(request, cost)
+
+
+def too_many_requests(error):
+    retry_after = max(1, math.ceil(error.retry_after))
+    response = JsonResponse({"error": "Too many requests, retry shortly", "retry_after": retry_after}, status=429)
+    response["Retry-After"] = str(retry_after)
+    return response
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(scope):
+    """Return the process-wide ``RateLimiter`` for ``scope``, or ``None`` when rate limiting is off."""
+    if not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+        return None
+    limiter = _limiters.get(scope)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(scope)
+            if limiter is None:
+                rates = settings.RATE_LIMITS.get(scope, {})
+                limiter = _limiters[scope] = RateLimiter(
+                    scope,
+                    client=rates.get("client"),
+                    key=rates.get("key"),
+                    global_=rates.get("global"),
+                    api_keys=settings.RATE_LIMIT_API_KEYS,
+                    cache_alias=settings.RATE_LIMIT_CACHE_ALIAS,
+                )
+    return limiter
+
+
+def rate_limit(scope, cost=None):
+    """View decorator: answer POSTs over the ``scope`` limits with 429 and Retry-After.
+
+    ``cost(request)`` gives the tokens a request takes (default 1).
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                limiter = get_rate_limiter(scope)
+                if limiter is not None and request.method == "POST":
+                    try:
+                        await limiter.acheck(request, cost(request) if cost else 1)
+                    except RateLimited as e:
+                        logger.warning(f"Rejecting request from {client_ip(request)}: {e}")
+                        return too_many_requests(e)
+                return await view(request, *args, **kwargs)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                limiter = get_rate_limiter(scope)
+                if limiter is not None and request.method == "POST":
+                    try:
+                        limiter.check(request, cost(request) if cost else 1)
+                    except RateLimited as e:
+                        logger.warning(f"Rejecting request from {client_ip(request)}: {e}")
+                        return too_many_requests(e)
+                return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ====================================================
+# Upstream Admission Control
+# ====================================================
+# A per-process cap on calls in flight to each upstream (HF_MAX_IN_FLIGHT,
+# OPENROUTER_MAX_IN_FLIGHT). Calls over the cap fail at once with 503 and
+# Retry-After instead of queueing behind a slow upstream; cache hits never
+# take a slot.
+class Saturated(Exception):
+    def __init__(self, name, limit, retry_after):
+        super().__init__(f"{limit} {name} calls already in flight")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class InFlightLimiter:
+    def __init__(self, name, limit, retry_after=1):
+        self.name = name
+        self.limit = limit
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.limit and self.in_flight >= self.limit:
+                self.rejected += 1
+                raise Saturated(self.name, self.limit, self.retry_after)
+            self.in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+UPSTREAM_LIMIT_SETTINGS = {
+    "hf": "HF_MAX_IN_FLIGHT",
+    "openrouter": "OPENROUTER_MAX_IN_FLIGHT",
+}
+
+_inflight = {}
+
+
+def get_inflight_limiter(upstream):
+    """Return the process-wide ``InFlightLimiter`` for ``upstream`` ("hf" or "openrouter")."""
+    limiter = _inflight.get(upstream)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _inflight.get(upstream)
+            if limiter is None:
+                limiter = _inflight[upstream] = InFlightLimiter(
+                    upstream,
+                    getattr(settings, UPSTREAM_LIMIT_SETTINGS[upstream], 0),
+                    retry_after=getattr(settings, 'UPSTREAM_BUSY_RETRY_AFTER', 1),
+                )
+    return limiter
+
+
+@receiver(setting_changed)
+def _reset_limiters(setting, **kwargs):
+    if setting.startswith('RATE_LIMIT'):
+        _limiters.clear()
+    if setting in UPSTREAM_LIMIT_SETTINGS.values() or setting == 'UPSTREAM_BUSY_RETRY_AFTER':
+        _inflight.clear()
@@ -0,0 +1,306 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# ====================================================
+# Circuit Breaker
+# ====================================================
+# Wraps calls to the Hugging Face Space. While the recent failure ratio (or
+# ratio of slow calls) is below threshold the circuit is closed; once it is
+# exceeded it opens and calls fail fast with a 503 for ``open_seconds``. Then a
+# few probe calls are let through (half-open): success closes the circuit,
+# failure opens it again.
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"circuit open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name="upstream", window_size=20, window_seconds=60, min_calls=10, failure_ratio=0.5,
+                 slow_call_ms=10000, slow_ratio=0.8, open_seconds=30, half_open_calls=1):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_ms = slow_call_ms
+        self.slow_ratio = slow_ratio
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.rejected = 0
+        self.transitions = {}
+        self._calls = deque(maxlen=window_size)     # (time, failed, slow)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        key = f"{self.state}->{state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        logger.warning(f"Circuit {self.name}: {self.state} -> {state}")
+        self.state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state != CLOSED:
+            self._probes = 0
+        else:
+            self._calls.clear()
+
+    def before_call(self):
+        """Raise ``CircuitOpen`` unless a call may go upstream now."""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.open_seconds - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpen(remaining)
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpen(1)
+                self._probes += 1
+
+    def record(self, failed, latency_ms):
+        """Record the outcome of a call allowed by ``before_call``."""
+        slow = latency_ms >= self.slow_call_ms
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._transition(OPEN if failed or slow else CLOSED)
+                return
+            now = time.monotonic()
+            self._calls.append((now, failed, slow))
+            if self.state == CLOSED:
+                failures, slow_calls, total = self._window(now)
+                if total >= self.min_calls and (failures / total >= self.failure_ratio
+                                                or slow_calls / total >= self.slow_ratio):
+                    self._transition(OPEN)
+
+    def _window(self, now):
+        recent = [(failed, slow) for at, failed, slow in self._calls if now - at <= self.window_seconds]
+        return sum(failed for failed, _ in recent), sum(slow for _, slow in recent), len(recent)
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self._calls.clear()
+            self._probes = 0
+
+    def stats(self):
+        with self._lock:
+            failures, slow_calls, total = self._window(time.monotonic())
+            return {
+                "state": self.state,
+                "calls": total,
+                "failure_ratio": round(failures / total, 3) if total else 0.0,
+                "slow_ratio": round(slow_calls / total, 3) if total else 0.0,
+                "rejected": self.rejected,
+                "transitions": dict(self.transitions),
+            }
+
+
+# ====================================================
+# Hedged Requests
+# ====================================================
+# A call that has not answered by the observed p95 latency gets a second,
+# identical request; whichever succeeds first is used. Hedges are capped at
+# ``max_ratio`` of all calls so a slow upstream does not see double traffic.
+# Async calls cancel the loser. Sync calls race two futures on a pool of
+# ``max_workers`` threads; when every worker is busy a call runs unhedged in
+# the calling thread, so the pool never limits how many calls run at once.
+class LatencyTracker:
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+
+    def add(self, latency_ms):
+        self._samples.append(latency_ms)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, q):
+        samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+
+class Hedger:
+    def __init__(self, enabled=False, percentile=95, min_samples=20, min_delay_ms=50, max_ratio=0.1, max_workers=12):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay_ms = min_delay_ms
+        self.max_ratio = max_ratio
+        self.latencies = LatencyTracker()
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._max_workers = max_workers
+        self._active = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging this call, or ``None`` to not hedge it."""
+        self.calls += 1
+        if not self.enabled or len(self.latencies) < self.min_samples:
+            return None
+        return max(self.latencies.percentile(self.percentile), self.min_delay_ms) / 1000
+
+    def _take_budget(self):
+        with self._lock:
+            if self.hedges >= self.max_ratio * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+    def _submit(self, fn):
+        """Run ``fn`` on the hedge pool, or return ``None`` when every worker is busy."""
+        with self._lock:
+            if self._active >= self._max_workers:
+                return None
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="hf-hedge")
+            self._active += 1
+            future = self._executor.submit(fn)
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future):
+        with self._lock:
+            self._active -= 1
+
+    def call(self, fn, hedge=True):
+        """Run ``fn()``, hedging it with a second call when it is slow."""
+        delay = self.hedge_delay() if hedge else None
+        primary = self._submit(fn) if delay is not None else None
+        if primary is None:
+            return fn()
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_budget():
+            return primary.result()
+        second = self._submit(fn)
+        if second is None:
+            with self._lock:
+                self.hedges -= 1
+            return primary.result()
+        logger.info(f"Hedging upstream call after {delay * 1000:.0f} ms")
+        pending = {primary, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The loser keeps its worker until it returns; its result is ignored
+                    if future is second:
+                        self.hedge_wins += 1
+                    return future.result()
+        # Both failed: report the original call's error
+        return primary.result()
+
+    async def acall(self, coroutine_fn, hedge=True):
+        """Async ``call``; the losing request is cancelled."""
+        delay = self.hedge_delay() if hedge else None
+        if delay is None:
+            return await coroutine_fn()
+        primary = asyncio.ensure_future(coroutine_fn())
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self._take_budget():
+            return await primary
+        logger.info(f"Hedging upstream call after {delay * 1000:.0f} ms")
+        second = asyncio.ensure_future(coroutine_fn())
+        pending = {primary, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "p95_ms": self.latencies.percentile(95),
+        }
+
+
+_breaker = None
+_hedger = None
+_lock = threading.Lock()
+
+
+def get_upstream_breaker():
+    """Return the process-wide circuit breaker for the Hugging Face Space, or ``None`` when disabled."""
+    global _breaker
+    if not getattr(settings, 'HF_BREAKER_ENABLED', True):
+        return None
+    if _breaker is None:
+        with _lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker(
+                    name="hf",
+                    window_size=settings.HF_BREAKER_WINDOW_SIZE,
+                    window_seconds=settings.HF_BREAKER_WINDOW_SECONDS,
+                    min_calls=settings.HF_BREAKER_MIN_CALLS,
+                    failure_ratio=settings.HF_BREAKER_FAILURE_RATIO,
+                    slow_call_ms=settings.HF_BREAKER_SLOW_CALL_MS,
+                    slow_ratio=settings.HF_BREAKER_SLOW_RATIO,
+                    open_seconds=settings.HF_BREAKER_OPEN_SECONDS,
+                )
+    return _breaker
+
+
+def get_upstream_hedger():
+    global _hedger
+    if _hedger is None:
+        with _lock:
+            if _hedger is None:
+                _hedger = Hedger(
+                    enabled=settings.HF_HEDGE_ENABLED,
+                    percentile=settings.HF_HEDGE_PERCENTILE,
+                    min_delay_ms=settings.HF_HEDGE_MIN_DELAY_MS,
+                    max_ratio=settings.HF_HEDGE_MAX_RATIO,
+                    max_workers=settings.HF_HEDGE_WORKERS,
+                )
+    return _hedger
+
+
+def upstream_health():
+    """Breaker and hedging state for the Space, as reported by /readyz."""
+    breaker = get_upstream_breaker()
+    return {
+        "breaker": breaker.stats() if breaker is not None else None,
+        "hedging": get_upstream_hedger().stats(),
+    }
+
+
+@receiver(setting_changed)
+def _reset_resilience(setting, **kwargs):
+    global _breaker, _hedger
+    if setting.startswith('HF_'):
+        _breaker = None
+        _hedger = None
@@ -0,0 +1,701 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from PIL import UnidentifiedImageError
+
+from .batching import MicroBatcher, Overloaded
+from .cache import get_prediction_cache
+from .catalog import get_disease_catalog
+from .history import get_history_recorder
+from .imaging import prepare_upload, sniff_image_type
+from .inference import LEAF_TYPE_MODEL, ReferenceModel, preprocess
+from .metrics import PREDICTION_ERRORS, PREDICTIONS, STAGE_SECONDS, UPSTREAM_SECONDS
+from .phash import get_perceptual_index, image_hash
+from .ratelimit import Saturated, get_inflight_limiter
+from .resilience import CLOSED, CircuitOpen, get_upstream_breaker, get_upstream_hedger
+from .singleflight import LEADER, SHARED, get_single_flight
+from .upstream import get_async_hf_client, get_hf_client
+from .uploads import archive_upload, content_hash
+
+logger = logging.getLogger(__name__)
+
+# ====================================================
+# Prediction Service
+# ====================================================
+# Shared by the single-image, batch, async and job views: exact cache,
+# near-duplicate index, then the category's prediction backend, with
+# identical concurrent misses coalesced into one backend call.
+CATEGORIES = ["Smooth", "Spoonge"]
+# model_type=auto asks every category's model and keeps the best answer
+AUTO = "auto"
+
+
+class PredictionError(Exception):
+    def __init__(self, message, status=500, retry_after=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.retry_after = retry_after
+
+
+def normalize_category(value, allow_auto=False):
+    """Map a user-supplied ``model_type`` to the Space's category name.
+
+    With ``allow_auto``, "auto" is accepted and returned as ``AUTO``. A missing
+    value means PREDICTION_DEFAULT_MODEL_TYPE.
+    """
+    category = (value or getattr(settings, 'PREDICTION_DEFAULT_MODEL_TYPE', "Smooth")).capitalize()
+    # Map "Sponge" to "Spoonge" for API compatibility
+    if category == "Sponge":
+        category = "Spoonge"
+    if allow_auto and category == AUTO.capitalize():
+        return AUTO
+    if category not in CATEGORIES:
+        logger.warning(f"Invalid category provided: {category}")
+        if allow_auto:
+            raise PredictionError("Invalid category. Must be 'Smooth', 'Spoonge' or 'auto'", status=400)
+        raise PredictionError("Invalid category. Must be 'Smooth' or 'Spoonge'", status=400)
+    return category
+
+
+def check_image(image_bytes):
+    """Reject uploads whose magic bytes are not a known image format."""
+    if not getattr(settings, 'PREDICTION_NORMALIZE_ENABLED', True):
+        return
+    start = time.perf_counter()
+    image_type = sniff_image_type(image_bytes)
+    logger.info(f"Sniffed upload: type={image_type} sniff={(time.perf_counter() - start) * 1000:.3f}ms")
+    if image_type is None:
+        raise PredictionError("Unsupported file type. Upload a JPEG, PNG, WebP, GIF, BMP, TIFF or HEIC image", status=415)
+
+
+def upstream_upload(image_bytes, filename, content_type):
+    """The ``(data, filename, content_type)`` to send upstream, downscaled when enabled."""
+    if not getattr(settings, 'PREDICTION_NORMALIZE_ENABLED', True):
+        return image_bytes, filename, content_type
+    with STAGE_SECONDS.time("preprocess"):
+        return prepare_upload(image_bytes, filename, content_type,
+                              max_side=settings.PREDICTION_NORMALIZE_MAX_SIDE,
+                              quality=settings.PREDICTION_NORMALIZE_QUALITY)
+
+
+def lookup_prediction(image_bytes, category):
+    """Check the exact cache and near-duplicate index before going upstream.
+
+    Returns ``(key, result, cache_status)``; ``result`` is ``None`` on a miss and
+    ``key`` must then be passed to ``store_prediction``. Raises ``PredictionError``
+    for uploads that are not images.
+    """
+    with STAGE_SECONDS.time("cache_lookup"):
+        return _lookup_prediction(image_bytes, category)
+
+
+def _lookup_prediction(image_bytes, category):
+    check_image(image_bytes)
+    digest = content_hash(image_bytes)
+    archive_upload(image_bytes, digest)
+
+    prediction_cache = get_prediction_cache()
+    cached = prediction_cache.get(digest, category)
+    if cached is not None:
+        logger.info(f"Prediction cache hit: disease={cached['prediction']}, category={category}")
+        return (digest, None), cached, "HIT"
+
+    # Near-duplicate lookup catches resized / re-encoded copies
+    perceptual_index = get_perceptual_index()
+    perceptual_hash = None
+    if perceptual_index is not None:
+        perceptual_hash = image_hash(image_bytes, settings.PREDICTION_PHASH_ALGORITHM)
+    if perceptual_hash is not None:
+        match = perceptual_index.search(perceptual_hash, category, settings.PREDICTION_PHASH_MAX_DISTANCE)
+        if match is not None:
+            distance, near = match
+            logger.info(f"Near-duplicate hit: distance={distance}, disease={near['prediction']}, category={category}")
+            prediction_cache.set(digest, category, near)
+            return (digest, perceptual_hash), near, "NEAR"
+
+    return (digest, perceptual_hash), None, "MISS"
+
+
+def store_prediction(key, category, result):
+    digest, perceptual_hash = key
+    get_prediction_cache().set(digest, category, result)
+    perceptual_index = get_perceptual_index()
+    if perceptual_hash is not None and perceptual_index is not None:
+        perceptual_index.add(perceptual_hash, category, result)
+
+
+def flight_key(key, category):
+    """Single-flight key for a cache miss: identical image bytes and category."""
+    return f"{category}-{key[0]}"
+
+
+def record_prediction(category, start, digest, result, cache_status):
+    """Count an answered prediction and queue it for the history table."""
+    PREDICTIONS.inc(category, result["prediction"], cache_status)
+    recorder = get_history_recorder()
+    if recorder is not None:
+        recorder.record(digest, category, result["prediction"], cache_status, (time.perf_counter() - start) * 1000)
+    return result, cache_status
+
+
+def predict_image(image_bytes, category, filename="image.jpg", content_type="application/octet-stream",
+                  record=True):
+    """Return ``(result, cache_status)`` for an image, where ``result`` has
+    ``prediction`` and ``category`` keys and ``cache_status`` is HIT, NEAR, MISS or
+    COALESCED (shared the result of an identical request that was in flight).
+
+    ``category`` may be ``AUTO`` (see ``predict_auto``). Raises ``PredictionError``
+    when no prediction could be obtained.
+    """
+    if category == AUTO:
+        return predict_auto(image_bytes, filename, content_type, record=record)
+    start = time.perf_counter()
+    try:
+        digest, result, cache_status = _predict_image(image_bytes, category, filename, content_type)
+    except PredictionError as e:
+        PREDICTION_ERRORS.inc(category, str(e.status))
+        raise
+    if record:
+        record_prediction(category, start, digest, result, cache_status)
+    return result, cache_status
+
+
+def _predict_image(image_bytes, category, filename, content_type):
+    key, result, cache_status = lookup_prediction(image_bytes, category)
+    if result is not None:
+        return key[0], result, cache_status
+
+    def call_backend():
+        result = get_backend(category).predict(image_bytes, category, filename=filename, content_type=content_type)
+        store_prediction(key, category, result)
+        return result
+
+    single_flight = get_single_flight()
+    if single_flight is None:
+        return key[0], call_backend(), "MISS"
+    result, source = single_flight.do(flight_key(key, category), call_backend)
+    if source == SHARED:
+        store_prediction(key, category, result)
+    return key[0], result, "MISS" if source == LEADER else "COALESCED"
+
+
+async def apredict_image(image_bytes, category, filename="image.jpg", content_type="application/octet-stream",
+                         record=True):
+    """Async ``predict_image``: cache work runs in a thread, the backend call on the event loop."""
+    if category == AUTO:
+        return await apredict_auto(image_bytes, filename, content_type, record=record)
+    start = time.perf_counter()
+    try:
+        digest, result, cache_status = await _apredict_image(image_bytes, category, filename, content_type)
+    except PredictionError as e:
+        PREDICTION_ERRORS.inc(category, str(e.status))
+        raise
+    if record:
+        record_prediction(category, start, digest, result, cache_status)
+    return result, cache_status
+
+
+async def _apredict_image(image_bytes, category, filename, content_type):
+    key, result, cache_status = await sync_to_async(lookup_prediction, thread_sensitive=False)(
+        image_bytes, category)
+    if result is not None:
+        return key[0], result, cache_status
+
+    async def call_backend():
+        result = await get_backend(category).apredict(image_bytes, category, filename=filename,
+                                                      content_type=content_type)
+        await sync_to_async(store_prediction, thread_sensitive=False)(key, category, result)
+        return result
+
+    single_flight = get_single_flight()
+    if single_flight is None:
+        return key[0], await call_backend(), "MISS"
+    result, source = await single_flight.ado(flight_key(key, category), call_backend)
+    if source == SHARED:
+        await sync_to_async(store_prediction, thread_sensitive=False)(key, category, result)
+    return key[0], result, "MISS" if source == LEADER else "COALESCED"
+
+
+# ====================================================
+# Automatic Model Type
+# ====================================================
+# model_type=auto sends the image to every category at once (one category in
+# the calling thread, the rest on a shared pool, or all on the event loop), so
+# it takes as long as the slowest category rather than their sum. When every
+# answer carries a confidence the most confident one wins; otherwise (the
+# Space returns none) a small local leaf-type model, trained on the bundled
+# dataset folders and run alongside, decides which luffa the leaf is from.
+_auto_executor = None
+_auto_executor_lock = threading.Lock()
+
+
+def get_auto_executor():
+    global _auto_executor
+    if _auto_executor is None:
+        with _auto_executor_lock:
+            if _auto_executor is None:
+                _auto_executor = ThreadPoolExecutor(max_workers=getattr(settings, 'PREDICTION_AUTO_WORKERS', 16),
+                                                    thread_name_prefix="predict-auto")
+    return _auto_executor
+
+
+# /predict/batch/ sends its images upstream on one shared pool rather than a
+# pool per request; each request still keeps at most PREDICTION_BATCH_CONCURRENCY
+# of them in flight, so one large batch cannot take every worker.
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+
+def get_batch_executor():
+    global _batch_executor
+    if _batch_executor is None:
+        with _batch_executor_lock:
+            if _batch_executor is None:
+                _batch_executor = ThreadPoolExecutor(max_workers=getattr(settings, 'PREDICTION_BATCH_WORKERS', 32),
+                                                     thread_name_prefix="predict-batch")
+    return _batch_executor
+
+
+_leaf_type_model = None
+_leaf_type_lock = threading.Lock()
+
+
+def get_leaf_type_model():
+    """The local leaf-type ``ReferenceModel``, or ``None`` when it can't be loaded."""
+    global _leaf_type_model
+    if _leaf_type_model is None:
+        with _leaf_type_lock:
+            if _leaf_type_model is None:
+                path = getattr(settings, 'PREDICTION_LEAF_TYPE_MODEL', None) or os.path.join(
+                    settings.PREDICTION_LOCAL_MODEL_DIR, f"{LEAF_TYPE_MODEL}.npz")
+                try:
+                    _leaf_type_model = ReferenceModel.load(path)
+                except OSError as e:
+                    # Remember the failure so every auto request doesn't retry the load
+                    logger.error(f"Could not load leaf-type model {path}: {e}")
+                    _leaf_type_model = False
+    return _leaf_type_model or None
+
+
+def classify_leaf_type(image_bytes):
+    """``(category, confidence)`` from the leaf-type model, or ``None`` if it can't tell."""
+    model = get_leaf_type_model()
+    if model is None:
+        return None
+    try:
+        with STAGE_SECONDS.time("leaf_type"):
+            [(category, confidence)] = model.predict(preprocess(image_bytes)[None])
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        logger.warning(f"Could not classify leaf type: {e}")
+        return None
+    return category, round(confidence, 4)
+
+
+def needs_leaf_type():
+    """Whether some category's backend may answer without a confidence."""
+    return any(get_backend(category).name != "local" for category in CATEGORIES)
+
+
+def choose_auto_result(outcomes, leaf_type):
+    """Pick the answer from ``{category: (result, cache_status) or PredictionError}``.
+
+    Returns ``(result, cache_status)`` where ``result`` carries an ``auto`` entry
+    saying how it was chosen and the runner-up. Raises the first category's
+    error when every category failed.
+    """
+    answered = {category: outcome for category, outcome in outcomes.items()
+                if not isinstance(outcome, PredictionError)}
+    if not answered:
+        raise next(iter(outcomes.values()))
+    if len(answered) == 1:
+        [winner] = answered
+        selected_by = "only_answer"
+    elif all("confidence" in result for result, _ in answered.values()):
+        winner = max(answered, key=lambda category: answered[category][0]["confidence"])
+        selected_by = "confidence"
+    elif leaf_type is not None and leaf_type[0] in answered:
+        winner = leaf_type[0]
+        selected_by = "leaf_type"
+    else:
+        winner = next(iter(answered))
+        selected_by = "default"
+
+    runner_up = None
+    runner_up_error = None
+    for category, outcome in outcomes.items():
+        if category == winner:
+            continue
+        if isinstance(outcome, PredictionError):
+            runner_up_error = runner_up_error or outcome.message
+        elif runner_up is None or runner_up.get("confidence", 0) < outcome[0].get("confidence", 0):
+            runner_up = outcome[0]
+
+    result, cache_status = answered[winner]
+    auto = {
+        "selected_by": selected_by,
+        "leaf_type": {"category": leaf_type[0], "confidence": leaf_type[1]} if leaf_type is not None else None,
+        "runner_up": runner_up,
+        "runner_up_error": runner_up_error,
+    }
+    logger.info(f"Auto model type: category={winner} selected_by={selected_by}")
+    return dict(result, auto=auto), cache_status
+
+
+def _auto_outcome(call):
+    try:
+        return call()
+    except PredictionError as e:
+        return e
+
+
+def predict_auto(image_bytes, filename="image.jpg", content_type="application/octet-stream", record=True):
+    """``predict_image`` for every category at once, returning the best answer (see ``choose_auto_result``)."""
+    start = time.perf_counter()
+    check_image(image_bytes)
+    executor = get_auto_executor()
+    leaf_future = executor.submit(classify_leaf_type, image_bytes) if needs_leaf_type() else None
+    first, *others = CATEGORIES
+    futures = {category: executor.submit(_auto_outcome, lambda category=category: predict_image(
+        image_bytes, category, filename, content_type, record=False)) for category in others}
+    outcomes = {first: _auto_outcome(lambda: predict_image(image_bytes, first, filename, content_type, record=False))}
+    outcomes.update((category, future.result()) for category, future in futures.items())
+    leaf_type = leaf_future.result() if leaf_future is not None else None
+
+    result, cache_status = choose_auto_result(outcomes, leaf_type)
+    if record:
+        record_prediction(result["category"], start, content_hash(image_bytes), result, cache_status)
+    return result, cache_status
+
+
+async def apredict_auto(image_bytes, filename="image.jpg", content_type="application/octet-stream", record=True):
+    """Async ``predict_auto``: the categories and leaf-type model run concurrently on the event loop."""
+    start = time.perf_counter()
+    check_image(image_bytes)
+    calls = [apredict_image(image_bytes, category, filename, content_type, record=False) for category in CATEGORIES]
+    if needs_leaf_type():
+        calls.append(sync_to_async(classify_leaf_type, thread_sensitive=False)(image_bytes))
+    answers = await asyncio.gather(*calls, return_exceptions=True)
+    for answer in answers:
+        if isinstance(answer, BaseException) and not isinstance(answer, PredictionError):
+            raise answer
+    outcomes = dict(zip(CATEGORIES, answers))
+    leaf_type = answers[len(CATEGORIES)] if len(answers) > len(CATEGORIES) else None
+
+    result, cache_status = choose_auto_result(outcomes, leaf_type)
+    if record:
+        record_prediction(result["category"], start, content_hash(image_bytes), result, cache_status)
+    return result, cache_status
+
+
+@receiver(setting_changed)
+def _reset_auto(setting, **kwargs):
+    global _auto_executor, _batch_executor, _leaf_type_model
+    if setting == 'PREDICTION_AUTO_WORKERS' and _auto_executor is not None:
+        _auto_executor.shutdown(wait=False)
+        _auto_executor = None
+    if setting == 'PREDICTION_BATCH_WORKERS' and _batch_executor is not None:
+        _batch_executor.shutdown(wait=False)
+        _batch_executor = None
+    if setting.startswith('PREDICTION_LEAF_TYPE') or setting.startswith('PREDICTION_LOCAL'):
+        _leaf_type_model = None
+
+
+# ====================================================
+# Response Payload
+# ====================================================
+def prediction_payload(result, catalog=None):
+    """The JSON body returned for a successful prediction."""
+    # Disease info is looked up per response so cached entries stay small
+    catalog = catalog or get_disease_catalog()
+    payload = {
+        "prediction": result["prediction"],
+        "category": result["category"],
+        "disease_info": catalog.info(result["prediction"]),
+        "status": "success"
+    }
+    if "confidence" in result:
+        payload["confidence"] = result["confidence"]
+    auto = result.get("auto")
+    if auto is not None:
+        payload["model_type"] = AUTO
+        payload["selected_by"] = auto["selected_by"]
+        payload["leaf_type"] = auto["leaf_type"]
+        runner_up = auto["runner_up"]
+        if runner_up is not None:
+            runner_up = {key: runner_up[key] for key in ("prediction", "category", "confidence") if key in runner_up}
+            runner_up["disease_info"] = catalog.info(runner_up["prediction"])
+        payload["runner_up"] = runner_up
+        if auto["runner_up_error"]:
+            payload["runner_up_error"] = auto["runner_up_error"]
+    return payload
+
+
+# ====================================================
+# Prediction Backends
+# ====================================================
+# PREDICTION_BACKENDS picks, per category, what answers a cache miss: "remote"
+# posts to the Hugging Face Space, "local" runs the NumPy reference model
+# in-process. Both return ``{"prediction", "category", ...}`` or raise
+# ``PredictionError``.
+class RemoteBackend:
+    """Posts to the Space through the in-flight cap, the circuit breaker and (optionally) hedged requests."""
+
+    name = "remote"
+
+    def admit(self):
+        """Take an HF_MAX_IN_FLIGHT slot; the caller must release the returned limiter."""
+        limiter = get_inflight_limiter("hf")
+        try:
+            limiter.acquire()
+        except Saturated as e:
+            logger.warning(f"Rejecting prediction: {e}")
+            raise PredictionError("Prediction API is busy, retry shortly", status=503, retry_after=e.retry_after)
+        return limiter
+
+    def before_call(self):
+        breaker = get_upstream_breaker()
+        if breaker is None:
+            return None
+        try:
+            breaker.before_call()
+        except CircuitOpen as e:
+            logger.warning(f"Rejecting prediction: {e}")
+            raise PredictionError("Prediction API is unavailable, retry shortly", status=503,
+                                  retry_after=max(1, math.ceil(e.retry_after)))
+        return breaker
+
+    def after_call(self, breaker, start, response=None):
+        latency_ms = (time.perf_counter() - start) * 1000
+        failed = response is None or response.status_code >= 500 or response.status_code == 429
+        UPSTREAM_SECONDS.observe(latency_ms / 1000, "hf", "error" if failed else "ok")
+        if breaker is not None:
+            breaker.record(failed, latency_ms)
+        if not failed:
+            get_upstream_hedger().latencies.add(latency_ms)
+
+    def predict(self, image_bytes, category, filename="image.jpg", content_type="application/octet-stream"):
+        data, filename, content_type = upstream_upload(image_bytes, filename, content_type)
+        limiter = self.admit()
+        try:
+            breaker = self.before_call()
+            logger.info(f"Making API request: category={category} ({len(data)} bytes)")
+            start = time.perf_counter()
+            try:
+                response = get_upstream_hedger().call(
+                    lambda: get_hf_client().predict(data, category, filename=filename, content_type=content_type),
+                    hedge=breaker is None or breaker.state == CLOSED,
+                )
+            except requests.RequestException as e:
+                self.after_call(breaker, start)
+                logger.error(f"API request failed: {str(e)}")
+                raise PredictionError("Prediction API unavailable", status=502)
+            except BaseException:
+                self.after_call(breaker, start)
+                raise
+        finally:
+            limiter.release()
+        self.after_call(breaker, start, response)
+        return parse_api_response(response, category)
+
+    async def apredict(self, image_bytes, category, filename="image.jpg", content_type="application/octet-stream"):
+        import httpx
+        data, filename, content_type = await sync_to_async(upstream_upload, thread_sensitive=False)(
+            image_bytes, filename, content_type)
+        limiter = self.admit()
+        try:
+            breaker = self.before_call()
+            logger.info(f"Making async API request: category={category} ({len(data)} bytes)")
+            start = time.perf_counter()
+            try:
+                response = await get_upstream_hedger().acall(
+                    lambda: get_async_hf_client().predict(data, category, filename=filename,
+                                                          content_type=content_type),
+                    hedge=breaker is None or breaker.state == CLOSED,
+                )
+            except httpx.HTTPError as e:
+                self.after_call(breaker, start)
+                logger.error(f"API request failed: {e!r}")
+                raise PredictionError("Prediction API unavailable", status=502)
+            except BaseException:
+                self.after_call(breaker, start)
+                raise
+        finally:
+            limiter.release()
+        self.after_call(breaker, start, response)
+        return parse_api_response(response, category)
+
+
+class LocalBackend:
+    """In-process inference with one ``ReferenceModel`` per category, loaded on first use.
+
+    Concurrent requests for a category are micro-batched into one forward pass
+    (PREDICTION_LOCAL_MAX_BATCH_SIZE / _MAX_WAIT_MS). When _QUEUE_DEPTH requests
+    are already waiting, new ones fail fast with a 503 and Retry-After.
+    """
+
+    name = "local"
+
+    def __init__(self, model_dir, max_batch_size=16, max_wait_ms=5, max_queue=64, retry_after=1):
+        self.model_dir = model_dir
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._models = {}
+        self._batchers = {}
+        self._lock = threading.Lock()
+
+    def model(self, category):
+        model = self._models.get(category)
+        if model is None:
+            with self._lock:
+                model = self._models.get(category)
+                if model is None:
+                    path = os.path.join(self.model_dir, f"{category}.npz")
+                    start = time.perf_counter()
+                    try:
+                        model = ReferenceModel.load(path)
+                    except OSError as e:
+                        logger.error(f"Could not load local model {path}: {e}")
+                        raise PredictionError("Local prediction model unavailable", status=503)
+                    logger.info(f"Loaded local model {path} in {(time.perf_counter() - start) * 1000:.1f} ms")
+                    self._models[category] = model
+        return model
+
+    def batcher(self, category):
+        batcher = self._batchers.get(category)
+        if batcher is None:
+            self.model(category)  # fail fast if the model cannot be loaded
+            with self._lock:
+                batcher = self._batchers.get(category)
+                if batcher is None:
+                    batcher = self._batchers[category] = MicroBatcher(
+                        lambda arrays: self.predict_arrays(arrays, category),
+                        max_batch_size=self.max_batch_size,
+                        max_wait_ms=self.max_wait_ms,
+                        max_queue=self.max_queue,
+                        name=f"local-{category}",
+                    )
+        return batcher
+
+    def decode(self, image_bytes):
+        try:
+            with STAGE_SECONDS.time("preprocess"):
+                return preprocess(image_bytes)
+        except (UnidentifiedImageError, OSError, ValueError) as e:
+            logger.warning(f"Could not decode upload for local inference: {e}")
+            raise PredictionError("Could not decode image", status=400)
+
+    def predict_arrays(self, arrays, category):
+        """Run one batched forward pass over preprocessed images, returning results in order."""
+        model = self.model(category)
+        start = time.perf_counter()
+        predictions = model.predict(np.stack(arrays))
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, "local_inference")
+        logger.info(f"Local inference: category={category} batch={len(arrays)} forward={elapsed * 1000:.1f} ms")
+        return [
+            {"prediction": label, "category": category, "confidence": round(confidence, 4)}
+            for label, confidence in predictions
+        ]
+
+    def submit(self, array, category):
+        try:
+            return self.batcher(category).submit(array)
+        except Overloaded as e:
+            logger.warning(f"Rejecting local prediction: {e}")
+            raise PredictionError("Prediction queue is full, retry shortly", status=503, retry_after=self.retry_after)
+
+    def predict(self, image_bytes, category, filename="image.jpg", content_type="application/octet-stream"):
+        # Decoding runs in the caller's thread; only the forward pass is batched
+        return self.submit(self.decode(image_bytes), category).result()
+
+    async def apredict(self, image_bytes, category, filename="image.jpg", content_type="application/octet-stream"):
+        array = await sync_to_async(self.decode, thread_sensitive=False)(image_bytes)
+        return await asyncio.wrap_future(self.submit(array, category))
+
+    def close(self):
+        for batcher in self._batchers.values():
+            batcher.close()
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(category):
+    """Return the process-wide backend configured for ``category``."""
+    name = getattr(settings, 'PREDICTION_BACKENDS', {}).get(category, getattr(settings, 'PREDICTION_BACKEND', 'remote'))
+    backend = _backends.get(name)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(name)
+            if backend is None:
+                if name == 'remote':
+                    backend = RemoteBackend()
+                elif name == 'local':
+                    backend = LocalBackend(
+                        settings.PREDICTION_LOCAL_MODEL_DIR,
+                        max_batch_size=settings.PREDICTION_LOCAL_MAX_BATCH_SIZE,
+                        max_wait_ms=settings.PREDICTION_LOCAL_MAX_WAIT_MS,
+                        max_queue=settings.PREDICTION_LOCAL_QUEUE_DEPTH,
+                        retry_after=settings.PREDICTION_LOCAL_RETRY_AFTER,
+                    )
+                else:
+                    raise ValueError(f"Unknown prediction backend for {category}: {name!r}")
+                _backends[name] = backend
+    return backend
+
+
+@receiver(setting_changed)
+def _reset_backends(setting, **kwargs):
+    if setting.startswith('PREDICTION_BACKEND') or setting.startswith('PREDICTION_LOCAL'):
+        for backend in _backends.values():
+            if isinstance(backend, LocalBackend):
+                backend.close()
+        _backends.clear()
+
+
+def parse_api_response(response, category):
+    """Validate a Space response and return ``{"prediction", "category"}``."""
+    if response.status_code != 200:
+        logger.error(f"API request failed with status {response.status_code}: {response.text}")
+        raise PredictionError(f"API request failed: {response.status_code}")
+
+    try:
+        with STAGE_SECONDS.time("json_parse"):
+            api_result = response.json()
+        logger.info(f"API response received: {api_result}")
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to parse API response as JSON: {response.text}, error: {str(e)}")
+        raise PredictionError("Invalid response from prediction API")
+
+    if api_result.get("status") != "success":
+        logger.error(f"Prediction failed: API returned status {api_result.get('status')}")
+        raise PredictionError("Prediction failed")
+
+    predicted_disease = api_result.get("prediction")
+    if not predicted_disease:
+        logger.error("Missing 'prediction' key in API response")
+        raise PredictionError("Prediction data missing from API response")
+
+    result_category = api_result.get("category")
+    if not result_category:
+        logger.warning("Missing 'category' key in API response, using request category")
+        result_category = category
+
+    logger.info(f"Prediction successful: disease={predicted_disease}, category={result_category}")
+    return {"prediction": predicted_disease, "category": result_category}
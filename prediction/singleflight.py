@@ -0,0 +1,279 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalesce within a process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# ====================================================
+# Single-flight Coalescing
+# ====================================================
+# Identical predictions that are in flight at the same time share one upstream
+# call. Within a process, the first caller for a key (the leader) runs the call
+# and everyone else waits on its Future. Across gunicorn workers, leaders take
+# an flock on <lock_dir>/<key>.lock; a leader that had to wait for the lock
+# reads the result the previous holder wrote to <key>.json instead of calling
+# upstream again. Results must be JSON-serializable.
+LEADER = "leader"           # ran the call
+COALESCED = "coalesced"     # waited on the leader in this process
+SHARED = "shared"           # reused the result another process wrote
+
+LOCK_POLL_INTERVAL = 0.01
+SWEEP_INTERVAL = 600        # seconds between removals of old lock / result files
+SWEEP_AGE = 3600
+
+
+class LeaderCancelled(Exception):
+    """Given to the waiters of a leader that was cancelled; one of them takes over the call."""
+
+
+class SingleFlight:
+    def __init__(self, lock_dir=None, wait_timeout=120):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self.wait_timeout = wait_timeout
+        self.leaders = 0
+        self.coalesced = 0      # waited on a leader in this process
+        self.shared = 0         # reused a result written by another process
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def stats(self):
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "shared": self.shared,
+            "in_flight": len(self._calls),
+        }
+
+    def _join(self, key):
+        """Return ``(future, leader)``; the leader must resolve ``future`` via ``_finish``."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._calls[key] = Future()
+            self.leaders += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn):
+        """Return ``(result, source)``: ``fn()``'s result and LEADER, COALESCED or SHARED."""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            logger.info(f"Coalesced in-flight request {key}")
+            try:
+                return future.result(), COALESCED
+            except LeaderCancelled:
+                continue
+        try:
+            result, source = self._run_locked(key, fn)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result, source
+
+    async def ado(self, key, coroutine_fn):
+        """Async ``do``: waiting on a leader or on the file lock never blocks the event loop.
+
+        A cancelled waiter leaves the shared call alone; a cancelled leader hands
+        the call to one of its waiters instead of failing them all.
+        """
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            logger.info(f"Coalesced in-flight request {key}")
+            try:
+                return await asyncio.shield(asyncio.wrap_future(future)), COALESCED
+            except LeaderCancelled:
+                continue
+        try:
+            handle, result = await sync_to_async(self._acquire, thread_sensitive=False)(key)
+            try:
+                if result is not None:
+                    source = SHARED
+                else:
+                    result, source = await coroutine_fn(), LEADER
+                    self._write_result(key, handle, result)
+            finally:
+                self._release(handle)
+        except asyncio.CancelledError:
+            # The leader's client went away; the waiters' requests still want the answer
+            self._finish(key, future, error=LeaderCancelled(key))
+            raise
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result, source
+
+    # ------------------------------------------------
+    # Cross-process lock
+    # ------------------------------------------------
+    def _run_locked(self, key, fn):
+        handle, result = self._acquire(key)
+        try:
+            if result is not None:
+                return result, SHARED
+            result = fn()
+            self._write_result(key, handle, result)
+            return result, LEADER
+        finally:
+            self._release(handle)
+
+    def _path(self, key, suffix):
+        return os.path.join(self.lock_dir, f"{key}{suffix}")
+
+    def _acquire(self, key):
+        """Take the key's file lock; returns ``(handle, result)`` where ``result`` is what
+        another process produced while we waited, or ``None``."""
+        if not self.lock_dir:
+            return None, None
+        self._sweep()
+        started = time.time()
+        path = self._path(key, ".lock")
+        handle = open(path, "a")
+        waited = False
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    logger.warning(f"Timed out waiting for the lock on {key}, calling upstream anyway")
+                    handle.close()
+                    return None, None
+                waited = True
+                time.sleep(LOCK_POLL_INTERVAL)
+                continue
+            if _same_file(handle, path):
+                break
+            # _sweep removed the file while we waited for it: lock the one now at the path
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+            handle = open(path, "a")
+        # Opening in "a" mode does not touch the mtime; keep a busy lock file from looking stale
+        os.utime(path)
+        if waited:
+            result = self._read_result(key, since=started)
+            if result is not None:
+                self.shared += 1
+                logger.info(f"Reused result of another worker for {key}")
+                return handle, result
+        return handle, None
+
+    def _release(self, handle):
+        if handle is not None:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+
+    def _read_result(self, key, since):
+        path = self._path(key, ".json")
+        try:
+            # Only a result written while we were waiting belongs to the same in-flight call
+            if os.path.getmtime(path) < since:
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_result(self, key, handle, result):
+        if handle is None:
+            return
+        path = self._path(key, ".json")
+        temporary = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, "w") as f:
+                json.dump(result, f)
+            os.replace(temporary, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not share result for {key}: {e}")
+
+    def _sweep(self):
+        now = time.monotonic()
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        cutoff = time.time() - SWEEP_AGE
+        with os.scandir(self.lock_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime >= cutoff:
+                        continue
+                    if not entry.name.endswith(".lock"):
+                        os.remove(entry.path)
+                        continue
+                    # Only remove a lock file nobody holds; a process already waiting on it
+                    # notices the file is gone once it gets the lock (_same_file)
+                    with open(entry.path, "a") as handle:
+                        try:
+                            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        except BlockingIOError:
+                            continue
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+
+
+def _same_file(handle, path):
+    """Whether ``path`` still names the file ``handle`` has open."""
+    try:
+        current = os.stat(path)
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(handle.fileno())
+    return (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino)
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """Return the process-wide ``SingleFlight``, or ``None`` when disabled."""
+    global _single_flight
+    if not getattr(settings, 'PREDICTION_SINGLEFLIGHT_ENABLED', True):
+        return None
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight(
+                    lock_dir=settings.PREDICTION_SINGLEFLIGHT_LOCK_DIR or None,
+                    wait_timeout=settings.PREDICTION_SINGLEFLIGHT_WAIT,
+                )
+    return _single_flight
+
+
+@receiver(setting_changed)
+def _reset_single_flight(setting, **kwargs):
+    global _single_flight
+    if setting.startswith('PREDICTION_SINGLEFLIGHT'):
+        _single_flight = None
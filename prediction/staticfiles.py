@@ -0,0 +1,153 @@
+import io
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.files.base import ContentFile
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from PIL import Image
+from whitenoise import compress
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # brotlicffi is a drop-in replacement
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+# ====================================================
+# Static File Pipeline
+# ====================================================
+# collectstatic writes hashed copies of every file (served by WhiteNoise with a
+# far-future immutable Cache-Control), gzip and Brotli copies of text assets,
+# and for the images under STATIC_IMAGE_DIRS resized AVIF/WebP variants named
+# "<name>.<width>w.<ext>". The variants go through the same hashing as the
+# originals; {% responsive_image %} and {% image_set %} (templatetags/responsive.py)
+# turn them into srcset/image-set markup once a manifest exists.
+SOURCE_FORMATS = {".png": "png", ".jpg": "jpeg", ".jpeg": "jpeg"}
+MIME_TYPES = {"avif": "image/avif", "webp": "image/webp", "png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg"}
+ENCODER_OPTIONS = {
+    "avif": {"quality": 55, "speed": 6},
+    "webp": {"quality": 80, "method": 6},
+    "png": {},
+    "jpeg": {"quality": 82, "optimize": True, "progressive": True},
+}
+VARIANT_RE = re.compile(r"\.(\d+)w\.(\w+)$")
+
+
+def variant_name(name, width, extension):
+    return f"{os.path.splitext(name)[0]}.{width}w.{extension}"
+
+
+def variant_widths(width):
+    """The STATIC_IMAGE_WIDTHS below ``width``, plus ``width`` itself."""
+    return [w for w in sorted(settings.STATIC_IMAGE_WIDTHS) if w < width] + [width]
+
+
+def encode_variant(image, width, extension):
+    if width != image.width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.Resampling.LANCZOS)
+    fmt = SOURCE_FORMATS.get(f".{extension}", extension)
+    if fmt == "jpeg" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, fmt.upper(), **ENCODER_OPTIONS[fmt])
+    return buffer.getvalue()
+
+
+class Compressor(compress.Compressor):
+    SKIP_COMPRESS_EXTENSIONS = compress.Compressor.SKIP_COMPRESS_EXTENSIONS + ("avif",)
+
+    def __init__(self, *args, use_brotli=True, **kwargs):
+        super().__init__(*args, use_brotli=use_brotli, **kwargs)
+        self.use_brotli = use_brotli and brotli is not None
+
+    @staticmethod
+    def compress_brotli(data):
+        return brotli.compress(data)
+
+
+class OptimizedStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            paths = {**paths, **self.write_image_variants(paths)}
+        yield from super().post_process(paths, dry_run, **options)
+
+    def create_compressor(self, **kwargs):
+        return Compressor(**kwargs)
+
+    def write_image_variants(self, paths):
+        """Write the resized variants of collected images; returns them as extra ``paths`` entries."""
+        sources = [
+            (name, storage, path) for name, (storage, path) in paths.items()
+            if name.startswith(tuple(settings.STATIC_IMAGE_DIRS))
+            and os.path.splitext(name)[1].lower() in SOURCE_FORMATS
+            and not VARIANT_RE.search(name)
+        ]
+        with ThreadPoolExecutor() as executor:
+            written = executor.map(lambda source: self.write_variants(*source), sources)
+            return {name: (self, name) for names in written for name in names}
+
+    def write_variants(self, name, storage, path):
+        modified = storage.get_modified_time(path)
+        with storage.open(path) as f:
+            image = Image.open(f)
+            image.load()
+        extension = os.path.splitext(name)[1].lower().lstrip(".")
+        names = []
+        for width in variant_widths(image.width):
+            # The original already serves its own format at full width
+            extensions = settings.STATIC_IMAGE_FORMATS + ([extension] if width < image.width else [])
+            for ext in extensions:
+                variant = variant_name(name, width, ext)
+                names.append(variant)
+                if self.exists(variant) and self.get_modified_time(variant) >= modified:
+                    continue
+                if self.exists(variant):
+                    self.delete(variant)
+                self._save(variant, ContentFile(encode_variant(image, width, ext)))
+        return names
+
+
+_variant_index = None
+_variant_lock = threading.Lock()
+
+
+def get_variant_index():
+    """``{name without extension: {extension: [(width, variant name), ...]}}`` from the staticfiles manifest.
+
+    Empty when the static files storage keeps no manifest or collectstatic has not run.
+    """
+    global _variant_index
+    if _variant_index is None:
+        with _variant_lock:
+            if _variant_index is None:
+                index = {}
+                for name in getattr(staticfiles_storage, 'hashed_files', {}):
+                    match = VARIANT_RE.search(name)
+                    if match:
+                        formats = index.setdefault(name[:match.start()], {})
+                        formats.setdefault(match.group(2), []).append((int(match.group(1)), name))
+                for formats in index.values():
+                    for variants in formats.values():
+                        variants.sort()
+                _variant_index = index
+    return _variant_index
+
+
+def image_variants(name):
+    """``{extension: [(width, variant name), ...]}`` for the static image ``name``, narrowest first."""
+    return get_variant_index().get(os.path.splitext(name)[0], {})
+
+
+@receiver(setting_changed)
+def _reset_variant_index(setting, **kwargs):
+    global _variant_index
+    if setting in ('STORAGES', 'STATIC_ROOT', 'STATIC_URL'):
+        _variant_index = None
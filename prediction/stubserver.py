@@ -0,0 +1,83 @@
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ====================================================
+# Stub Hugging Face Space
+# ====================================================
+# A local stand-in for the Space's ``/predict/image`` contract, used by the
+# tests and by `manage.py bench`: multipart POST in, JSON out, with optional
+# latency and injected errors.
+DEFAULT_RESPONSE = (200, {"status": "success", "prediction": "Fresh", "category": "Smooth"})
+
+
+class StubHFServer:
+    """Serve ``/predict/image`` on a free local port while used as a context manager.
+
+    ``responses`` is a list of ``(status, body)`` pairs served in order; the last
+    one repeats once the list is exhausted. Each request waits ``delay`` seconds
+    plus up to ``jitter`` more, and fails with ``error_status`` with probability
+    ``error_rate``.
+    """
+
+    def __init__(self, responses=None, delay=0.0, jitter=0.0, error_rate=0.0, error_status=503, seed=None):
+        self.responses = list(responses or [DEFAULT_RESPONSE])
+        self.delay = delay
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = []
+        self.bytes_received = 0
+        self.errors_injected = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, body, delay = stub.respond(self.path, self.client_address, len(body))
+                if delay:
+                    threading.Event().wait(delay)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            request_queue_size = 256
+
+            def handle_error(self, request, client_address):
+                pass  # clients that time out close the socket mid-response
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/predict/image"
+
+    def respond(self, path, client_address, size):
+        """Record a request and pick its ``(status, body, delay)``."""
+        with self._lock:
+            self.requests.append((path, client_address))
+            self.bytes_received += size
+            delay = self.delay + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors_injected += 1
+                return self.error_status, {"detail": "injected error"}, delay
+            status, body = self.responses[min(len(self.requests), len(self.responses)) - 1]
+            return status, body, delay
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,63 @@
+import os
+
+from django import template
+from django.conf import settings
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+from prediction.staticfiles import MIME_TYPES, image_variants
+
+register = template.Library()
+
+
+def _srcset(variants):
+    return ", ".join(f"{static(name)} {width}w" for width, name in variants)
+
+
+@register.simple_tag
+def responsive_image(name, alt="", sizes="100vw", **attrs):
+    """A ``<picture>`` offering the AVIF/WebP variants of a static image at every width.
+
+    ``sizes`` is the width the image is laid out at; extra keyword arguments
+    become ``<img>`` attributes. Without variants (no collectstatic manifest)
+    this is a plain ``<img>``.
+    """
+    variants = image_variants(name)
+    attributes = format_html_join("", ' {}="{}"', attrs.items())
+    if not variants:
+        return format_html('<img src="{}" alt="{}"{}>', static(name), alt, attributes)
+    sources = format_html_join(
+        "", '<source type="{}" srcset="{}" sizes="{}">',
+        ((MIME_TYPES[ext], _srcset(variants[ext]), sizes) for ext in settings.STATIC_IMAGE_FORMATS if ext in variants),
+    )
+    # Downscaled copies in the original format, for browsers without AVIF or WebP
+    extension = os.path.splitext(name)[1].lower().lstrip(".")
+    width = max(w for formats in variants.values() for w, _ in formats)
+    fallback = variants.get(extension, []) + [(width, name)]
+    return format_html('<picture>{}<img src="{}" srcset="{}" sizes="{}" alt="{}"{}></picture>',
+                       sources, static(name), _srcset(fallback), sizes, alt, attributes)
+
+
+@register.simple_tag
+def image_set(name):
+    """A CSS ``image-set()`` of the widest AVIF/WebP variants of a static image, then the original."""
+    variants = image_variants(name)
+    candidates = [(static(variants[ext][-1][1]), MIME_TYPES[ext])
+                  for ext in settings.STATIC_IMAGE_FORMATS if ext in variants]
+    if not candidates:
+        return format_html('url("{}")', static(name))
+    extension = os.path.splitext(name)[1].lower().lstrip(".")
+    candidates.append((static(name), MIME_TYPES.get(extension, "image/png")))
+    return mark_safe("image-set(" + ", ".join(format_html('url("{}") type("{}")', url, mime)
+                                              for url, mime in candidates) + ")")
+
+
+@register.simple_tag
+def static_variant(name, width):
+    """URL of the narrowest same-format variant of a static image at least ``width`` pixels wide."""
+    extension = os.path.splitext(name)[1].lower().lstrip(".")
+    for variant_width, variant in image_variants(name).get(extension, []):
+        if variant_width >= width:
+            return static(variant)
+    return static(name)
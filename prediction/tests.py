@@ -1,4 +1,2211 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Placeholder for future tests
-# Tests for Hugging Face API integration can be added here
+import numpy as np
+import openai
+import requests
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.template import Context, Template
+from django.test import (AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from . import chatbot, uploads, views
+from .cache import LocalLRUBackend, get_chat_cache, get_prediction_cache
+from .catalog import DEFAULT_DISEASES, clear_disease_catalog, get_disease_catalog
+from .plaintext import MarkdownStripper, remove_markdown
+from .plaintext_reference import remove_markdown_regex
+from .dataset import DatasetCache, build_dataset_cache, iter_dataset
+from .imaging import sniff_image_type
+from .inference import decode_image
+from .management.commands import predict_dir
+from .ratelimit import InFlightLimiter, Saturated, TokenBucket, get_inflight_limiter, parse_rate
+from .phash import PerceptualIndex, dhash, get_perceptual_index, hamming_distance, phash
+from .batching import MicroBatcher, Overloaded
+from .history import HistoryRecorder, get_history_recorder
+from .jobs import JobWorkerPool, claim_next_job, requeue_stale_jobs
+from .metrics import PREDICTIONS, STAGE_SECONDS, Counter, Histogram, Registry
+from .models import LuffaDisease, Prediction, PredictionJob, PredictionRollup
+from .resilience import CircuitBreaker, CircuitOpen, Hedger
+from .services import LocalBackend, PredictionError, get_backend, prediction_payload
+from .singleflight import COALESCED, LEADER, SHARED, SingleFlight, get_single_flight
+from .stubserver import StubHFServer
+from .upstream import AsyncHFClient, HFClient
+from .warmup import WARMUP_STEPS, Warmup
+
+# Tests for Hugging Face API integration
+
+SAMPLE_IMAGE = b"\xff\xd8\xff\xe0" + b"luffa-leaf" * 100
+LEAF_IMAGE = os.path.join(settings.BASE_DIR, "Luffa Smooth", "Alternaria", "slAlt-001.jpg")
+OTHER_LEAF_IMAGE = os.path.join(settings.BASE_DIR, "Luffa Smooth", "Fresh", "slFreshLvs-002.jpg")
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def reencode(data, scale=0.5, quality=60):
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    image = image.resize((int(image.width * scale), int(image.height * scale)))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def fake_api_response(prediction="Alternaria", category="Smooth", status_code=200):
+    response = mock.Mock(status_code=status_code, text="")
+    response.json.return_value = {"status": "success", "prediction": prediction, "category": category}
+    return response
+
+
+
+_no_rate_limits = override_settings(RATE_LIMIT_ENABLED=False)
+_no_history = override_settings(PREDICTION_HISTORY_ENABLED=False)
+# For the tests that check what reaches the history: only explicit flush() calls write rows
+_manual_history = override_settings(PREDICTION_HISTORY_ENABLED=True, PREDICTION_HISTORY_FLUSH_INTERVAL=3600)
+_unhashed_static = override_settings(STORAGES={
+    **settings.STORAGES,
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+})
+
+
+def setUpModule():
+    # Most tests send far more requests than a client is allowed; RateLimitTests turn the limits back on
+    _no_rate_limits.enable()
+    # Pages render without a collectstatic manifest; StaticPipelineTests use the real storage
+    _unhashed_static.enable()
+    # The recorder's background thread would flush into whatever test runs next,
+    # including SimpleTestCases that may not touch the database
+    _no_history.enable()
+
+
+def tearDownModule():
+    _no_history.disable()
+    _unhashed_static.disable()
+    _no_rate_limits.disable()
+
+class PredictUploadTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        get_prediction_cache().clear()
+
+    def post_image(self, data=SAMPLE_IMAGE, model_type="Smooth"):
+        upload = SimpleUploadedFile("leaf.jpg", data, content_type="image/jpeg")
+        return self.client.post("/predict/", {"image": upload, "model_type": model_type})
+
+    def test_upload_is_forwarded_from_memory(self):
+        client = mock.Mock()
+        client.predict.return_value = fake_api_response()
+        with override_settings(MEDIA_ROOT=self.media_root), \
+                mock.patch("prediction.services.get_hf_client", return_value=client):
+            response = self.post_image()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["prediction"], "Alternaria")
+        data, category = client.predict.call_args.args
+        self.assertEqual(data, SAMPLE_IMAGE)
+        self.assertEqual(category, "Smooth")
+        self.assertEqual(client.predict.call_args.kwargs["content_type"], "image/jpeg")
+        self.assertEqual(os.listdir(self.media_root), [])
+
+    def test_archive_writes_content_addressed_file(self):
+        with override_settings(MEDIA_ROOT=self.media_root, PREDICTION_ARCHIVE_ENABLED=True):
+            path = uploads.archive_upload(SAMPLE_IMAGE).result()
+
+        self.assertEqual(os.path.basename(path), uploads.content_hash(SAMPLE_IMAGE) + ".jpg")
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), SAMPLE_IMAGE)
+
+    def test_archive_extension_comes_from_the_bytes(self):
+        png = io.BytesIO()
+        Image.new("RGB", (4, 4)).save(png, "PNG")
+        self.assertEqual(uploads.archive_extension(png.getvalue()), ".png")
+        self.assertEqual(uploads.archive_extension(SAMPLE_IMAGE), ".jpg")
+        self.assertEqual(uploads.archive_extension(b"<script>alert(1)</script>"), ".bin")
+
+        hf_client = mock.Mock()
+        hf_client.predict.return_value = fake_api_response()
+        with override_settings(MEDIA_ROOT=self.media_root, PREDICTION_ARCHIVE_ENABLED=True), \
+                mock.patch("prediction.services.get_hf_client", return_value=hf_client):
+            upload = SimpleUploadedFile("leaf.html", png.getvalue(), content_type="text/html")
+            self.client.post("/predict/", {"image": upload, "model_type": "Smooth"})
+            uploads._archive_executor.submit(lambda: None).result()
+
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "predictions")),
+                         [uploads.content_hash(png.getvalue()) + ".png"])
+
+    def test_full_archive_queue_drops_uploads(self):
+        release = threading.Event()
+        with override_settings(MEDIA_ROOT=self.media_root, PREDICTION_ARCHIVE_ENABLED=True,
+                               PREDICTION_ARCHIVE_MAX_PENDING=1):
+            with mock.patch.object(uploads, "_write_archive", side_effect=lambda *args: release.wait(5)):
+                dropped = uploads.archive_dropped
+                first = uploads.archive_upload(b"first")
+                self.assertIsNone(uploads.archive_upload(b"second"))
+                self.assertEqual(uploads.archive_dropped, dropped + 1)
+                release.set()
+                first.result()
+                uploads._archive_executor.submit(lambda: None).result()
+            self.assertIsNotNone(uploads.archive_upload(SAMPLE_IMAGE))
+            # Written under this test's MEDIA_ROOT, which the worker reads when it runs
+            uploads._archive_executor.submit(lambda: None).result()
+
+    def test_archive_disabled_by_default(self):
+        with override_settings(MEDIA_ROOT=self.media_root, PREDICTION_ARCHIVE_ENABLED=False):
+            self.assertIsNone(uploads.archive_upload(SAMPLE_IMAGE))
+
+
+class PredictionCacheTests(TestCase):
+    def setUp(self):
+        get_prediction_cache().clear()
+        self.hf_client = mock.Mock()
+        self.hf_client.predict.return_value = fake_api_response()
+        patcher = mock.patch("prediction.services.get_hf_client", return_value=self.hf_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post_image(self, data=SAMPLE_IMAGE, model_type="Smooth"):
+        upload = SimpleUploadedFile("leaf.jpg", data, content_type="image/jpeg")
+        return self.client.post("/predict/", {"image": upload, "model_type": model_type})
+
+    def test_repeat_upload_is_served_from_cache(self):
+        first = self.post_image()
+        second = self.post_image()
+
+        self.assertEqual(first["X-Cache"], "MISS")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(self.hf_client.predict.call_count, 1)
+
+    def test_category_is_part_of_key(self):
+        self.post_image(model_type="Smooth")
+        response = self.post_image(model_type="Sponge")
+
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(self.hf_client.predict.call_count, 2)
+
+    def test_failed_predictions_are_not_cached(self):
+        self.hf_client.predict.return_value = fake_api_response(status_code=500)
+        self.assertEqual(self.post_image().status_code, 500)
+        self.hf_client.predict.return_value = fake_api_response()
+        self.assertEqual(self.post_image()["X-Cache"], "MISS")
+
+    @override_settings(PREDICTION_CACHE_BACKEND="django")
+    def test_django_cache_backend(self):
+        with self.assertLogs("prediction.cache", "WARNING") as logs:
+            self.post_image()
+        # Without REDIS_URL the "predictions" alias is per process
+        self.assertIn("per-process LocMemCache", logs.output[0])
+        self.assertEqual(self.post_image()["X-Cache"], "HIT")
+        self.assertEqual(get_prediction_cache().stats()["hits"], 1)
+
+    @override_settings(PREDICTION_CACHE_BACKEND="django", PREDICTION_CACHE_ALIAS="shared", CACHES={
+        **settings.CACHES, "shared": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}})
+    def test_shared_cache_alias_does_not_warn(self):
+        with self.assertNoLogs("prediction.cache", "WARNING"):
+            self.assertFalse(get_prediction_cache().backend.local_cache)
+
+    def test_lru_eviction_and_ttl(self):
+        backend = LocalLRUBackend(max_entries=2, ttl=60)
+        backend.set("a", 1)
+        backend.set("b", 2)
+        backend.get("a")
+        backend.set("c", 3)
+        self.assertEqual((backend.get("a"), backend.get("b"), backend.get("c")), (1, None, 3))
+
+        expired = LocalLRUBackend(max_entries=2, ttl=-1)
+        expired.set("a", 1)
+        self.assertIsNone(expired.get("a"))
+
+
+class PerceptualHashTests(TestCase):
+    def setUp(self):
+        get_prediction_cache().clear()
+        get_perceptual_index().clear()
+
+    def test_reencoded_copy_is_close(self):
+        original = read_file(LEAF_IMAGE)
+        copy = reencode(original)
+        other = read_file(OTHER_LEAF_IMAGE)
+        for hash_function in (dhash, phash):
+            near = hamming_distance(hash_function(original), hash_function(copy))
+            far = hamming_distance(hash_function(original), hash_function(other))
+            self.assertLessEqual(near, 4)
+            self.assertGreater(far, near)
+
+    def test_index_search_and_ring_buffer(self):
+        index = PerceptualIndex(max_entries=2)
+        index.add(0b1111, "Smooth", "a")
+        index.add(0xFF00, "Smooth", "b")
+        self.assertEqual(index.search(0b0111, "Smooth", 2), (1, "a"))
+        self.assertIsNone(index.search(0b0111, "Spoonge", 64))
+        self.assertIsNone(index.search(0xF0F0F0F0, "Smooth", 2))
+
+        index.add(0b1111 << 32, "Smooth", "c")
+        self.assertEqual(len(index), 2)
+        self.assertIsNone(index.search(0b1111, "Smooth", 0))
+
+    def test_search_while_the_ring_buffer_wraps(self):
+        index = PerceptualIndex(max_entries=8)
+        stop = threading.Event()
+
+        def writer():
+            value = 0
+            while not stop.is_set():
+                value = value % 63 + 1
+                index.add(value, "Smooth", value)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            deadline = time.monotonic() + 0.3
+            while time.monotonic() < deadline:
+                for wanted in range(1, 64):
+                    found = index.search(wanted, "Smooth", 0)
+                    # An exact match must come back with the value stored alongside that hash
+                    if found is not None:
+                        self.assertEqual(found, (0, wanted))
+        finally:
+            stop.set()
+            thread.join()
+        self.assertEqual(len(index), 8)
+
+    def test_resized_upload_reuses_prediction(self):
+        hf_client = mock.Mock()
+        hf_client.predict.return_value = fake_api_response()
+        original = read_file(LEAF_IMAGE)
+        with mock.patch("prediction.services.get_hf_client", return_value=hf_client):
+            first = self.client.post("/predict/", {"image": SimpleUploadedFile("a.jpg", original), "model_type": "Smooth"})
+            second = self.client.post("/predict/", {"image": SimpleUploadedFile("b.jpg", reencode(original)), "model_type": "Smooth"})
+
+        self.assertEqual(first["X-Cache"], "MISS")
+        self.assertEqual(second["X-Cache"], "NEAR")
+        self.assertEqual(second.json()["prediction"], "Alternaria")
+        self.assertEqual(hf_client.predict.call_count, 1)
+
+
+def phone_photo(size=(2400, 1800), orientation=6):
+    """A large JPEG with an EXIF orientation tag, like a phone camera writes."""
+    image = Image.radial_gradient("L").resize(size).convert("RGB")
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=95, exif=exif)
+    return buffer.getvalue()
+
+
+class ImageNormalizationTests(TestCase):
+    def setUp(self):
+        get_prediction_cache().clear()
+        get_perceptual_index().clear()
+        self.hf_client = mock.Mock()
+        self.hf_client.predict.return_value = fake_api_response()
+        patcher = mock.patch("prediction.services.get_hf_client", return_value=self.hf_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, data, name="leaf.jpg"):
+        return self.client.post("/predict/", {"image": SimpleUploadedFile(name, data), "model_type": "Smooth"})
+
+    def test_sniff_image_type(self):
+        self.assertEqual(sniff_image_type(read_file(LEAF_IMAGE)), "jpeg")
+        self.assertEqual(sniff_image_type(b"\x89PNG\r\n\x1a\n" + b"\0" * 8), "png")
+        self.assertEqual(sniff_image_type(b"RIFF\0\0\0\0WEBPVP8 "), "webp")
+        self.assertEqual(sniff_image_type(b"\0\0\0\x18ftypheic\0\0"), "heif")
+        self.assertIsNone(sniff_image_type(b"%PDF-1.7"))
+
+    def test_non_image_is_rejected_before_upstream(self):
+        response = self.post(b"%PDF-1.7 not a leaf", name="leaf.pdf")
+        self.assertEqual(response.status_code, 415)
+        self.hf_client.predict.assert_not_called()
+
+    @override_settings(PREDICTION_NORMALIZE_MAX_SIDE=448)
+    def test_large_photo_is_oriented_and_downscaled(self):
+        photo = phone_photo()
+        response = self.post(photo, name="IMG_0001.JPEG")
+
+        self.assertEqual(response.status_code, 200)
+        sent = self.hf_client.predict.call_args.args[0]
+        kwargs = self.hf_client.predict.call_args.kwargs
+        self.assertEqual((kwargs["filename"], kwargs["content_type"]), ("IMG_0001.jpg", "image/jpeg"))
+        with Image.open(io.BytesIO(sent)) as image:
+            # Orientation 6 = rotate 90°: the landscape sensor image becomes portrait
+            self.assertEqual(image.size, (336, 448))
+            self.assertEqual(image.getexif().get(0x0112), None)
+        self.assertLess(len(sent), len(photo) / 10)
+
+    def test_small_upright_jpeg_is_forwarded_unchanged(self):
+        data = read_file(LEAF_IMAGE)
+        self.post(data)
+        self.assertEqual(self.hf_client.predict.call_args.args[0], data)
+
+    def test_cache_key_uses_original_upload(self):
+        photo = phone_photo()
+        self.post(photo)
+        response = self.post(photo)
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(self.hf_client.predict.call_count, 1)
+
+
+class LocalBackendTests(TestCase):
+    def setUp(self):
+        get_prediction_cache().clear()
+        get_perceptual_index().clear()
+        self.hf_client = mock.Mock()
+        self.hf_client.predict.return_value = fake_api_response(prediction="Fresh", category="Spoonge")
+        patcher = mock.patch("prediction.services.get_hf_client", return_value=self.hf_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, data, model_type="Smooth"):
+        return self.client.post("/predict/", {"image": SimpleUploadedFile("leaf.jpg", data), "model_type": model_type})
+
+    @override_settings(PREDICTION_BACKENDS={"Smooth": "local", "Spoonge": "remote"})
+    def test_backend_is_selected_per_category(self):
+        response = self.post(read_file(LEAF_IMAGE))
+        body = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((body["prediction"], body["category"]), ("Alternaria", "Smooth"))
+        self.assertGreater(body["confidence"], 0.5)
+        self.hf_client.predict.assert_not_called()
+
+        self.assertEqual(self.post(read_file(LEAF_IMAGE), "Sponge").json()["prediction"], "Fresh")
+        self.hf_client.predict.assert_called_once()
+
+    def test_reference_model_recognises_dataset_images(self):
+        backend = LocalBackend(settings.PREDICTION_LOCAL_MODEL_DIR)
+        sample = list(iter_dataset())[::20]
+        correct = sum(backend.predict(read_file(path), category)["prediction"] == label
+                      for path, category, label in sample)
+        self.assertGreater(correct / len(sample), 0.8)
+
+    def test_batched_forward_pass_matches_single_images(self):
+        backend = LocalBackend(settings.PREDICTION_LOCAL_MODEL_DIR)
+        arrays = [backend.decode(read_file(path)) for path in (LEAF_IMAGE, OTHER_LEAF_IMAGE)]
+        batched = backend.predict_arrays(arrays, "Smooth")
+        self.assertEqual(batched, [backend.predict_arrays([array], "Smooth")[0] for array in arrays])
+
+    @override_settings(PREDICTION_BACKEND="local", PREDICTION_BACKENDS={})
+    def test_undecodable_image_is_a_client_error(self):
+        self.assertEqual(self.post(SAMPLE_IMAGE).status_code, 400)
+
+    @override_settings(PREDICTION_BACKENDS={"Smooth": "local"}, PREDICTION_LOCAL_MODEL_DIR="/nonexistent")
+    def test_missing_model_is_unavailable(self):
+        self.assertEqual(self.post(read_file(LEAF_IMAGE)).status_code, 503)
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def make_batcher(self, run_batch=None, **kwargs):
+        self.sizes = []
+
+        def record(items):
+            self.sizes.append(len(items))
+            return [item * 2 for item in items]
+
+        batcher = MicroBatcher(run_batch or record, **kwargs)
+        self.addCleanup(batcher.close)
+        return batcher
+
+    def test_concurrent_submissions_share_a_batch(self):
+        batcher = self.make_batcher(max_batch_size=32, max_wait_ms=50)
+        barrier = threading.Barrier(16)
+
+        def call(i):
+            barrier.wait()
+            return batcher.submit(i).result(timeout=5)
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(call, range(16)))
+
+        self.assertEqual(results, [i * 2 for i in range(16)])
+        self.assertEqual(sum(self.sizes), 16)
+        self.assertLessEqual(len(self.sizes), 3)
+
+    def test_batch_size_is_capped(self):
+        batcher = self.make_batcher(max_batch_size=4, max_wait_ms=20)
+        futures = [batcher.submit(i) for i in range(10)]
+        self.assertEqual([future.result(timeout=5) for future in futures], [i * 2 for i in range(10)])
+        self.assertTrue(all(size <= 4 for size in self.sizes))
+
+    def test_errors_reach_every_caller(self):
+        def fail(items):
+            raise ValueError("model exploded")
+
+        batcher = self.make_batcher(fail, max_wait_ms=20)
+        futures = [batcher.submit(i) for i in range(3)]
+        for future in futures:
+            with self.assertRaises(ValueError):
+                future.result(timeout=5)
+
+    def test_full_queue_is_rejected(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow(items):
+            started.set()
+            release.wait(5)
+            return items
+
+        batcher = self.make_batcher(slow, max_batch_size=1, max_wait_ms=0, max_queue=2)
+        running = batcher.submit(0)
+        started.wait(5)
+        queued = [batcher.submit(1), batcher.submit(2)]
+        with self.assertRaises(Overloaded):
+            batcher.submit(3)
+        release.set()
+        self.assertEqual([running.result(5)] + [future.result(5) for future in queued], [0, 1, 2])
+
+
+@override_settings(PREDICTION_BACKEND="local", PREDICTION_BACKENDS={}, PREDICTION_CACHE_BACKEND="none",
+                   PREDICTION_PHASH_ENABLED=False)
+class LocalBatchingTests(TestCase):
+    def post(self, data):
+        return self.client.post("/predict/", {"image": SimpleUploadedFile("leaf.jpg", data), "model_type": "Smooth"})
+
+    @override_settings(PREDICTION_LOCAL_MAX_WAIT_MS=50)
+    def test_concurrent_requests_are_batched(self):
+        images = [read_file(path) for path, _, _ in list(iter_dataset(["Smooth"]))[::50]]
+        backend = get_backend("Smooth")
+        with ThreadPoolExecutor(max_workers=len(images)) as executor:
+            results = list(executor.map(lambda data: backend.predict(data, "Smooth"), images))
+
+        self.assertEqual(len(results), len(images))
+        self.assertEqual(results, [backend.predict_arrays([backend.decode(data)], "Smooth")[0] for data in images])
+        self.assertLess(backend.batcher("Smooth").stats()["batches"], len(images))
+
+    def test_full_queue_returns_503_with_retry_after(self):
+        with mock.patch.object(MicroBatcher, "submit", side_effect=Overloaded("full")):
+            response = self.post(read_file(LEAF_IMAGE))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+
+    def test_async_view_uses_batcher(self):
+        request = AsyncRequestFactory().post("/predict/", {"image": SimpleUploadedFile("leaf.jpg", read_file(LEAF_IMAGE)),
+                                                          "model_type": "Smooth"})
+        response = async_to_sync(views.apredict)(request)
+        self.assertEqual(json.loads(response.content)["prediction"], "Alternaria")
+
+
+class HFClientTests(SimpleTestCase):
+    def make_client(self, url, **kwargs):
+        kwargs.setdefault("backoff_base", 0.001)
+        client = HFClient(url, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_connections_are_reused(self):
+        with StubHFServer() as stub:
+            client = self.make_client(stub.url)
+            for _ in range(3):
+                response = client.predict(SAMPLE_IMAGE, "Smooth")
+                self.assertEqual(response.json()["prediction"], "Fresh")
+
+        self.assertEqual(len({address for _, address in stub.requests}), 1)
+        self.assertTrue(stub.requests[0][0].endswith("?category=Smooth"))
+
+    def test_retries_5xx_and_429(self):
+        ok = {"status": "success", "prediction": "Fresh", "category": "Smooth"}
+        with StubHFServer([(503, {}), (429, {}), (200, ok)]) as stub:
+            response = self.make_client(stub.url, max_retries=2).predict(SAMPLE_IMAGE, "Smooth")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(stub.requests), 3)
+
+    def test_gives_up_after_max_retries(self):
+        with StubHFServer([(500, {})]) as stub:
+            response = self.make_client(stub.url, max_retries=1).predict(SAMPLE_IMAGE, "Smooth")
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(len(stub.requests), 2)
+
+    def test_read_timeout(self):
+        with StubHFServer(delay=0.5) as stub:
+            client = self.make_client(stub.url, read_timeout=0.05, max_retries=0)
+            with self.assertRaises(requests.Timeout):
+                client.predict(SAMPLE_IMAGE, "Smooth")
+
+    def test_read_timeout_is_not_retried(self):
+        with StubHFServer(delay=0.5) as stub:
+            client = self.make_client(stub.url, read_timeout=0.05, max_retries=2)
+            with self.assertRaises(requests.ReadTimeout):
+                client.predict(SAMPLE_IMAGE, "Smooth")
+        self.assertEqual(len(stub.requests), 1)
+
+    def test_connection_errors_are_retried(self):
+        client = self.make_client("http://127.0.0.1:1", max_retries=2)
+        with mock.patch.object(client.session, "post", wraps=client.session.post) as post:
+            with self.assertRaises(requests.ConnectionError):
+                client.predict(SAMPLE_IMAGE, "Smooth")
+        self.assertEqual(post.call_count, 3)
+
+    def test_async_read_timeout_is_not_retried(self):
+        import httpx
+
+        async def predict():
+            client = AsyncHFClient(stub.url, read_timeout=0.05, max_retries=2, backoff_base=0.001)
+            try:
+                await client.predict(SAMPLE_IMAGE, "Smooth")
+            finally:
+                await client.aclose()
+
+        with StubHFServer(delay=0.5) as stub:
+            with self.assertRaises(httpx.ReadTimeout):
+                async_to_sync(predict)()
+        self.assertEqual(len(stub.requests), 1)
+
+    def test_backoff_is_bounded(self):
+        client = self.make_client("http://127.0.0.1:1", backoff_base=1, backoff_max=2)
+        for attempt in range(1, 6):
+            self.assertLessEqual(client.backoff(attempt), 2)
+
+
+@override_settings(PREDICTION_NORMALIZE_ENABLED=False)
+class BatchPredictTests(TestCase):
+    def setUp(self):
+        get_prediction_cache().clear()
+
+    def post_batch(self, images, model_types):
+        files = [SimpleUploadedFile(f"leaf{i}.jpg", data, content_type="image/jpeg") for i, data in enumerate(images)]
+        return self.client.post("/predict/batch/", {"images": files, "model_type": model_types})
+
+    def test_results_in_request_order_with_partial_failure(self):
+        def fake_predict(image_bytes, category, **kwargs):
+            if image_bytes == b"bad":
+                return fake_api_response(status_code=500)
+            return fake_api_response(prediction=image_bytes.decode(), category=category)
+
+        hf_client = mock.Mock()
+        hf_client.predict.side_effect = fake_predict
+        with mock.patch("prediction.services.get_hf_client", return_value=hf_client):
+            response = self.post_batch([b"Fresh", b"bad", b"Insect"], ["Smooth", "Smooth", "Sponge"])
+
+        body = response.json()
+        self.assertEqual(body["status"], "partial")
+        self.assertEqual((body["succeeded"], body["failed"]), (2, 1))
+        self.assertEqual([item["index"] for item in body["results"]], [0, 1, 2])
+        self.assertEqual(body["results"][0]["prediction"], "Fresh")
+        self.assertEqual(body["results"][1]["code"], 500)
+        self.assertEqual(body["results"][2]["category"], "Spoonge")
+
+    def test_rejects_mismatched_model_types(self):
+        response = self.post_batch([b"a", b"b", b"c"], ["Smooth", "Sponge"])
+        self.assertEqual(response.status_code, 400)
+
+    def test_upstream_calls_run_concurrently(self):
+        images = [f"leaf-{i}".encode() for i in range(8)]
+        with StubHFServer(delay=0.2) as stub, \
+                override_settings(HF_API_BASE=stub.url, PREDICTION_BATCH_CONCURRENCY=4):
+            start = time.perf_counter()
+            response = self.post_batch(images, ["Smooth"])
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(response.json()["succeeded"], 8)
+        self.assertEqual(len(stub.requests), 8)
+        # 8 images / 4 concurrent calls = 2 round trips, not 8
+        self.assertLess(elapsed, 0.2 * 8 / 2)
+
+    def test_disease_catalog_is_read_in_the_request_thread(self):
+        threads = []
+        catalog = get_disease_catalog()
+
+        def read_catalog():
+            threads.append(threading.current_thread())
+            return catalog
+
+        hf_client = mock.Mock()
+        hf_client.predict.return_value = fake_api_response()
+        with mock.patch("prediction.services.get_hf_client", return_value=hf_client), \
+                mock.patch("prediction.services.get_disease_catalog", side_effect=read_catalog), \
+                mock.patch("prediction.views.get_disease_catalog", side_effect=read_catalog):
+            body = self.post_batch([b"a", b"b"], ["Smooth"]).json()
+
+        self.assertEqual(body["succeeded"], 2)
+        self.assertEqual(body["results"][0]["disease_info"], catalog.info("Alternaria"))
+        self.assertEqual(threads, [threading.current_thread()])
+
+    def test_batches_share_one_pool(self):
+        threads = set()
+
+        def fake_predict(image_bytes, category, **kwargs):
+            threads.add(threading.current_thread())
+            return fake_api_response()
+
+        hf_client = mock.Mock()
+        hf_client.predict.side_effect = fake_predict
+        with mock.patch("prediction.services.get_hf_client", return_value=hf_client), \
+                override_settings(PREDICTION_BATCH_WORKERS=2, PREDICTION_BATCH_CONCURRENCY=2):
+            for _ in range(3):
+                self.assertEqual(self.post_batch([b"a", b"b", b"c"], ["Smooth"]).json()["succeeded"], 3)
+
+        self.assertLessEqual(len(threads), 2)
+        self.assertTrue(all(thread.name.startswith("predict-batch") for thread in threads))
+
+
+@override_settings(PREDICTION_CACHE_BACKEND="none", PREDICTION_PHASH_ENABLED=False, PREDICTION_NORMALIZE_ENABLED=False)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        get_chat_cache().clear()
+
+    def upload(self, i):
+        return {"image": SimpleUploadedFile(f"leaf{i}.jpg", f"leaf-{i}".encode()), "model_type": "Sponge"}
+
+    def test_async_predict(self):
+        with StubHFServer() as stub, override_settings(HF_API_BASE=stub.url):
+            request = AsyncRequestFactory().post("/predict/", self.upload(0))
+            response = async_to_sync(views.apredict)(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["prediction"], "Fresh")
+        self.assertTrue(stub.requests[0][0].endswith("?category=Spoonge"))
+
+    def test_async_predict_upstream_failure(self):
+        with StubHFServer([(500, {})]) as stub, override_settings(HF_API_BASE=stub.url, HF_MAX_RETRIES=0):
+            response = async_to_sync(views.apredict)(AsyncRequestFactory().post("/predict/", self.upload(0)))
+
+        self.assertEqual(response.status_code, 500)
+
+    def test_load_async_vs_wsgi(self):
+        """Load test: one sync worker serialises upstream waits, one event loop overlaps them."""
+        delay, sync_requests, async_requests = 0.1, 10, 100
+
+        async def run_async():
+            factory = AsyncRequestFactory()
+            return await asyncio.gather(*(
+                views.apredict(factory.post("/predict/", self.upload(i))) for i in range(async_requests)
+            ))
+
+        with StubHFServer(delay=delay) as stub, override_settings(HF_API_BASE=stub.url):
+            factory = RequestFactory()
+            start = time.perf_counter()
+            for i in range(sync_requests):
+                self.assertEqual(views.predict(factory.post("/predict/", self.upload(i))).status_code, 200)
+            sync_elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            responses = async_to_sync(run_async)()
+            async_elapsed = time.perf_counter() - start
+
+        self.assertTrue(all(response.status_code == 200 for response in responses))
+        self.assertGreaterEqual(sync_elapsed, delay * sync_requests)
+        # 10x the requests finish faster than the WSGI path's 10
+        self.assertLess(async_elapsed, sync_elapsed)
+
+    def test_async_chat_api(self):
+        completion = mock.Mock()
+        completion.choices = [mock.Mock(message=mock.Mock(content="**Water** the roots"))]
+        client = mock.MagicMock()
+        client.chat.completions.create = mock.AsyncMock(return_value=completion)
+        request = AsyncRequestFactory().post("/chat/api/", {"message": "hi"}, content_type="application/json")
+        with mock.patch("prediction.chatbot.get_async_chat_client", return_value=client):
+            response = async_to_sync(views.achat_api)(request)
+
+        self.assertEqual(json.loads(response.content)["response"], "Water the roots")
+
+
+CHAT_REPLY = """# Downy mildew
+
+Downy mildew is **common** in *humid* weather.
+
+
+
+- Remove infected leaves
+- Spray a `copper` fungicide
+1. Improve airflow, see [this guide](https://example.com/guide)
+"""
+
+
+def stream_chunks(text, size):
+    chunks = []
+    for i in range(0, len(text), size):
+        chunk = mock.Mock()
+        chunk.choices = [mock.Mock(delta=mock.Mock(content=text[i:i + size]))]
+        chunks.append(chunk)
+    return chunks
+
+
+# Replies as the chat model produces them, with the original regex output
+MARKDOWN_CORPUS = [
+    CHAT_REPLY,
+    "**Alternaria** leaf spot: _dark_ rings, use `mancozeb`.",
+    "## Symptoms\n\n* Yellow spots\n* Wilting\n\n### Treatment\n1. Prune\n2. Spray",
+    "#\n\n- \n  1. nested item",
+    "Use *one* star, an unclosed **bold and a stray ` tick",
+    "See [guide](https://example.com) and [notes] (not a link) or [x](y) [a[b](c)",
+    "Spacing   \n\n\n   \n\tkept\n\n",
+    "* **Mosaic virus:** spread by aphids\n+ *Fresh:* no action_needed_",
+    "3.14 is not a list\n10. but this is\n-dash",
+    "",
+]
+
+
+def stream_strip(text, size):
+    stripper = MarkdownStripper()
+    pieces = [stripper.feed(text[i:i + size]) for i in range(0, len(text), size)]
+    return "".join(pieces) + stripper.flush()
+
+
+class MarkdownStripperTests(SimpleTestCase):
+    def test_matches_regex_implementation_on_corpus(self):
+        for text in MARKDOWN_CORPUS:
+            expected = remove_markdown_regex(text)
+            self.assertEqual(remove_markdown(text), expected)
+            for size in (1, 2, 5, 1000):
+                self.assertEqual(stream_strip(text, size), expected, (text, size))
+
+    def test_matches_regex_implementation_on_random_markdown(self):
+        rng = random.Random(8)
+        tokens = ["a", "b", " ", "*", "**", "_", "`", "#", "- ", "1. ", "[x](y)", "[", "]", "(", ")", "\n", "\n\n  \n"]
+        for _ in range(3000):
+            text = "".join(rng.choice(tokens) for _ in range(rng.randint(0, 20)))
+            expected = remove_markdown_regex(text)
+            self.assertEqual(remove_markdown(text), expected, text)
+            if "[" not in text:
+                self.assertEqual(stream_strip(text, rng.randint(1, 4)), expected, text)
+
+    def test_holds_back_only_unterminated_markers(self):
+        stripper = MarkdownStripper()
+        self.assertEqual(stripper.feed("Spray **copper"), "Spray")
+        self.assertEqual(stripper.feed("** weekly, see [the"), " copper weekly, see")
+        self.assertEqual(stripper.feed(" guide](https://x) now"), " the guide now")
+        self.assertEqual(stripper.feed("\n- Prune"), "\nPrune")
+        self.assertEqual(stripper.flush(), "")
+
+    def test_unterminated_marker_is_released_at_line_end(self):
+        stripper = MarkdownStripper()
+        self.assertEqual(stripper.feed("a `b c"), "a")
+        self.assertEqual(stripper.feed("\nd"), " `b c\nd")
+
+
+class ChatStreamingTests(TestCase):
+    def setUp(self):
+        get_chat_cache().clear()
+
+    def test_client_is_reused(self):
+        patcher = mock.patch("openai.OpenAI")
+        openai_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        with override_settings(OPENROUTER_API_KEY="test-key"):
+            self.assertIs(chatbot.get_chat_client(), chatbot.get_chat_client())
+        self.assertEqual(openai_class.call_count, 1)
+
+    def test_streaming_chat_api(self):
+        client = mock.Mock()
+        client.chat.completions.create.return_value = iter(stream_chunks(CHAT_REPLY, 5))
+        with mock.patch("prediction.chatbot.get_chat_client", return_value=client):
+            response = self.client.post("/chat/api/", {"message": "mildew?", "stream": True}, content_type="application/json")
+            events = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertTrue(client.chat.completions.create.call_args.kwargs["stream"])
+        self.assertGreater(len(events), 2)
+        self.assertEqual(events[-1], {"done": True})
+        self.assertEqual("".join(event.get("delta", "") for event in events), remove_markdown(CHAT_REPLY))
+
+    def test_first_event_is_sent_before_completion_finishes(self):
+        produced = []
+
+        def chunks():
+            for chunk in stream_chunks(CHAT_REPLY, 5):
+                produced.append(chunk)
+                yield chunk
+
+        client = mock.Mock()
+        client.chat.completions.create.return_value = chunks()
+        with mock.patch("prediction.chatbot.get_chat_client", return_value=client):
+            response = self.client.post("/chat/api/", {"message": "mildew?", "stream": True}, content_type="application/json")
+            first = json.loads(next(iter(response.streaming_content)))
+
+        self.assertEqual(first["delta"], "Dow")
+        self.assertLess(len(produced), len(stream_chunks(CHAT_REPLY, 5)))
+
+    def test_async_streaming_chat_api(self):
+        async def chunks():
+            for chunk in stream_chunks(CHAT_REPLY, 4):
+                yield chunk
+
+        client = mock.MagicMock()
+        client.chat.completions.create = mock.AsyncMock(return_value=chunks())
+        request = AsyncRequestFactory().post("/chat/api/", {"message": "hi", "stream": True}, content_type="application/json")
+
+        async def collect():
+            response = await views.achat_api(request)
+            return [json.loads(line) async for line in response.streaming_content]
+
+        with mock.patch("prediction.chatbot.get_async_chat_client", return_value=client):
+            events = async_to_sync(collect)()
+
+        self.assertEqual(events[-1], {"done": True})
+        self.assertEqual("".join(event.get("delta", "") for event in events), remove_markdown(CHAT_REPLY))
+
+
+def fake_completion(content):
+    completion = mock.Mock()
+    completion.choices = [mock.Mock(message=mock.Mock(content=content))]
+    return completion
+
+
+class ChatCacheTests(TestCase):
+    def setUp(self):
+        get_chat_cache().clear()
+        self.llm = mock.Mock()
+        self.llm.chat.completions.create.return_value = fake_completion("**Copper** fungicide every 7 days")
+        patcher = mock.patch("prediction.chatbot.get_chat_client", return_value=self.llm)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ask(self, message, **extra):
+        return self.client.post("/chat/api/", {"message": message, **extra}, content_type="application/json")
+
+    def test_repeated_question_is_served_from_cache(self):
+        first = self.ask("How do I treat downy mildew?")
+        second = self.ask("  how do I treat   Downy Mildew ")
+
+        self.assertEqual(first["X-Cache"], "MISS")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(json.loads(second.content)["response"], "Copper fungicide every 7 days")
+        self.assertEqual(self.llm.chat.completions.create.call_count, 1)
+        self.assertEqual(get_chat_cache().stats(), {"hits": 1, "misses": 1, "hit_rate": 0.5})
+
+    def test_key_includes_model_and_system_prompt(self):
+        self.ask("downy mildew")
+        with mock.patch("prediction.chatbot.CHAT_MODEL", "other/model"):
+            self.assertEqual(self.ask("downy mildew")["X-Cache"], "MISS")
+        with mock.patch("prediction.chatbot.CHAT_SYSTEM_PROMPT", "Answer briefly."):
+            self.assertEqual(self.ask("downy mildew")["X-Cache"], "MISS")
+        self.assertEqual(self.llm.chat.completions.create.call_count, 3)
+
+    def test_streamed_reply_is_cached(self):
+        self.llm.chat.completions.create.return_value = iter(stream_chunks(CHAT_REPLY, 5))
+        b"".join(self.ask("mildew?", stream=True).streaming_content)
+
+        response = self.ask("mildew", stream=True)
+        events = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(events, [{"delta": remove_markdown(CHAT_REPLY)}, {"done": True}])
+        self.assertEqual(self.ask("Mildew?")["X-Cache"], "HIT")
+        self.assertEqual(self.llm.chat.completions.create.call_count, 1)
+
+    def test_failed_stream_is_not_cached(self):
+        def broken():
+            yield from stream_chunks("Partial answer", 4)
+            raise openai.APIConnectionError(request=mock.Mock())
+
+        self.llm.chat.completions.create.return_value = broken()
+        events = [json.loads(line) for line in b"".join(self.ask("mildew", stream=True).streaming_content).splitlines()]
+        self.assertIn("error", events[-1])
+
+        self.llm.chat.completions.create.return_value = fake_completion("Full answer")
+        self.assertEqual(self.ask("mildew")["X-Cache"], "MISS")
+
+    @override_settings(CHAT_CACHE_BACKEND="local", CHAT_CACHE_MAX_ENTRIES=2)
+    def test_local_backend_is_lru_bounded(self):
+        for message in ("one", "two", "one", "three", "one", "two"):
+            self.ask(message)
+        # "two" was least recently used when "three" arrived
+        self.assertEqual(self.llm.chat.completions.create.call_count, 4)
+
+
+class WarmupTests(TestCase):
+    def readyz(self, warmup):
+        with mock.patch("prediction.views.get_warmup", return_value=warmup):
+            return self.client.get("/readyz")
+
+    def test_healthz(self):
+        response = self.client.get("/healthz")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"status": "ok"})
+
+    def test_ready_without_warmup(self):
+        response = self.readyz(Warmup())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["state"], "lazy")
+
+    def test_not_ready_until_warmup_finishes(self):
+        release = threading.Event()
+        warmup = Warmup(steps=[("slow", lambda: release.wait(5))])
+        warmup.start()
+        response = self.readyz(warmup)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["state"], "warming")
+
+        release.set()
+        self.assertTrue(warmup.wait(5))
+        body = self.readyz(warmup).json()
+        self.assertEqual((body["state"], body["ready"]), ("ready", True))
+        self.assertEqual(body["steps"]["slow"]["status"], "ready")
+
+    def test_failed_step_is_reported(self):
+        def broken():
+            raise OSError("model missing")
+
+        warmup = Warmup(steps=[("model", broken), ("other", lambda: None)], retry_delay=3600)
+        warmup.start()
+        warmup.wait(5)
+        response = self.readyz(warmup)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["steps"], {
+            "model": {"status": "failed", "error": "model missing", "attempts": 1},
+            "other": {"status": "ready", "ms": mock.ANY},
+        })
+
+    def test_failed_step_is_retried_until_ready(self):
+        errors = [OSError("no such table"), OSError("no such table")]
+
+        def flaky():
+            if errors:
+                raise errors.pop()
+
+        warmup = Warmup(steps=[("model", flaky)], retry_delay=0.01)
+        warmup.start()
+        warmup.wait(5)
+        self.assertEqual(self.readyz(warmup).status_code, 503)
+        deadline = time.monotonic() + 5
+        while warmup.state != "ready" and time.monotonic() < deadline:
+            time.sleep(0.01)
+        body = self.readyz(warmup).json()
+        self.assertEqual((body["state"], body["ready"]), ("ready", True))
+        self.assertEqual(body["steps"]["model"]["attempts"], 3)
+
+    def test_optional_step_failure_is_degraded_not_unready(self):
+        def broken():
+            raise OSError("no such table: prediction_predictionjob")
+
+        warmup = Warmup(steps=[("model", lambda: None), ("job_workers", broken)], retry_delay=3600)
+        warmup.start()
+        warmup.wait(5)
+        response = self.readyz(warmup)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()["state"], response.json()["ready"]), ("degraded", True))
+        self.assertEqual(response.json()["steps"]["job_workers"]["status"], "failed")
+
+    @override_settings(PREDICTION_BACKENDS={"Smooth": "local", "Spoonge": "local"}, OPENROUTER_API_KEY="",
+                       PREDICTION_JOBS_WORKERS=0)
+    def test_warmup_loads_local_models(self):
+        warmup = Warmup(WARMUP_STEPS)
+        warmup.start()
+        self.assertTrue(warmup.wait(30))
+        self.assertEqual(warmup.state, "ready", warmup.status())
+        backend = get_backend("Smooth")
+        self.assertEqual(sorted(backend._models), ["Smooth", "Spoonge"])
+        self.assertEqual(sorted(backend._batchers), ["Smooth", "Spoonge"])
+
+    def test_openai_is_not_imported_at_startup(self):
+        script = "import django, sys; django.setup(); import prediction.urls; print('openai' in sys.modules)"
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE="luffa_prediction.settings")
+        output = subprocess.run([sys.executable, "-c", script], cwd=settings.BASE_DIR, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip().splitlines()[-1], "False")
+
+
+@override_settings(PREDICTION_JOBS_WORKERS=0, PREDICTION_JOBS_RETRY_DELAY=5, PREDICTION_JOBS_MAX_ATTEMPTS=3,
+                   PREDICTION_JOBS_CALLBACK_RETRIES=1)
+@override_settings(PREDICTION_JOBS_CALLBACK_HOSTS=["example.com"])
+class PredictionJobTests(TestCase):
+    def setUp(self):
+        get_prediction_cache().clear()
+        get_perceptual_index().clear()
+        self.hf_client = mock.Mock()
+        self.hf_client.predict.return_value = fake_api_response()
+        patcher = mock.patch("prediction.services.get_hf_client", return_value=self.hf_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def submit(self, data=SAMPLE_IMAGE, **fields):
+        fields.setdefault("model_type", "Smooth")
+        return self.client.post("/predict/jobs/", {"image": SimpleUploadedFile("leaf.jpg", data), **fields})
+
+    def run_pending(self):
+        return JobWorkerPool(workers=0).run_pending()
+
+    def test_submit_then_poll(self):
+        response = self.submit()
+        self.assertEqual(response.status_code, 202)
+        body = response.json()
+        self.assertEqual((body["status"], body["category"]), ("queued", "Smooth"))
+        self.assertEqual(response["Location"], f"/predict/jobs/{body['job_id']}/")
+        self.hf_client.predict.assert_not_called()
+
+        self.assertEqual(self.run_pending(), 1)
+        body = self.client.get(response["Location"]).json()
+        self.assertEqual(body["status"], "succeeded")
+        self.assertEqual(body["attempts"], 1)
+        self.assertEqual(body["result"]["prediction"], "Alternaria")
+        self.assertEqual(body["result"]["cache"], "MISS")
+        self.assertIn("disease_info", body["result"])
+        self.assertEqual(bytes(PredictionJob.objects.get().image), b"")
+
+    def test_rejected_submissions(self):
+        self.assertEqual(self.client.post("/predict/jobs/", {"model_type": "Smooth"}).status_code, 400)
+        self.assertEqual(self.submit(b"not an image").status_code, 415)
+        self.assertEqual(self.submit(model_type="Rough").status_code, 400)
+        self.assertEqual(self.submit(callback_url="ftp://example.com/hook").status_code, 400)
+        self.assertEqual(self.client.get("/predict/jobs/").status_code, 405)
+        self.assertFalse(PredictionJob.objects.exists())
+        self.assertEqual(self.client.get("/predict/jobs/00000000-0000-0000-0000-000000000000/").status_code, 404)
+
+    def test_upstream_failure_is_retried_with_backoff(self):
+        self.hf_client.predict.side_effect = requests.ConnectionError("cold start")
+        self.submit()
+        self.assertEqual(self.run_pending(), 1)
+        job = PredictionJob.objects.get()
+        self.assertEqual((job.status, job.attempts), ("queued", 1))
+        self.assertGreater(job.available_at, job.started_at)
+        # Not due yet
+        self.assertEqual(self.run_pending(), 0)
+
+        PredictionJob.objects.update(available_at=job.started_at)
+        self.hf_client.predict.side_effect = None
+        self.assertEqual(self.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("succeeded", 2))
+
+    @override_settings(PREDICTION_JOBS_MAX_ATTEMPTS=1)
+    def test_job_fails_after_max_attempts(self):
+        self.hf_client.predict.side_effect = requests.ConnectionError("down")
+        job_id = self.submit().json()["job_id"]
+        self.run_pending()
+        body = self.client.get(f"/predict/jobs/{job_id}/").json()
+        self.assertEqual((body["status"], body["code"], body["error"]), ("failed", 502, "Prediction API unavailable"))
+
+    def test_callbacks_are_off_by_default(self):
+        with override_settings(PREDICTION_JOBS_CALLBACK_HOSTS=[]):
+            self.assertEqual(self.submit(callback_url="https://example.com/hook").status_code, 400)
+        self.assertFalse(PredictionJob.objects.exists())
+
+    def test_internal_callback_targets_are_rejected(self):
+        for url in ["http://127.0.0.1:8000/admin/", "http://localhost/", "http://169.254.169.254/latest/meta-data/",
+                    "http://10.0.0.5/hook", "http://[::1]/hook", "https://example.com.internal/hook",
+                    "https://evil.com/?https://example.com/hook"]:
+            with self.subTest(url=url):
+                self.assertEqual(self.submit(callback_url=url).status_code, 400)
+        self.assertFalse(PredictionJob.objects.exists())
+
+    def test_callback_host_is_checked_again_at_delivery(self):
+        with mock.patch("prediction.jobs.requests.post") as post:
+            self.submit(callback_url="https://example.com/hook")
+            with override_settings(PREDICTION_JOBS_CALLBACK_HOSTS=["api.example.org"]):
+                self.run_pending()
+        post.assert_not_called()
+        self.assertEqual(PredictionJob.objects.get().callback_status, "failed")
+
+    def test_callback_is_notified(self):
+        with mock.patch("prediction.jobs.requests.post", return_value=mock.Mock(status_code=204)) as post:
+            job_id = self.submit(callback_url="https://example.com/hook").json()["job_id"]
+            self.run_pending()
+        post.assert_called_once()
+        self.assertEqual(post.call_args.args, ("https://example.com/hook",))
+        self.assertFalse(post.call_args.kwargs["allow_redirects"])
+        payload = post.call_args.kwargs["json"]
+        self.assertEqual((payload["job_id"], payload["status"]), (job_id, "succeeded"))
+        self.assertEqual(payload["result"]["prediction"], "Alternaria")
+        self.assertEqual(PredictionJob.objects.get().callback_status, "delivered")
+
+    def test_failed_callback_is_retried_then_recorded(self):
+        with mock.patch("prediction.jobs.requests.post", return_value=mock.Mock(status_code=503)) as post, \
+                mock.patch("prediction.jobs.time.sleep"):
+            self.submit(callback_url="http://example.com/hook")
+            self.run_pending()
+        self.assertEqual(post.call_count, 2)
+        job = PredictionJob.objects.get()
+        self.assertEqual((job.status, job.callback_status), ("succeeded", "failed"))
+
+    def test_claim_is_exclusive_and_stale_jobs_are_requeued(self):
+        self.submit()
+        job = claim_next_job()
+        self.assertEqual(job.status, "running")
+        self.assertIsNone(claim_next_job())
+
+        self.assertEqual(requeue_stale_jobs(older_than=60), 0)
+        self.assertEqual(requeue_stale_jobs(older_than=-1), 1)
+        self.assertEqual(claim_next_job().id, job.id)
+
+
+class JobWorkerPoolTests(TransactionTestCase):
+    def test_workers_run_queued_jobs(self):
+        hf_client = mock.Mock()
+        hf_client.predict.return_value = fake_api_response(prediction="Fresh")
+        with override_settings(PREDICTION_JOBS_WORKERS=0):
+            job_ids = [
+                self.client.post("/predict/jobs/", {"image": SimpleUploadedFile("leaf.jpg", SAMPLE_IMAGE + bytes([i]))})
+                .json()["job_id"]
+                for i in range(4)
+            ]
+        # One worker so the in-memory test database sees no concurrent writers
+        pool = JobWorkerPool(workers=1, poll_interval=0.05)
+        with mock.patch("prediction.services.get_hf_client", return_value=hf_client):
+            pool.start()
+            deadline = time.monotonic() + 10
+            while pool.completed < 4 and time.monotonic() < deadline:
+                time.sleep(0.02)
+            pool.stop(timeout=5)
+        statuses = [self.client.get(f"/predict/jobs/{job_id}/").json()["status"] for job_id in job_ids]
+        self.assertEqual(statuses, ["succeeded"] * 4)
+        self.assertEqual(hf_client.predict.call_count, 4)
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        get_prediction_cache().clear()
+        get_perceptual_index().clear()
+        self.lock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.lock_dir, ignore_errors=True)
+
+    def post_concurrently(self, uploads):
+        """POST ``(data, model_type)`` pairs to /predict/ at the same moment, one thread each."""
+        barrier = threading.Barrier(len(uploads))
+
+        def post(upload):
+            data, model_type = upload
+            barrier.wait()
+            return self.client.post("/predict/", {"image": SimpleUploadedFile("leaf.jpg", data), "model_type": model_type})
+
+        with ThreadPoolExecutor(max_workers=len(uploads)) as executor:
+            return list(executor.map(post, uploads))
+
+    def test_identical_requests_share_one_upstream_call(self):
+        leaf = read_file(LEAF_IMAGE)
+        with StubHFServer(delay=0.3) as stub, \
+                override_settings(HF_API_BASE=stub.url, PREDICTION_SINGLEFLIGHT_LOCK_DIR=self.lock_dir):
+            responses = self.post_concurrently([(leaf, "Smooth")] * 8)
+            stats = get_single_flight().stats()
+
+        self.assertEqual(len(stub.requests), 1)
+        self.assertEqual([r.json()["prediction"] for r in responses], ["Fresh"] * 8)
+        statuses = sorted(r["X-Cache"] for r in responses)
+        self.assertEqual(statuses.count("MISS"), 1)
+        self.assertEqual(stats["leaders"], 1)
+        self.assertEqual(stats["coalesced"], statuses.count("COALESCED"))
+        self.assertEqual(stats["coalesced"] + statuses.count("HIT"), 7)
+        self.assertEqual(stats["in_flight"], 0)
+
+    def test_categories_and_images_are_not_coalesced(self):
+        leaf, other = read_file(LEAF_IMAGE), read_file(OTHER_LEAF_IMAGE)
+        with StubHFServer(delay=0.2) as stub, \
+                override_settings(HF_API_BASE=stub.url, PREDICTION_SINGLEFLIGHT_LOCK_DIR=self.lock_dir):
+            self.post_concurrently([(leaf, "Smooth"), (leaf, "Sponge"), (other, "Smooth")])
+        self.assertEqual(len(stub.requests), 3)
+
+    def test_leader_failure_reaches_every_waiter(self):
+        leaf = read_file(LEAF_IMAGE)
+        with StubHFServer([(500, {})], delay=0.3) as stub, \
+                override_settings(HF_API_BASE=stub.url, HF_MAX_RETRIES=0, PREDICTION_SINGLEFLIGHT_LOCK_DIR=""):
+            responses = self.post_concurrently([(leaf, "Smooth")] * 4)
+        self.assertEqual(len(stub.requests), 1)
+        self.assertEqual([r.status_code for r in responses], [500] * 4)
+
+    def test_disabled(self):
+        leaf = read_file(LEAF_IMAGE)
+        with StubHFServer(delay=0.2) as stub, \
+                override_settings(HF_API_BASE=stub.url, PREDICTION_SINGLEFLIGHT_ENABLED=False):
+            self.post_concurrently([(leaf, "Smooth")] * 3)
+        self.assertEqual(len(stub.requests), 3)
+
+    def test_workers_share_results_through_the_lock_dir(self):
+        # Two SingleFlight instances stand in for two gunicorn workers
+        first, second = SingleFlight(self.lock_dir), SingleFlight(self.lock_dir)
+        calls = []
+
+        def slow_call():
+            calls.append(threading.current_thread().name)
+            time.sleep(0.3)
+            return {"prediction": "Fresh", "category": "Smooth"}
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(first.do, "Smooth-abc", slow_call)
+            time.sleep(0.05)
+            waiter = executor.submit(second.do, "Smooth-abc", slow_call)
+            self.assertEqual(leader.result(), ({"prediction": "Fresh", "category": "Smooth"}, LEADER))
+            self.assertEqual(waiter.result(), ({"prediction": "Fresh", "category": "Smooth"}, SHARED))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(second.stats()["shared"], 1)
+
+        # A later miss is not served the old file
+        self.assertEqual(second.do("Smooth-abc", lambda: {"prediction": "Holed"})[1], LEADER)
+
+    def test_cancelled_async_leader_hands_over_to_a_waiter(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def slow_call():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return {"prediction": "Fresh"}
+
+        async def run():
+            leader = asyncio.ensure_future(flight.ado("Smooth-abc", slow_call))
+            await asyncio.sleep(0.01)
+            waiters = [asyncio.ensure_future(flight.ado("Smooth-abc", slow_call)) for _ in range(4)]
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            # A waiter that gives up does not cancel the call the others wait on
+            waiters[0].cancel()
+            results = await asyncio.gather(*waiters[1:])
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            with self.assertRaises(asyncio.CancelledError):
+                await waiters[0]
+            return results
+
+        results = async_to_sync(run)()
+        self.assertEqual([result for result, _ in results], [{"prediction": "Fresh"}] * 3)
+        self.assertEqual(sorted(source for _, source in results), [COALESCED, COALESCED, LEADER])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+    def test_sweep_keeps_lock_files_in_use(self):
+        flight = SingleFlight(self.lock_dir)
+        handle, _ = flight._acquire("Smooth-busy")
+        idle = os.path.join(self.lock_dir, "Smooth-idle.lock")
+        open(idle, "w").close()
+        old = time.time() - 2 * 3600
+        for name in ("Smooth-busy.lock", "Smooth-idle.lock"):
+            os.utime(os.path.join(self.lock_dir, name), (old, old))
+
+        flight._last_sweep -= 3600
+        flight._sweep()
+        self.assertTrue(os.path.exists(os.path.join(self.lock_dir, "Smooth-busy.lock")))
+        self.assertFalse(os.path.exists(idle))
+        flight._release(handle)
+
+    def test_acquire_refreshes_the_lock_file(self):
+        flight = SingleFlight(self.lock_dir)
+        path = os.path.join(self.lock_dir, "Smooth-abc.lock")
+        open(path, "w").close()
+        os.utime(path, (0, 0))
+        handle, _ = flight._acquire("Smooth-abc")
+        self.assertGreater(os.path.getmtime(path), time.time() - 60)
+        flight._release(handle)
+
+    def test_waiter_relocks_a_swept_lock_file(self):
+        first, second = SingleFlight(self.lock_dir), SingleFlight(self.lock_dir)
+        handle, _ = first._acquire("Smooth-abc")
+        path = os.path.join(self.lock_dir, "Smooth-abc.lock")
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            waiter = executor.submit(second._acquire, "Smooth-abc")
+            time.sleep(0.05)
+            # The file is swept while the waiter is blocked on it, then a third worker locks a new one
+            os.remove(path)
+            third, _ = first._acquire("Smooth-abc")
+            first._release(handle)
+            time.sleep(0.05)
+            self.assertFalse(waiter.done())
+            first._release(third)
+            waiting_handle, _ = waiter.result(timeout=5)
+        self.assertEqual(os.fstat(waiting_handle.fileno()).st_ino, os.stat(path).st_ino)
+        second._release(waiting_handle)
+
+    def test_async_callers_are_coalesced(self):
+        flight = SingleFlight(self.lock_dir)
+        calls = []
+
+        async def slow_call():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return {"prediction": "Fresh"}
+
+        async def run():
+            return await asyncio.gather(*(flight.ado("Smooth-abc", slow_call) for _ in range(5)))
+
+        results = async_to_sync(run)()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(source for _, source in results), [COALESCED] * 4 + [LEADER])
+
+
+class CircuitBreakerTests(TestCase):
+    def test_opens_on_failure_ratio_then_probes(self):
+        breaker = CircuitBreaker(min_calls=4, failure_ratio=0.5, open_seconds=0.1)
+        for failed in (False, True, False):
+            breaker.before_call()
+            breaker.record(failed, 10)
+        self.assertEqual(breaker.state, "closed")
+        breaker.record(True, 10)
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(CircuitOpen):
+            breaker.before_call()
+
+        time.sleep(0.12)
+        breaker.before_call()  # the probe
+        self.assertEqual(breaker.state, "half_open")
+        with self.assertRaises(CircuitOpen):
+            breaker.before_call()
+        breaker.record(False, 10)
+        self.assertEqual(breaker.state, "closed")
+        self.assertEqual(breaker.stats()["transitions"], {"closed->open": 1, "open->half_open": 1, "half_open->closed": 1})
+        self.assertEqual(breaker.stats()["rejected"], 2)
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker(min_calls=1, open_seconds=0.05)
+        breaker.record(True, 10)
+        time.sleep(0.06)
+        breaker.before_call()
+        breaker.record(True, 10)
+        self.assertEqual(breaker.state, "open")
+
+    def test_opens_on_slow_calls(self):
+        breaker = CircuitBreaker(min_calls=3, slow_call_ms=100, slow_ratio=0.6)
+        for latency in (20, 150, 150):
+            breaker.record(False, latency)
+        self.assertEqual(breaker.state, "open")
+
+    @override_settings(HF_BREAKER_MIN_CALLS=2, HF_BREAKER_OPEN_SECONDS=60, PREDICTION_NORMALIZE_ENABLED=False)
+    def test_open_circuit_fails_fast_with_503(self):
+        get_prediction_cache().clear()
+        hf_client = mock.Mock()
+        hf_client.predict.side_effect = requests.ConnectionError("Space is down")
+        with mock.patch("prediction.services.get_hf_client", return_value=hf_client):
+            statuses = [self.client.post("/predict/", {"image": SimpleUploadedFile("leaf.jpg", SAMPLE_IMAGE)})
+                        for _ in range(3)]
+            readyz = self.client.get("/readyz").json()
+        self.assertEqual([r.status_code for r in statuses], [502, 502, 503])
+        self.assertEqual(statuses[2]["Retry-After"], "60")
+        self.assertEqual(hf_client.predict.call_count, 2)
+        self.assertEqual(readyz["upstream"]["breaker"]["state"], "open")
+
+
+class HedgerTests(SimpleTestCase):
+    def make_hedger(self, **kwargs):
+        kwargs.setdefault("min_samples", 5)
+        hedger = Hedger(enabled=True, min_delay_ms=10, max_ratio=1.0, **kwargs)
+        for _ in range(5):
+            hedger.latencies.add(20)
+        return hedger
+
+    def test_slow_call_is_hedged(self):
+        calls = []
+
+        def call():
+            calls.append(1)
+            time.sleep(0.5 if len(calls) == 1 else 0.01)
+            return len(calls)
+
+        hedger = self.make_hedger()
+        start = time.perf_counter()
+        self.assertEqual(hedger.call(call), 2)
+        # The faster hedge answers without waiting out the slow first call
+        self.assertLess(time.perf_counter() - start, 0.3)
+        self.assertEqual((hedger.hedges, hedger.hedge_wins), (1, 1))
+
+    def test_busy_pool_runs_the_call_unhedged(self):
+        hedger = self.make_hedger(max_workers=1)
+        hedger._active = 1
+        threads = []
+        self.assertEqual(hedger.call(lambda: threads.append(threading.current_thread()) or time.sleep(0.05) or "slow"),
+                         "slow")
+        self.assertEqual(threads, [threading.current_thread()])
+        self.assertEqual(hedger.hedges, 0)
+
+    def test_fast_call_and_budget_are_not_hedged(self):
+        hedger = self.make_hedger()
+        self.assertEqual(hedger.call(lambda: "fast"), "fast")
+        self.assertEqual(hedger.hedges, 0)
+
+        hedger = self.make_hedger()
+        hedger.max_ratio = 0
+        self.assertEqual(hedger.call(lambda: time.sleep(0.05) or "slow"), "slow")
+        self.assertEqual(hedger.hedges, 0)
+
+    def test_failed_primary_falls_back_to_hedge(self):
+        calls = []
+
+        def call():
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(0.05)
+                raise requests.ConnectionError("reset")
+            time.sleep(0.1)
+            return "ok"
+
+        hedger = self.make_hedger()
+        self.assertEqual(hedger.call(call), "ok")
+        self.assertEqual((hedger.hedges, hedger.hedge_wins), (1, 1))
+
+    def test_async_loser_is_cancelled(self):
+        cancelled = []
+
+        async def call(delay, value):
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                cancelled.append(value)
+                raise
+            return value
+
+        delays = iter([(0.5, "primary"), (0.01, "hedge")])
+        hedger = self.make_hedger()
+        result = async_to_sync(hedger.acall)(lambda: call(*next(delays)))
+        self.assertEqual(result, "hedge")
+        self.assertEqual(cancelled, ["primary"])
+
+
+class MetricsTests(TestCase):
+    def test_render_text_format(self):
+        registry = Registry()
+        counter = registry.counter("test_total", "A counter", ("view", "status"))
+        histogram = registry.histogram("test_seconds", "A histogram", ("stage",), buckets=(0.1, 1))
+        registry.callback("test_ready", "A gauge", "gauge", (), lambda: {(): 1})
+        counter.inc("predict", "200")
+        counter.inc("predict", "200", amount=2)
+        counter.inc('say "hi"', "500")
+        histogram.observe(0.05, "upload")
+        histogram.observe(0.5, "upload")
+        histogram.observe(5, "upload")
+
+        lines = registry.render().splitlines()
+        self.assertIn("# TYPE test_total counter", lines)
+        self.assertIn('test_total{view="predict",status="200"} 3', lines)
+        self.assertIn('test_total{view="say \\"hi\\"",status="500"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="upload",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="upload",le="1"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="upload",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_sum{stage="upload"} 5.55', lines)
+        self.assertIn('test_seconds_count{stage="upload"} 3', lines)
+        self.assertIn("test_ready 1", lines)
+
+    def test_concurrent_threads_are_all_counted(self):
+        counter = Counter("test_total", "", ("worker",))
+        histogram = Histogram("test_seconds", "")
+
+        def work(i):
+            for _ in range(1000):
+                counter.inc(str(i % 2))
+                histogram.observe(0.01)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(work, range(16)))
+
+        self.assertEqual(counter.values(), {("0",): 8000, ("1",): 8000})
+        self.assertEqual(histogram.values()[()][-2], 0)
+        self.assertEqual(sum(histogram.values()[()][:-1]), 16000)
+
+    def test_exited_threads_leave_no_shards(self):
+        counter = Counter("test_total", "")
+        histogram = Histogram("test_seconds", "", buckets=(1,))
+
+        def work(_):
+            counter.inc()
+            histogram.observe(0.5)
+
+        for _ in range(200):
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                list(executor.map(work, range(8)))
+
+        # At most this thread's shard is left; the workers' were folded into the totals when they exited
+        self.assertLessEqual(len(counter._shards), 1)
+        self.assertLessEqual(len(histogram._shards), 1)
+        self.assertEqual(counter.values(), {(): 1600})
+        self.assertEqual(histogram.values(), {(): [1600, 0, 800.0]})
+        counter.inc(amount=5)
+        self.assertEqual(counter.values(), {(): 1605})
+
+    @override_settings(PREDICTION_CACHE_BACKEND="none", PREDICTION_PHASH_ENABLED=False,
+                       PREDICTION_NORMALIZE_ENABLED=False)
+    def test_predict_is_recorded(self):
+        predictions = PREDICTIONS.values().get(("Smooth", "Alternaria", "MISS"), 0)
+        parses = STAGE_SECONDS.values().get(("json_parse",), [0])[-2:]
+        client = mock.Mock()
+        client.predict.return_value = fake_api_response()
+        with mock.patch("prediction.services.get_hf_client", return_value=client):
+            upload = SimpleUploadedFile("leaf.jpg", SAMPLE_IMAGE, content_type="image/jpeg")
+            self.assertEqual(self.client.post("/predict/", {"image": upload}).status_code, 200)
+
+        self.assertEqual(PREDICTIONS.values()[("Smooth", "Alternaria", "MISS")], predictions + 1)
+        self.assertNotEqual(STAGE_SECONDS.values()[("json_parse",)][-2:], parses)
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        self.assertIn('luffa_http_requests_total{view="predict",method="POST",status="200"}', body)
+        self.assertIn('luffa_http_request_duration_seconds_count{view="predict"}', body)
+        for stage in ("upload_read", "cache_lookup", "json_parse"):
+            self.assertIn(f'luffa_stage_duration_seconds_count{{stage="{stage}"}}', body)
+        self.assertIn('luffa_upstream_request_duration_seconds_count{upstream="hf",outcome="ok"}', body)
+        self.assertIn('luffa_prediction_jobs{status="queued"} 0', body)
+        self.assertNotIn("unavailable", body)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+
+class BenchCommandTests(TestCase):
+    def test_replays_dataset_through_predict(self):
+        out = io.StringIO()
+        call_command("bench", limit=6, concurrency=3, warmup=0, latency_ms=0, jitter_ms=0, json=True, stdout=out)
+        result = json.loads(out.getvalue())
+
+        self.assertEqual(result["requests"], 6)
+        self.assertEqual(result["status_codes"], {"200": 6})
+        self.assertEqual(result["cache"], {"MISS": 6})
+        self.assertEqual(result["upstream"]["requests"], 6)
+        self.assertGreater(result["bytes_sent"], 0)
+        self.assertLessEqual(result["latency_ms"]["p50"], result["latency_ms"]["p99"])
+
+    @_manual_history
+    def test_bench_stays_out_of_the_history(self):
+        call_command("bench", limit=3, warmup=0, latency_ms=0, jitter_ms=0, json=True, stdout=io.StringIO())
+        get_history_recorder().flush()
+        self.assertEqual(Prediction.objects.count(), 0)
+        self.assertEqual(PredictionRollup.objects.count(), 0)
+
+    def test_stub_injects_errors(self):
+        with StubHFServer(error_rate=1.0, error_status=502) as stub:
+            response = requests.post(stub.url, files={"file": b"leaf"})
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(stub.errors_injected, 1)
+        self.assertGreater(stub.bytes_received, 0)
+
+
+@override_settings(PREDICTION_HISTORY_ENABLED=True, PREDICTION_HISTORY_FLUSH_INTERVAL=3600,
+                   PREDICTION_HISTORY_BATCH_SIZE=1000, PREDICTION_PHASH_ENABLED=False)
+class PredictionHistoryTests(TestCase):
+    def setUp(self):
+        get_prediction_cache().clear()
+
+    def tearDown(self):
+        # Drop whatever a test left buffered inside its own transaction
+        get_history_recorder().flush()
+
+    def test_predictions_are_buffered_then_bulk_written(self):
+        client = mock.Mock()
+        client.predict.return_value = fake_api_response()
+        with mock.patch("prediction.services.get_hf_client", return_value=client):
+            for _ in range(2):
+                upload = SimpleUploadedFile("leaf.jpg", SAMPLE_IMAGE, content_type="image/jpeg")
+                self.assertEqual(self.client.post("/predict/", {"image": upload}).status_code, 200)
+
+        recorder = get_history_recorder()
+        self.assertEqual(Prediction.objects.count(), 0)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(recorder.flush(), 2)
+        inserts = [query["sql"] for query in queries if query["sql"].startswith('INSERT INTO "prediction_prediction"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(list(Prediction.objects.order_by("created_at").values_list("disease", "cache_status")),
+                         [("Alternaria", "MISS"), ("Alternaria", "HIT")])
+        self.assertEqual(Prediction.objects.first().image_hash, uploads.content_hash(SAMPLE_IMAGE))
+        rollup = PredictionRollup.objects.get()
+        self.assertEqual((rollup.category, rollup.disease, rollup.count, rollup.cache_hits), ("Smooth", "Alternaria", 2, 1))
+
+    def test_rollups_accumulate_across_flushes(self):
+        recorder = HistoryRecorder(flush_interval=3600)
+        for disease in ("Fresh", "Fresh", "Holed"):
+            recorder.record("abc", "Smooth", disease, "MISS", 100)
+        recorder.flush()
+        recorder.record("abc", "Smooth", "Fresh", "HIT", 10)
+        recorder.flush()
+
+        rollups = {row.disease: row for row in PredictionRollup.objects.all()}
+        self.assertEqual(rollups["Fresh"].count, 3)
+        self.assertEqual(rollups["Fresh"].cache_hits, 1)
+        self.assertEqual(rollups["Fresh"].average_latency_ms, 70)
+        self.assertEqual(rollups["Holed"].count, 1)
+        self.assertEqual(Prediction.objects.count(), 4)
+
+    def test_failed_flush_keeps_records_up_to_max_pending(self):
+        recorder = HistoryRecorder(flush_interval=3600, max_pending=3)
+        for _ in range(4):
+            recorder.record("abc", "Smooth", "Fresh", "MISS", 100)
+        with mock.patch.object(Prediction.objects, "bulk_create", side_effect=Exception("db down")):
+            self.assertEqual(recorder.flush(), 0)
+        self.assertEqual(recorder.stats(), {"pending": 3, "written": 0, "dropped": 1})
+        self.assertEqual(recorder.flush(), 3)
+
+    def test_summary_reads_rollups(self):
+        now = timezone.now().replace(minute=0, second=0, microsecond=0)
+        PredictionRollup.objects.create(hour=now, category="Smooth", disease="Fresh", count=3, cache_hits=1,
+                                        total_latency_ms=300)
+        PredictionRollup.objects.create(hour=now - timedelta(hours=1), category="Smooth", disease="Fresh", count=1,
+                                        total_latency_ms=100)
+        PredictionRollup.objects.create(hour=now, category="Spoonge", disease="Insect", count=4,
+                                        total_latency_ms=800)
+        PredictionRollup.objects.create(hour=now - timedelta(days=30), category="Smooth", disease="Holed", count=9)
+
+        summary = self.client.get("/predict/summary/", {"days": 7}).json()
+        self.assertEqual(summary["total"], 8)
+        self.assertEqual(summary["cache_hit_rate"], 0.125)
+        self.assertEqual([(row["disease"], row["count"], row["share"], row["avg_latency_ms"])
+                          for row in summary["diseases"]],
+                         [("Fresh", 4, 0.5, 100.0), ("Insect", 4, 0.5, 200.0)])
+
+        summary = self.client.get("/predict/summary/", {"days": 60, "model_type": "smooth"}).json()
+        self.assertEqual({row["disease"]: row["count"] for row in summary["diseases"]}, {"Fresh": 4, "Holed": 9})
+        self.assertEqual(self.client.get("/predict/summary/", {"days": "week"}).status_code, 400)
+
+
+@override_settings(DISEASE_CATALOG_CHECK_INTERVAL=3600)
+class DiseaseCatalogTests(TestCase):
+    def setUp(self):
+        clear_disease_catalog()
+        self.addCleanup(clear_disease_catalog)
+
+    def test_lookups_are_served_from_memory(self):
+        get_disease_catalog()
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                payload = prediction_payload({"prediction": "Fresh", "category": "Smooth"})
+        self.assertEqual(payload["disease_info"], DEFAULT_DISEASES[2].info)
+        self.assertEqual(prediction_payload({"prediction": "Rust", "category": "Smooth"})["disease_info"],
+                         "No info available.")
+
+    def test_admin_edit_reloads_catalog(self):
+        get_disease_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            LuffaDisease.objects.create(disease_name="Fresh", info="Edited in the admin")
+        self.assertEqual(get_disease_catalog().info("Fresh"), "Edited in the admin")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            LuffaDisease.objects.get(disease_name="Fresh").delete()
+        self.assertEqual(get_disease_catalog().info("Fresh"), DEFAULT_DISEASES[2].info)
+
+    def test_edits_by_other_processes_are_seen_after_the_check_interval(self):
+        LuffaDisease.objects.create(disease_name="Fresh", info="Before")
+        with override_settings(DISEASE_CATALOG_CHECK_INTERVAL=0):
+            self.assertEqual(get_disease_catalog().info("Fresh"), "Before")
+            # A queryset update sends no signal, like a save in another worker
+            LuffaDisease.objects.update(info="After", updated_at=timezone.now() + timedelta(seconds=1))
+            with self.assertNumQueries(2):  # version stamp, then the reload
+                self.assertEqual(get_disease_catalog().info("Fresh"), "After")
+            with self.assertNumQueries(1):
+                get_disease_catalog()
+
+    def test_per_category_classes(self):
+        catalog = get_disease_catalog()
+        self.assertEqual(catalog.classes("Smooth"),
+                         ("Alternaria", "Angular Spot", "Fresh", "Holed", "Mosaic Virus", "Others"))
+        self.assertIn("Insect", catalog.classes())
+
+        body = self.client.get("/predict/diseases/", {"model_type": "sponge"}).json()
+        self.assertEqual(body["category"], "Spoonge")
+        self.assertEqual([row["name"] for row in body["diseases"]],
+                         ["Bacteria Leaf Spot", "Downy Mildew", "Fresh", "Insect", "Mosaic disease", "Others"])
+
+
+SPOONGE_LEAF_IMAGE = os.path.join(settings.BASE_DIR, "Luffa Spoonge", "Insect", "Insect-001.jpg")
+
+
+class AutoModelTypeTests(TestCase):
+    def setUp(self):
+        get_prediction_cache().clear()
+        get_perceptual_index().clear()
+        self.hf_client = mock.Mock()
+        self.hf_client.predict.side_effect = self.fake_predict
+        self.delay = 0.0
+        self.failing = ()
+        patcher = mock.patch("prediction.services.get_hf_client", return_value=self.hf_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fake_predict(self, image_bytes, category, **kwargs):
+        time.sleep(self.delay)
+        if category in self.failing:
+            return fake_api_response(status_code=500)
+        return fake_api_response(prediction="Fresh", category=category)
+
+    def post(self, data, **fields):
+        fields.setdefault("model_type", "auto")
+        return self.client.post("/predict/", {"image": SimpleUploadedFile("leaf.jpg", data), **fields})
+
+    @override_settings(PREDICTION_BACKENDS={"Smooth": "local", "Spoonge": "local"})
+    def test_more_confident_model_wins(self):
+        body = self.post(read_file(SPOONGE_LEAF_IMAGE)).json()
+        self.assertEqual(body["model_type"], "auto")
+        self.assertEqual(body["selected_by"], "confidence")
+        self.assertIsNone(body["leaf_type"])  # every backend gave a confidence
+        self.assertNotEqual(body["runner_up"]["category"], body["category"])
+        self.assertGreaterEqual(body["confidence"], body["runner_up"]["confidence"])
+        self.assertIn("disease_info", body["runner_up"])
+        self.hf_client.predict.assert_not_called()
+
+    @override_settings(HF_MAX_RETRIES=0)
+    def test_leaf_type_model_decides_without_confidence(self):
+        for path, category in ((SPOONGE_LEAF_IMAGE, "Spoonge"), (LEAF_IMAGE, "Smooth")):
+            body = self.post(read_file(path)).json()
+            self.assertEqual((body["category"], body["selected_by"]), (category, "leaf_type"))
+            self.assertEqual(body["leaf_type"]["category"], category)
+            self.assertEqual(body["runner_up"]["category"], "Smooth" if category == "Spoonge" else "Spoonge")
+
+    def test_categories_are_asked_concurrently(self):
+        self.delay = 0.3
+        start = time.perf_counter()
+        response = self.post(read_file(LEAF_IMAGE))
+        elapsed = time.perf_counter() - start
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.hf_client.predict.call_count, 2)
+        self.assertLess(elapsed, 0.55)  # the slower call, not the sum (0.6 s)
+
+    @override_settings(HF_MAX_RETRIES=0, HF_BREAKER_ENABLED=False)
+    def test_one_failed_category_returns_the_other(self):
+        self.failing = ("Smooth",)
+        body = self.post(read_file(LEAF_IMAGE)).json()
+        self.assertEqual((body["category"], body["selected_by"]), ("Spoonge", "only_answer"))
+        self.assertIsNone(body["runner_up"])
+        self.assertIn("runner_up_error", body)
+
+        self.failing = ("Smooth", "Spoonge")
+        self.assertEqual(self.post(read_file(OTHER_LEAF_IMAGE)).status_code, 500)
+
+    @override_settings(PREDICTION_LEAF_TYPE_MODEL="/nonexistent/leaf_type.npz")
+    def test_missing_leaf_type_model_falls_back_to_first_category(self):
+        body = self.post(read_file(SPOONGE_LEAF_IMAGE)).json()
+        self.assertEqual((body["category"], body["selected_by"]), ("Smooth", "default"))
+        self.assertIsNone(body["leaf_type"])
+
+    @override_settings(PREDICTION_DEFAULT_MODEL_TYPE="auto")
+    def test_default_model_type_setting(self):
+        response = self.client.post("/predict/", {"image": SimpleUploadedFile("leaf.jpg", read_file(LEAF_IMAGE))})
+        self.assertEqual(response.json()["model_type"], "auto")
+        # auto is not a category the summary can be filtered by
+        self.assertEqual(self.client.get("/predict/summary/", {"model_type": "auto"}).status_code, 400)
+
+    @_manual_history
+    def test_history_records_the_chosen_category_once(self):
+        recorder = get_history_recorder()
+        self.post(read_file(SPOONGE_LEAF_IMAGE))
+        recorder.flush()
+        self.assertEqual(list(Prediction.objects.values_list("category", flat=True)), ["Spoonge"])
+
+    def test_async_view(self):
+        self.delay = 0.2
+        request = AsyncRequestFactory().post("/predict/", {
+            "image": SimpleUploadedFile("leaf.jpg", read_file(SPOONGE_LEAF_IMAGE)), "model_type": "auto"})
+        with mock.patch("prediction.services.get_async_hf_client") as async_client:
+            async def apredict(image_bytes, category, **kwargs):
+                await asyncio.sleep(self.delay)
+                return fake_api_response(prediction="Fresh", category=category)
+            async_client.return_value.predict.side_effect = apredict
+            start = time.perf_counter()
+            response = async_to_sync(views.apredict)(request)
+            elapsed = time.perf_counter() - start
+        body = json.loads(response.content)
+        self.assertEqual((body["category"], body["selected_by"]), ("Spoonge", "leaf_type"))
+        self.assertLess(elapsed, 0.38)
+
+    def test_batch_and_jobs_accept_auto(self):
+        response = self.client.post("/predict/batch/", {
+            "images": [SimpleUploadedFile("a.jpg", read_file(LEAF_IMAGE))], "model_type": "auto"})
+        self.assertEqual(response.json()["results"][0]["selected_by"], "leaf_type")
+        response = self.client.post("/predict/jobs/", {"image": SimpleUploadedFile("a.jpg", read_file(LEAF_IMAGE)),
+                                                       "model_type": "auto"})
+        self.assertEqual(response.json()["category"], "auto")
+        self.assertEqual(JobWorkerPool(workers=0).run_pending(), 1)
+        body = self.client.get(response["Location"]).json()
+        self.assertEqual((body["status"], body["result"]["selected_by"]), ("succeeded", "leaf_type"))
+
+
+@override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMIT_API_KEYS=["partner-key"], RATE_LIMITS={
+    "predict": {"client": "3/m", "key": "10/m", "global": "5/m"},
+    "chat": {"client": "2/m", "global": ""},
+})
+class RateLimitTests(TestCase):
+    def setUp(self):
+        caches[settings.RATE_LIMIT_CACHE_ALIAS].clear()
+        get_prediction_cache().clear()
+        self.hf_client = mock.Mock()
+        self.hf_client.predict.return_value = fake_api_response()
+        patcher = mock.patch("prediction.services.get_hf_client", return_value=self.hf_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, ip="10.0.0.1", **extra):
+        upload = SimpleUploadedFile("leaf.jpg", SAMPLE_IMAGE, content_type="image/jpeg")
+        return self.client.post("/predict/", {"image": upload}, REMOTE_ADDR=ip, **extra)
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate("30/m"), (30, 60))
+        self.assertEqual(parse_rate("100/5s"), (100, 5))
+        with self.assertRaises(ValueError):
+            parse_rate("30/week")
+
+    def test_client_bucket_refuses_with_retry_after(self):
+        self.assertEqual([self.post().status_code for _ in range(3)], [200, 200, 200])
+        response = self.post()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "20")  # one token every 20 s
+        self.assertEqual(response.json()["retry_after"], 20)
+        self.assertEqual(self.hf_client.predict.call_count, 1)  # then cache hits; refused requests never get that far
+        # Other clients have their own bucket
+        self.assertEqual(self.post(ip="10.0.0.2").status_code, 200)
+
+    def test_global_bucket_and_refund(self):
+        for ip in ("10.0.0.1", "10.0.0.2"):
+            for _ in range(2):
+                self.assertEqual(self.post(ip=ip).status_code, 200)
+        self.assertEqual(self.post(ip="10.0.0.3").status_code, 200)
+        self.assertEqual(self.post(ip="10.0.0.3").status_code, 429)  # the global bucket is empty
+        # The refused request gave its client token back
+        bucket = TokenBucket("3/m", settings.RATE_LIMIT_CACHE_ALIAS)
+        self.assertEqual(bucket.hit("predict:ip:10.0.0.3"), 0)
+
+    def test_bucket_refills(self):
+        bucket = TokenBucket("2/s", settings.RATE_LIMIT_CACHE_ALIAS)
+        now = time.time_ns()
+        with mock.patch("prediction.ratelimit.time.time_ns", return_value=now):
+            self.assertEqual([bucket.hit("k"), bucket.hit("k")], [0, 0])
+            self.assertAlmostEqual(bucket.hit("k"), 0.5, places=3)
+        with mock.patch("prediction.ratelimit.time.time_ns", return_value=now + 500_000_000):
+            self.assertEqual(bucket.hit("k"), 0)
+            self.assertGreater(bucket.hit("k"), 0)
+        with mock.patch("prediction.ratelimit.time.time_ns", return_value=now + 10 * 10**9):
+            self.assertEqual([bucket.hit("k"), bucket.hit("k")], [0, 0])  # full again, not 20 tokens
+
+    def test_api_key_gets_its_own_bucket(self):
+        for _ in range(3):
+            self.post()
+        self.assertEqual(self.post().status_code, 429)
+        self.assertEqual(self.post(HTTP_X_API_KEY="partner-key").status_code, 200)
+        # Unknown keys are limited by IP
+        self.assertEqual(self.post(HTTP_X_API_KEY="made-up").status_code, 429)
+
+    @override_settings(RATE_LIMIT_TRUSTED_PROXIES=1)
+    def test_forwarded_address_behind_proxy(self):
+        for _ in range(3):
+            self.post(ip="10.9.9.9", HTTP_X_FORWARDED_FOR="203.0.113.7")
+        self.assertEqual(self.post(ip="10.9.9.9", HTTP_X_FORWARDED_FOR="203.0.113.7").status_code, 429)
+        self.assertEqual(self.post(ip="10.9.9.9", HTTP_X_FORWARDED_FOR="198.51.100.1").status_code, 200)
+
+    @override_settings(RATE_LIMIT_TRUSTED_PROXIES=1, RATE_LIMITS={"predict": {"client": "3/m", "global": ""}})
+    def test_clients_behind_one_proxy_get_separate_buckets(self):
+        proxy = "10.9.9.9"
+        for client in ("203.0.113.7", "198.51.100.1"):
+            statuses = [self.post(ip=proxy, HTTP_X_FORWARDED_FOR=client).status_code for _ in range(4)]
+            self.assertEqual(statuses, [200, 200, 200, 429], client)
+
+    def test_render_deployment_trusts_its_proxy(self):
+        script = "from django.conf import settings; import django; django.setup(); print(settings.RATE_LIMIT_TRUSTED_PROXIES)"
+        env = {key: value for key, value in os.environ.items() if key != "RATE_LIMIT_TRUSTED_PROXIES"}
+        env.update(DJANGO_SETTINGS_MODULE="luffa_prediction.settings", RENDER="true")
+        output = subprocess.run([sys.executable, "-c", script], cwd=settings.BASE_DIR, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip().splitlines()[-1], "1")
+        with open(os.path.join(settings.BASE_DIR, "render.yaml")) as f:
+            self.assertIn('- key: RATE_LIMIT_TRUSTED_PROXIES\n        value: "1"', f.read())
+
+    def test_batch_takes_a_token_per_image(self):
+        images = [SimpleUploadedFile(f"{i}.jpg", SAMPLE_IMAGE) for i in range(2)]
+        self.assertEqual(self.client.post("/predict/batch/", {"images": images}).status_code, 200)
+        self.assertEqual(self.post(ip="127.0.0.1").status_code, 200)
+        self.assertEqual(self.post(ip="127.0.0.1").status_code, 429)
+
+    def test_page_views_are_not_limited(self):
+        for _ in range(5):
+            self.assertEqual(self.client.get("/predict/").status_code, 200)
+
+    def test_async_views_are_limited(self):
+        factory = AsyncRequestFactory()
+
+        async def chat_twice_then_once_more():
+            responses = []
+            for _ in range(3):
+                request = factory.post("/chat/api/", {"message": ""}, content_type="application/json")
+                responses.append(await views.achat_api(request))
+            return responses
+
+        statuses = [response.status_code for response in async_to_sync(chat_twice_then_once_more)()]
+        self.assertEqual(statuses, [400, 400, 429])
+
+    def test_unreachable_cache_lets_requests_through(self):
+        with mock.patch("prediction.ratelimit.TokenBucket.hit", side_effect=ConnectionError("redis down")):
+            self.assertEqual([self.post().status_code for _ in range(5)], [200] * 5)
+
+    @override_settings(RATE_LIMIT_ENABLED=False, HF_MAX_IN_FLIGHT=1, UPSTREAM_BUSY_RETRY_AFTER=2)
+    def test_upstream_in_flight_cap(self):
+        with get_inflight_limiter("hf"):
+            response = self.post()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "2")
+        self.hf_client.predict.assert_not_called()
+        self.assertEqual(self.post().status_code, 200)
+        self.assertEqual(get_inflight_limiter("hf").in_flight, 0)
+
+    @override_settings(RATE_LIMIT_ENABLED=False, OPENROUTER_MAX_IN_FLIGHT=1)
+    def test_chat_in_flight_cap(self):
+        get_chat_cache().clear()
+        client = mock.Mock()
+        client.chat.completions.create.return_value = iter(stream_chunks(CHAT_REPLY, 5))
+        with mock.patch("prediction.chatbot.get_chat_client", return_value=client):
+            with get_inflight_limiter("openrouter"):
+                for stream in (False, True):
+                    response = self.client.post("/chat/api/", {"message": "mildew?", "stream": stream},
+                                                content_type="application/json")
+                    self.assertEqual(response.status_code, 503)
+                    self.assertEqual(response["Retry-After"], "1")
+            response = self.client.post("/chat/api/", {"message": "mildew?", "stream": True},
+                                        content_type="application/json")
+            b"".join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_inflight_limiter("openrouter").in_flight, 0)
+
+    def test_in_flight_limiter(self):
+        limiter = InFlightLimiter("test", limit=2)
+        with limiter, limiter:
+            with self.assertRaises(Saturated):
+                limiter.acquire()
+        self.assertEqual((limiter.in_flight, limiter.rejected), (0, 1))
+
+    def test_bench_command(self):
+        out = io.StringIO()
+        call_command("bench_ratelimit", iterations=200, clients=10, json=True, stdout=out)
+        results = {row["case"]: row for row in json.loads(out.getvalue())["results"]}
+        self.assertEqual(len(results), 5)
+        self.assertLess(results["allowed, one client"]["p50_us"], 1000)
+
+
+class DatasetCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        self.images = list(iter_dataset())[::50]
+
+    def test_build_then_reuse(self):
+        cache, stats = build_dataset_cache(self.cache_dir, self.images, workers=1)
+        self.assertEqual((stats["decoded"], stats["reused"], stats["rewritten"]), (20, 0, True))
+        self.assertEqual(cache.images.shape, (20, 224, 224, 3))
+        self.assertEqual(cache.images.dtype, np.uint8)
+        path, category, label = self.images[3]
+        np.testing.assert_array_equal(cache.images[3], decode_image(read_file(path)))
+        self.assertEqual((cache.entries[3]["category"], cache.entries[3]["label"]), (category, label))
+        self.assertEqual(cache.by_hash[uploads.content_hash(read_file(path))], 3)
+
+        # A re-run decodes nothing and leaves the files alone
+        cache, stats = build_dataset_cache(self.cache_dir, self.images, workers=1)
+        self.assertEqual((stats["decoded"], stats["rewritten"]), (0, False))
+
+        # A moved file is found by its hash; only new images are decoded
+        moved = os.path.join(self.cache_dir, "moved.jpg")
+        shutil.copy(self.images[0][0], moved)
+        extra = list(iter_dataset())[1]
+        images = [(moved, *self.images[0][1:])] + self.images[1:] + [extra]
+        cache, stats = build_dataset_cache(self.cache_dir, images, workers=1)
+        self.assertEqual((stats["decoded"], stats["reused"], stats["rewritten"]), (1, 20, True))
+        self.assertEqual(len(DatasetCache.open(self.cache_dir)), 21)
+
+    def test_process_pool(self):
+        cache, stats = build_dataset_cache(self.cache_dir, self.images[:4], workers=2)
+        self.assertEqual(stats["decoded"], 4)
+        np.testing.assert_array_equal(cache.images[1], decode_image(read_file(self.images[1][0])))
+
+    def test_missing_cache(self):
+        self.assertIsNone(DatasetCache.open(self.cache_dir))
+        with self.assertRaises(CommandError):
+            call_command("evaluate", cache_dir=self.cache_dir, stdout=io.StringIO())
+
+    def test_evaluate_local_backend(self):
+        build_dataset_cache(self.cache_dir, self.images, workers=1)
+        out = io.StringIO()
+        call_command("evaluate", cache_dir=self.cache_dir, backend="local", json=True, stdout=out)
+        results = {row["category"]: row for row in json.loads(out.getvalue())}
+        self.assertEqual(set(results), {"Smooth", "Spoonge"})
+        for row in results.values():
+            self.assertEqual(row["backend"], "local")
+            self.assertEqual(sum(map(sum, row["confusion"])), row["images"])
+            self.assertGreater(row["accuracy"], 0.5)
+
+    def test_evaluate_remote_backend(self):
+        build_dataset_cache(self.cache_dir, self.images, workers=1)
+        out = io.StringIO()
+        with StubHFServer() as stub, override_settings(HF_API_BASE=stub.url):
+            call_command("evaluate", cache_dir=self.cache_dir, backend="remote", category=["Smooth"],
+                         json=True, stdout=out)
+        [row] = json.loads(out.getvalue())
+        labels = [label for _, category, label in self.images if category == "Smooth"]
+        self.assertEqual(len(stub.requests), len(labels))
+        # The stub always answers "Fresh"
+        self.assertEqual(row["accuracy"], round(labels.count("Fresh") / len(labels), 4))
+        self.assertEqual(row["confusion"][row["labels"].index("Fresh")][row["labels"].index("Fresh")],
+                         labels.count("Fresh"))
+
+
+class PredictDirTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        images = list(iter_dataset())[::100]
+        os.makedirs(os.path.join(self.root, "field", "day2"))
+        for i, (path, _, _) in enumerate(images):
+            folder = "field" if i % 2 else os.path.join("field", "day2")
+            shutil.copy(path, os.path.join(self.root, folder, f"{i:02d}.jpg"))
+        with open(os.path.join(self.root, "notes.jpg"), "wb") as f:
+            f.write(b"not an image")
+        with open(os.path.join(self.root, "readme.txt"), "w") as f:
+            f.write("skipped, not an image extension")
+        self.count = len(images) + 1
+        self.output = os.path.join(self.root, "out", "results.jsonl")
+        os.makedirs(os.path.dirname(self.output))
+
+    def run_command(self, **options):
+        out = io.StringIO()
+        call_command("predict_dir", self.root, output=self.output, backend="local", stdout=out,
+                     stderr=io.StringIO(), **options)
+        return out.getvalue()
+
+    def records(self):
+        with open(self.output) as f:
+            return [json.loads(line) for line in f]
+
+    @_manual_history
+    def test_writes_jsonl(self):
+        recorder = get_history_recorder()
+        self.run_command(model_type="smooth")
+        records = {record["path"]: record for record in self.records()}
+        self.assertEqual(len(records), self.count)
+        self.assertEqual(records["notes.jpg"]["code"], 415)
+        record = records[os.path.join("field", "01.jpg")]
+        self.assertEqual((record["status"], record["model_type"], record["category"]), ("success", "Smooth", "Smooth"))
+        self.assertEqual(record["disease_info"], get_disease_catalog().info(record["prediction"]))
+        # Bulk runs stay out of the prediction history unless asked
+        recorder.flush()
+        self.assertEqual(Prediction.objects.count(), 0)
+
+    def test_csv_output(self):
+        self.output = self.output.replace(".jsonl", ".csv")
+        self.run_command(model_type="auto", concurrency=2)
+        with open(self.output, newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), self.count)
+        self.assertTrue(all(row["selected_by"] for row in rows if row["status"] == "success"))
+
+    def test_resume_skips_finished_files(self):
+        original = predict_dir.predict_image
+        failing = os.path.join("field", "03.jpg")
+
+        def flaky(data, category, filename, **kwargs):
+            if filename == os.path.basename(failing):
+                raise PredictionError("Upstream failed", status=502)
+            return original(data, category, filename=filename, **kwargs)
+
+        with mock.patch.object(predict_dir, "predict_image", side_effect=flaky):
+            self.run_command()
+        self.assertEqual([r["code"] for r in self.records() if r["path"] == failing], [502])
+        # A crash mid-write leaves half a line behind
+        with open(self.output, "a") as f:
+            f.write('{"path": "field/0')
+
+        with mock.patch.object(predict_dir, "predict_image", wraps=original) as predict:
+            summary = self.run_command()
+        # Only the server-side failure is tried again; the 415 is final
+        self.assertEqual(predict.call_count, 1)
+        self.assertIn(f"{self.count - 1} already done", summary)
+        records = self.records()
+        self.assertEqual(len(records), self.count + 1)
+        self.assertEqual(records[-1]["path"], failing)
+        self.assertEqual(records[-1]["status"], "success")
+
+    def test_not_a_directory(self):
+        with self.assertRaises(CommandError):
+            call_command("predict_dir", os.path.join(self.root, "missing"), output=self.output)
+
+
+class StaticPipelineTests(SimpleTestCase):
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        os.makedirs(os.path.join(self.source, "asset", "1x"))
+        os.makedirs(os.path.join(self.source, "css"))
+        shutil.copy(os.path.join(settings.BASE_DIR, "static", "css", "style.css"),
+                    os.path.join(self.source, "css", "style.css"))
+        for name, size in [("LuffaLense.png", (432, 426)), (os.path.join("1x", "frame.png"), (600, 338))]:
+            x, y = np.meshgrid(np.linspace(0, 255, size[0]), np.linspace(0, 255, size[1]))
+            pixels = np.stack([x, y, (x + y) / 2, np.full_like(x, 255)], axis=-1).astype(np.uint8)
+            Image.fromarray(pixels, "RGBA").save(os.path.join(self.source, "asset", name))
+        self.settings_override = override_settings(
+            STATIC_ROOT=self.root,
+            STATICFILES_DIRS=[self.source],
+            STATICFILES_FINDERS=["django.contrib.staticfiles.finders.FileSystemFinder"],
+            STORAGES={**settings.STORAGES, "staticfiles": {
+                "BACKEND": "prediction.staticfiles.OptimizedStaticFilesStorage"}},
+            STATIC_IMAGE_WIDTHS=[80, 160],
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def collectstatic(self):
+        call_command("collectstatic", interactive=False, verbosity=0)
+        # Re-read the manifest collectstatic just wrote
+        self.settings_override.disable()
+        self.settings_override.enable()
+        return staticfiles_storage
+
+    def test_collectstatic_writes_variants_and_compressed_copies(self):
+        storage = self.collectstatic()
+        names = set(storage.hashed_files)
+        for width in (80, 160, 432):
+            self.assertIn(f"asset/LuffaLense.{width}w.avif", names)
+            self.assertIn(f"asset/LuffaLense.{width}w.webp", names)
+        # Smaller PNGs for browsers without AVIF/WebP; the original is the full-width one
+        self.assertIn("asset/LuffaLense.80w.png", names)
+        self.assertNotIn("asset/LuffaLense.432w.png", names)
+        with Image.open(storage.path(storage.hashed_files["asset/LuffaLense.80w.avif"])) as image:
+            self.assertEqual(image.size, (80, 79))
+        css = storage.path(storage.hashed_files["css/style.css"])
+        self.assertTrue(os.path.exists(css + ".br"))
+        self.assertTrue(os.path.exists(css + ".gz"))
+        self.assertFalse(os.path.exists(storage.path(storage.hashed_files["asset/LuffaLense.80w.avif"]) + ".br"))
+
+        # Unchanged sources keep their variants on the next run
+        variant = storage.path("asset/LuffaLense.160w.webp")
+        modified = os.path.getmtime(variant)
+        self.collectstatic()
+        self.assertEqual(os.path.getmtime(variant), modified)
+
+    def test_responsive_markup(self):
+        template = Template("{% load responsive %}{% responsive_image 'asset/LuffaLense.png' alt='Logo' "
+                            "sizes='40px' height='40' %}|{% image_set 'asset/1x/frame.png' %}")
+        # Without a manifest (development, the rest of these tests) there is nothing to offer but the original
+        with override_settings(STORAGES=_unhashed_static.options["STORAGES"]):
+            self.assertEqual(template.render(Context()),
+                             '<img src="/static/asset/LuffaLense.png" alt="Logo" height="40">'
+                             '|url("/static/asset/1x/frame.png")')
+
+        storage = self.collectstatic()
+        picture, image_set = template.render(Context()).split("|")
+        avif = storage.url("asset/LuffaLense.80w.avif")
+        self.assertIn(f'<source type="image/avif" srcset="{avif} 80w, ', picture)
+        self.assertIn('sizes="40px"', picture)
+        self.assertIn(f'<img src="{storage.url("asset/LuffaLense.png")}" srcset="', picture)
+        self.assertIn('alt="Logo" height="40"', picture)
+        self.assertTrue(image_set.startswith(
+            f'image-set(url("{storage.url("asset/1x/frame.600w.avif")}") type("image/avif"), '))
+        self.assertTrue(image_set.endswith(f'url("{storage.url("asset/1x/frame.png")}") type("image/png"))'))
+
+    def test_hashed_files_are_immutable(self):
+        storage = self.collectstatic()
+        response = self.client.get(storage.url("css/style.css"), HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=315360000", response["Cache-Control"])
+
+    def test_page_weight(self):
+        with self.assertRaises(CommandError):
+            call_command("page_weight", stdout=io.StringIO())
+        self.collectstatic()
+        out = io.StringIO()
+        call_command("page_weight", "/", json=True, stdout=out)
+        [page] = json.loads(out.getvalue())["pages"]
+        urls = [resource["url"] for resource in page["resources"]]
+        self.assertIn(staticfiles_storage.url("asset/LuffaLense.80w.avif"), urls)
+        self.assertIn(staticfiles_storage.url("asset/1x/frame.600w.avif"), urls)
+        self.assertLess(page["after"], page["before"])
@@ -0,0 +1,91 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .imaging import sniff_image_type
+
+logger = logging.getLogger(__name__)
+
+# ====================================================
+# Upload Handling
+# ====================================================
+# Uploads are forwarded to the prediction API straight from memory. Archiving
+# to disk is opt-in (PREDICTION_ARCHIVE_ENABLED) and happens on a background
+# thread so disk latency never lands on the request path. At most
+# PREDICTION_ARCHIVE_MAX_PENDING uploads wait for it; when the disk falls behind
+# further uploads are not archived rather than piling up in memory. The file
+# extension comes from the image's magic bytes, never from the client's filename.
+_archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-archive')
+_archive_lock = threading.Lock()
+_archive_pending = 0
+archive_dropped = 0
+ARCHIVE_EXTENSIONS = {"jpeg": ".jpg", "tiff": ".tif"}
+
+
+def read_upload(uploaded_file):
+    """Return the full contents of a Django ``UploadedFile`` as bytes."""
+    return b"".join(uploaded_file.chunks())
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _archive_dir():
+    return os.path.join(settings.MEDIA_ROOT, 'predictions')
+
+
+def _write_archive(data, digest, ext):
+    directory = _archive_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{digest}{ext}")
+    if os.path.exists(path):
+        # Content-addressed: identical bytes are already archived
+        return path
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as destination:
+            destination.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        logger.exception(f"Failed to archive upload {digest}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    logger.info(f"Archived upload to: {path}")
+    return path
+
+
+def archive_extension(data):
+    image_type = sniff_image_type(data)
+    return ARCHIVE_EXTENSIONS.get(image_type, f".{image_type}") if image_type else ".bin"
+
+
+def _archive_done(future):
+    global _archive_pending
+    with _archive_lock:
+        _archive_pending -= 1
+
+
+def archive_upload(data, digest=None):
+    """Queue ``data`` to be archived as ``<sha256><ext>`` under MEDIA_ROOT.
+
+    Returns a future, or ``None`` when archiving is disabled or the queue is full.
+    """
+    global _archive_pending, archive_dropped
+    if not getattr(settings, 'PREDICTION_ARCHIVE_ENABLED', False):
+        return None
+    digest = digest or content_hash(data)
+    with _archive_lock:
+        if _archive_pending >= getattr(settings, 'PREDICTION_ARCHIVE_MAX_PENDING', 100):
+            archive_dropped += 1
+            logger.warning(f"Archive queue full, not archiving upload {digest}")
+            return None
+        _archive_pending += 1
+    future = _archive_executor.submit(_write_archive, data, digest, archive_extension(data))
+    future.add_done_callback(_archive_done)
+    return future
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# ====================================================
+# Hugging Face Space Client
+# ====================================================
+# One pooled session per process keeps TLS connections to the Space alive
+# between predictions. Every attempt is bounded by separate connect/read
+# timeouts and 5xx/429 responses and connection failures are retried with
+# jittered backoff. A read timeout is not retried: the Space already has the
+# image and may still be running it, so a retry would only pile more work on
+# an overloaded model and multiply the time the caller waits.
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class RetryPolicy:
+    def __init__(self, max_retries=2, backoff_base=0.5, backoff_max=8.0):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def backoff(self, attempt, response=None):
+        """Seconds to wait before retry ``attempt`` (full jitter, honours Retry-After)."""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+
+class HFClient(RetryPolicy):
+    def __init__(self, base_url, pool_size=10, connect_timeout=3.05, read_timeout=60,
+                 max_retries=2, backoff_base=0.5, backoff_max=8.0):
+        super().__init__(max_retries, backoff_base, backoff_max)
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def predict(self, image_bytes, category, filename="image.jpg", content_type="application/octet-stream"):
+        """POST an image to the Space and return the final ``requests.Response``.
+
+        Raises ``requests.ConnectionError`` when every attempt failed to connect,
+        and ``requests.ReadTimeout`` as soon as one attempt times out waiting for the reply.
+        """
+        files = {"file": (filename, image_bytes, content_type)}
+        attempts = self.max_retries + 1
+        for attempt in range(1, attempts + 1):
+            start = time.perf_counter()
+            try:
+                response = self.session.post(self.base_url, params={"category": category},
+                                             files=files, timeout=self.timeout)
+            except requests.ConnectionError as e:  # includes ConnectTimeout
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                logger.warning(f"HF attempt {attempt}/{attempts} failed after {elapsed_ms:.1f} ms: {e}")
+                if attempt == attempts:
+                    raise
+                time.sleep(self.backoff(attempt))
+                continue
+
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            logger.info(f"HF attempt {attempt}/{attempts}: status={response.status_code} latency={elapsed_ms:.1f} ms")
+            if response.status_code in RETRY_STATUSES and attempt < attempts:
+                time.sleep(self.backoff(attempt, response))
+                continue
+            return response
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncHFClient(RetryPolicy):
+    """``HFClient`` for async views, backed by a pooled ``httpx.AsyncClient``.
+
+    httpx is only imported once an async client is built, keeping it out of
+    sync-only workers and management commands.
+    """
+
+    def __init__(self, base_url, max_connections=100, connect_timeout=3.05, read_timeout=60,
+                 max_retries=2, backoff_base=0.5, backoff_max=8.0):
+        super().__init__(max_retries, backoff_base, backoff_max)
+        self.base_url = base_url
+        import httpx
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+
+    async def predict(self, image_bytes, category, filename="image.jpg", content_type="application/octet-stream"):
+        """Async counterpart of ``HFClient.predict``; raises ``httpx.TransportError``."""
+        import httpx
+        # Failures before the request reached the Space; read and write timeouts are not retried
+        retryable = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)
+        files = {"file": (filename, image_bytes, content_type)}
+        attempts = self.max_retries + 1
+        for attempt in range(1, attempts + 1):
+            start = time.perf_counter()
+            try:
+                response = await self.client.post(self.base_url, params={"category": category}, files=files)
+            except httpx.TransportError as e:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                logger.warning(f"HF attempt {attempt}/{attempts} failed after {elapsed_ms:.1f} ms: {e!r}")
+                if attempt == attempts or not isinstance(e, retryable):
+                    raise
+                await asyncio.sleep(self.backoff(attempt))
+                continue
+
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            logger.info(f"HF attempt {attempt}/{attempts}: status={response.status_code} latency={elapsed_ms:.1f} ms")
+            if response.status_code in RETRY_STATUSES and attempt < attempts:
+                await asyncio.sleep(self.backoff(attempt, response))
+                continue
+            return response
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_hf_client():
+    """Return the process-wide ``HFClient`` configured from settings."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HFClient(
+                    settings.HF_API_BASE,
+                    pool_size=settings.HF_POOL_SIZE,
+                    connect_timeout=settings.HF_CONNECT_TIMEOUT,
+                    read_timeout=settings.HF_READ_TIMEOUT,
+                    max_retries=settings.HF_MAX_RETRIES,
+                    backoff_base=settings.HF_BACKOFF_BASE,
+                    backoff_max=settings.HF_BACKOFF_MAX,
+                )
+    return _client
+
+
+# httpx async clients are bound to the event loop they were first used on, so
+# keep one per loop (uvicorn runs a single loop per worker process).
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_hf_client():
+    """Return the ``AsyncHFClient`` for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncHFClient(
+            settings.HF_API_BASE,
+            max_connections=settings.HF_ASYNC_MAX_CONNECTIONS,
+            connect_timeout=settings.HF_CONNECT_TIMEOUT,
+            read_timeout=settings.HF_READ_TIMEOUT,
+            max_retries=settings.HF_MAX_RETRIES,
+            backoff_base=settings.HF_BACKOFF_BASE,
+            backoff_max=settings.HF_BACKOFF_MAX,
+        )
+    return client
+
+
+@receiver(setting_changed)
+def _reset_hf_client(setting, **kwargs):
+    global _client
+    if not setting.startswith('HF_'):
+        return
+    if _client is not None:
+        _client.close()
+        _client = None
+    _async_clients.clear()
@@ -1,9 +1,24 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Native async views only pay off under an ASGI server (see ASYNC_VIEWS in settings)
+if settings.ASYNC_VIEWS:
+    predict_view, chat_api_view = views.apredict, views.achat_api
+else:
+    predict_view, chat_api_view = views.predict, views.chat_api
+
 urlpatterns = [
     path('', views.home, name='home'),
-    path('predict/', views.predict, name='predict'),
+    path('predict/', predict_view, name='predict'),
+    path('predict/batch/', views.predict_batch, name='predict_batch'),
+    path('predict/jobs/', views.predict_jobs, name='predict_jobs'),
+    path('predict/jobs/<uuid:job_id>/', views.predict_job, name='predict_job'),
+    path('predict/diseases/', views.diseases, name='diseases'),
+    path('predict/summary/', views.prediction_summary, name='prediction_summary'),
     path('chat/', views.chat, name='chat'),
-    path('chat/api/', views.chat_api, name='chat_api'),
+    path('chat/api/', chat_api_view, name='chat_api'),
+    path('healthz', views.healthz, name='healthz'),
+    path('readyz', views.readyz, name='readyz'),
+    path('metrics', views.metrics, name='metrics'),
 ]
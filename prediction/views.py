@@ -1,146 +1,309 @@
 import warnings
 warnings.filterwarnings("ignore")
-import requests
+import itertools
 import json
 import logging
-import re
 import os
-from django.shortcuts import render
-from django.http import JsonResponse
+import threading
+from datetime import timedelta
+from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.cache import never_cache
 from django.conf import settings
-import openai
+from django.utils import timezone
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
 
-# ====================================================
-# Hugging Face API Configuration
-# ====================================================
-HF_API_BASE = "https://Abid1012-luffa-disease-api.hf.space/predict/image"
+from .catalog import aget_disease_catalog, get_disease_catalog
+from .chatbot import acomplete_chat, astream_chat, complete_chat, stream_chat
+from .history import summarize
+from .jobs import callback_allowed, job_payload, submit_job
+from .metrics import REGISTRY, STAGE_SECONDS
+from .models import PredictionJob
+from .ratelimit import Saturated, rate_limit
+from .resilience import upstream_health
+from .services import (PredictionError, apredict_image, check_image, get_batch_executor, normalize_category,
+                       predict_image, prediction_payload)
+from .uploads import read_upload
+from .warmup import get_warmup
 
 # ====================================================
-# Disease Information Dictionary
+# Prediction Views
 # ====================================================
-DISEASE_INFO_DICT = {
-    'Alternaria': 'Alternaria leaf spot is a fungal disease that causes dark spots on leaves. It thrives in warm, humid conditions.',
-    'Angular Spot': 'Angular leaf spot is a bacterial disease causing angular water-soaked lesions on leaves.',
-    'Fresh': 'The leaf appears healthy and fresh with no visible signs of disease.',
-    'Holed': 'Holes in leaves may be caused by insect damage or physical injury.',
-    'Mosaic Virus': 'Mosaic virus causes mottled patterns on leaves and can stunt plant growth.',
-    'Others': 'Other unidentified diseases or conditions affecting the plant.',
-    'Bacteria Leaf Spot': 'Bacterial leaf spot causes small, dark lesions on leaves that may have a yellow halo.',
-    'Downy Mildew': 'Downy mildew is a fungal disease that appears as white or gray patches on the underside of leaves.',
-    'Insect': 'Signs of insect damage such as holes, chewing marks, or discoloration.',
-    'Mosaic disease': 'Mosaic disease causes irregular patterns and discoloration on leaves.'
-}
+def prediction_error_response(error):
+    response = JsonResponse({"error": error.message}, status=error.status)
+    if error.retry_after is not None:
+        response["Retry-After"] = str(error.retry_after)
+    return response
 
-# ====================================================
-# Markdown Removal Function
-# ====================================================
-def remove_markdown(text):
-    # Remove bold/italic markdown
-    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)  # Bold
-    text = re.sub(r'\*(.*?)\*', r'\1', text)      # Italic
-    text = re.sub(r'_(.*?)_', r'\1', text)        # Italic underscore
-    text = re.sub(r'`(.*?)`', r'\1', text)        # Inline code
-    # Remove headers
-    text = re.sub(r'^#+\s*', '', text, flags=re.MULTILINE)
-    # Remove bullet points
-    text = re.sub(r'^[\*\-\+]\s*', '', text, flags=re.MULTILINE)
-    # Remove numbered lists
-    text = re.sub(r'^\d+\.\s*', '', text, flags=re.MULTILINE)
-    # Remove links
-    text = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', text)
-    # Remove extra newlines
-    text = re.sub(r'\n\s*\n', '\n\n', text)
-    return text.strip()
+def upstream_busy_response(error):
+    """503 for a call refused by the upstream in-flight cap."""
+    response = JsonResponse({"error": "The assistant is busy, retry shortly"}, status=503)
+    response["Retry-After"] = str(error.retry_after)
+    return response
+
+def prediction_response(result, cache_status, catalog=None):
+    response = JsonResponse(prediction_payload(result, catalog))
+    response["X-Cache"] = cache_status
+    return response
 
 @csrf_exempt
 @never_cache
+@rate_limit("predict")
 def predict(request):
     logger = logging.getLogger(__name__)
     if request.method == "POST":
         try:
-            image_file = request.FILES.get("image")
-            category = request.POST.get("model_type", "Smooth").capitalize()  # Default to Smooth, capitalize
-
-            # Map "Sponge" to "Spoonge" for API compatibility
-            if category == "Sponge":
-                category = "Spoonge"
+            with STAGE_SECONDS.time("upload_read"):
+                # The multipart body is parsed on first access to request.FILES
+                image_file = request.FILES.get("image")
+                model_type = request.POST.get("model_type")
+                # Read the upload into memory and forward it without touching disk
+                image_bytes = read_upload(image_file) if image_file else None
 
-            logger.info(f"Received prediction request: category={category}, image_file={image_file.name if image_file else 'None'}")
+            logger.info(f"Received prediction request: category={model_type}, image_file={image_file.name if image_file else 'None'}")
 
             if not image_file:
                 logger.warning("No image provided in prediction request")
                 return JsonResponse({"error": "No image provided"}, status=400)
 
-            if category not in ["Smooth", "Spoonge"]:
-                logger.warning(f"Invalid category provided: {category}")
-                return JsonResponse({"error": "Invalid category. Must be 'Smooth' or 'Spoonge'"}, status=400)
-
-            # Save the uploaded image to media/predictions/current.jpg
-            media_dir = os.path.join(settings.MEDIA_ROOT, 'predictions')
-            os.makedirs(media_dir, exist_ok=True)
-            image_path = os.path.join(media_dir, 'current.jpg')
-            with open(image_path, 'wb+') as destination:
-                for chunk in image_file.chunks():
-                    destination.write(chunk)
-            logger.info(f"Image saved to: {image_path}")
-
-            # Prepare API request using the saved file
-            url = f"{HF_API_BASE}?category={category}"
-            with open(image_path, 'rb') as f:
-                files = {"file": f}
-                logger.info(f"Making API request to: {url}")
-                response = requests.post(url, files=files)
-
-            if response.status_code != 200:
-                logger.error(f"API request failed with status {response.status_code}: {response.text}")
-                return JsonResponse({"error": f"API request failed: {response.status_code}"}, status=500)
-
-            try:
-                api_result = response.json()
-                logger.info(f"API response received: {api_result}")
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse API response as JSON: {response.text}, error: {str(e)}")
-                return JsonResponse({"error": "Invalid response from prediction API"}, status=500)
-
-            if api_result.get("status") != "success":
-                logger.error(f"Prediction failed: API returned status {api_result.get('status')}")
-                return JsonResponse({"error": "Prediction failed"}, status=500)
-
-            predicted_disease = api_result.get("prediction")
-            if not predicted_disease:
-                logger.error("Missing 'prediction' key in API response")
-                return JsonResponse({"error": "Prediction data missing from API response"}, status=500)
-
-            category = api_result.get("category")
-            if not category:
-                logger.warning("Missing 'category' key in API response, using request category")
-
-            # Get disease info
-            info = DISEASE_INFO_DICT.get(predicted_disease, "No info available.")
-            logger.info(f"Prediction successful: disease={predicted_disease}, category={category}")
-
-            return JsonResponse({
-                "prediction": predicted_disease,
-                "category": category,
-                "disease_info": info,
-                "status": "success"
-            })
+            category = normalize_category(model_type, allow_auto=True)
+            result, cache_status = predict_image(
+                image_bytes, category,
+                filename=image_file.name,
+                content_type=image_file.content_type or "application/octet-stream",
+            )
+            return prediction_response(result, cache_status)
 
+        except PredictionError as e:
+            return prediction_error_response(e)
         except Exception as e:
             logger.error(f"Unexpected error in predict function: {str(e)}", exc_info=True)
             return JsonResponse({"error": "An unexpected error occurred"}, status=500)
 
     return render(request, "prediction/predict.html")
 
+def _predict_batch_item(index, image_file, model_type, catalog):
+    item = {"index": index, "filename": image_file.name}
+    try:
+        category = normalize_category(model_type, allow_auto=True)
+        result, cache_status = predict_image(
+            read_upload(image_file), category,
+            filename=image_file.name,
+            content_type=image_file.content_type or "application/octet-stream",
+        )
+    except PredictionError as e:
+        item.update({"status": "error", "error": e.message, "code": e.status})
+        if e.retry_after is not None:
+            item["retry_after"] = e.retry_after
+        return item
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Unexpected error predicting batch item {index}: {str(e)}", exc_info=True)
+        item.update({"status": "error", "error": "An unexpected error occurred", "code": 500})
+        return item
+    item.update(prediction_payload(result, catalog))
+    item["cache"] = cache_status
+    return item
+
+def _batch_cost(request):
+    return max(1, len(request.FILES.getlist("images")))
+
+@csrf_exempt
+@never_cache
+@rate_limit("predict", cost=_batch_cost)
+def predict_batch(request):
+    """Predict many images in one multipart request.
+
+    Form fields: ``images`` (repeated file field) and ``model_type``, given either
+    once for the whole batch or once per image in the same order. Images are sent
+    upstream concurrently (PREDICTION_BATCH_CONCURRENCY) and results come back in
+    request order; a failed image does not fail the batch.
+    """
+    logger = logging.getLogger(__name__)
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    image_files = request.FILES.getlist("images")
+    model_types = request.POST.getlist("model_type") or [None]
+
+    if not image_files:
+        return JsonResponse({"error": "No images provided"}, status=400)
+    if len(image_files) > settings.PREDICTION_BATCH_MAX_IMAGES:
+        return JsonResponse({"error": f"Too many images. Maximum is {settings.PREDICTION_BATCH_MAX_IMAGES}"}, status=400)
+    if len(model_types) == 1:
+        model_types = model_types * len(image_files)
+    elif len(model_types) != len(image_files):
+        return JsonResponse({"error": "Provide one model_type for the batch or one per image"}, status=400)
+
+    logger.info(f"Received batch prediction request: {len(image_files)} images")
+    # Read in this thread: the shared pool's threads never close their database connections
+    catalog = get_disease_catalog()
+    executor = get_batch_executor()
+    slots = threading.BoundedSemaphore(settings.PREDICTION_BATCH_CONCURRENCY)
+    futures = []
+    for index, (image_file, model_type) in enumerate(zip(image_files, model_types)):
+        slots.acquire()
+        future = executor.submit(_predict_batch_item, index, image_file, model_type, catalog)
+        future.add_done_callback(lambda _: slots.release())
+        futures.append(future)
+    results = [future.result() for future in futures]
+
+    failed = sum(1 for item in results if item["status"] != "success")
+    if failed == 0:
+        status = "success"
+    elif failed == len(results):
+        status = "error"
+    else:
+        status = "partial"
+    return JsonResponse({
+        "status": status,
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "results": results,
+    })
+
+
+# ====================================================
+# Prediction Jobs
+# ====================================================
+validate_callback_url = URLValidator(schemes=["http", "https"])
+
+def job_response(job, status=200):
+    response = JsonResponse(job_payload(job), status=status)
+    response["Location"] = reverse("predict_job", args=[job.id])
+    return response
+
+@csrf_exempt
+@never_cache
+@rate_limit("predict")
+def predict_jobs(request):
+    """Queue a prediction and return its job id at once (202).
+
+    Form fields: ``image``, ``model_type`` and an optional ``callback_url`` that
+    receives the job status as JSON when it finishes. Poll the Location URL.
+    """
+    logger = logging.getLogger(__name__)
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    image_file = request.FILES.get("image")
+    if not image_file:
+        return JsonResponse({"error": "No image provided"}, status=400)
+    callback_url = request.POST.get("callback_url", "").strip()
+    if callback_url:
+        if not settings.PREDICTION_JOBS_CALLBACK_HOSTS:
+            return JsonResponse({"error": "Callbacks are not enabled on this server"}, status=400)
+        try:
+            validate_callback_url(callback_url)
+        except ValidationError:
+            return JsonResponse({"error": "Invalid callback_url"}, status=400)
+        if not callback_allowed(callback_url):
+            return JsonResponse({"error": "callback_url host is not allowed"}, status=400)
+
+    try:
+        category = normalize_category(request.POST.get("model_type"), allow_auto=True)
+        image_bytes = read_upload(image_file)
+        check_image(image_bytes)
+    except PredictionError as e:
+        return prediction_error_response(e)
+
+    job = submit_job(
+        image_bytes, category,
+        filename=image_file.name,
+        content_type=image_file.content_type or "application/octet-stream",
+        callback_url=callback_url,
+    )
+    logger.info(f"Accepted prediction job {job.id}: category={category}, image_file={image_file.name}")
+    return job_response(job, status=202)
+
+@never_cache
+def predict_job(request, job_id):
+    """Status of a prediction job; ``result`` is present once it has succeeded."""
+    return job_response(get_object_or_404(PredictionJob, id=job_id))
+
+def diseases(request):
+    """The disease classes (optionally for one ``model_type``) with their info text."""
+    try:
+        category = normalize_category(request.GET["model_type"]) if request.GET.get("model_type") else None
+    except PredictionError as e:
+        return prediction_error_response(e)
+    catalog = get_disease_catalog()
+    return JsonResponse({
+        "category": category,
+        "diseases": [{"name": name, "info": catalog.info(name)} for name in catalog.classes(category)],
+    })
+
+@never_cache
+def prediction_summary(request):
+    """Disease prevalence over the last ``days`` (default 7, at most 366), optionally for one ``model_type``."""
+    try:
+        days = min(max(int(request.GET.get("days", 7)), 1), 366)
+        category = normalize_category(request.GET["model_type"]) if request.GET.get("model_type") else None
+    except ValueError:
+        return JsonResponse({"error": "days must be a whole number"}, status=400)
+    except PredictionError as e:
+        return prediction_error_response(e)
+    since = (timezone.now() - timedelta(days=days)).replace(minute=0, second=0, microsecond=0)
+    return JsonResponse(summarize(since, category))
+
+# ====================================================
+# Health Checks
+# ====================================================
+@never_cache
+def healthz(request):
+    """Liveness: the worker is up and serving requests."""
+    return JsonResponse({"status": "ok"})
+
+@never_cache
+def readyz(request):
+    """Readiness: 503 until the background warm-up has finished, or while a required step keeps failing.
+
+    Also reports the Space's circuit breaker and hedging state; an open circuit
+    does not make the worker unready, since cached and local predictions still work.
+    """
+    status = get_warmup().status()
+    if "remote" in settings.PREDICTION_BACKENDS.values():
+        status["upstream"] = upstream_health()
+    return JsonResponse(status, status=200 if status["ready"] else 503)
+
+@never_cache
+def metrics(request):
+    """Prometheus text exposition of this process's metrics."""
+    if not settings.METRICS_ENABLED:
+        raise Http404("Metrics are disabled")
+    return HttpResponse(REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 def home(request):
     return render(request, "prediction/home.html")
 
 def chat(request):
     return render(request, "prediction/chat.html")
 
+def _ndjson(payload):
+    return json.dumps(payload) + "\n"
+
+def _chat_stream_response(events):
+    response = StreamingHttpResponse(events, content_type="application/x-ndjson")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # don't let a proxy buffer the stream
+    return response
+
+def _stream_chat(user_message):
+    """Yield NDJSON events: ``{"delta": ...}`` per text chunk, then ``{"done": true}``."""
+    try:
+        for text in stream_chat(user_message):
+            yield _ndjson({"delta": text})
+        yield _ndjson({"done": True})
+    except Saturated:
+        raise  # raised before the first event, see chat_api
+    except Exception as e:
+        logging.error(f"Error in chat stream: {str(e)}", exc_info=True)
+        yield _ndjson({"error": str(e)})
+
 @csrf_exempt
+@rate_limit("chat")
 def chat_api(request):
     if request.method == "POST":
         try:
@@ -150,42 +313,116 @@ def chat_api(request):
             if not user_message:
                 return JsonResponse({"error": "No message provided"}, status=400)
 
-            # Initialize OpenAI client with OpenRouter
-            client = openai.OpenAI(
-                api_key=settings.OPENROUTER_API_KEY,
-                base_url="https://openrouter.ai/api/v1"
-            )
+            if data.get("stream"):
+                # Start the stream before answering so a full upstream still gets a 503
+                events = _stream_chat(user_message)
+                first = next(events)
+                return _chat_stream_response(itertools.chain([first], events))
+
+            cleaned_response, cache_status = complete_chat(user_message)
+
+            response = JsonResponse({
+                "status": "success",
+                "response": cleaned_response
+            })
+            response["X-Cache"] = cache_status
+            return response
+
+        except Saturated as e:
+            return upstream_busy_response(e)
+        except Exception as e:
+            import logging
+            logging.error(f"Error in chat_api function: {str(e)}", exc_info=True)
+            return JsonResponse({"error": str(e)}, status=500)
+
+    return JsonResponse({"error": "Method not allowed"}, status=405)
+
+# ====================================================
+# Async Views (ASGI)
+# ====================================================
+# Served instead of predict/chat_api when ASYNC_VIEWS is enabled. Under an ASGI
+# server (uvicorn) the worker's event loop keeps many upstream calls in flight
+# at once instead of blocking a thread per request.
+
+@csrf_exempt
+@never_cache
+@rate_limit("predict")
+async def apredict(request):
+    logger = logging.getLogger(__name__)
+    if request.method == "POST":
+        try:
+            with STAGE_SECONDS.time("upload_read"):
+                image_file = request.FILES.get("image")
+                model_type = request.POST.get("model_type")
+                image_bytes = read_upload(image_file) if image_file else None
 
-            # Create chat completion
-            response = client.chat.completions.create(
-                model="deepseek/deepseek-r1-0528:free",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a specialized assistant for Luffa plant information. You can only provide information about Luffa plants, their cultivation, diseases, health, and related topics. If the user asks about anything else, politely decline and redirect the conversation back to Luffa plants. Always respond in plain text without using markdown formatting, bold text, italics, or special characters like emojis."
-                    },
-                    {
-                        "role": "user",
-                        "content": user_message
-                    }
-                ],
-                stream=False
+            logger.info(f"Received async prediction request: category={model_type}, image_file={image_file.name if image_file else 'None'}")
+
+            if not image_file:
+                logger.warning("No image provided in prediction request")
+                return JsonResponse({"error": "No image provided"}, status=400)
+
+            category = normalize_category(model_type, allow_auto=True)
+            result, cache_status = await apredict_image(
+                image_bytes, category,
+                filename=image_file.name,
+                content_type=image_file.content_type or "application/octet-stream",
             )
+            return prediction_response(result, cache_status, await aget_disease_catalog())
+
+        except PredictionError as e:
+            return prediction_error_response(e)
+        except Exception as e:
+            logger.error(f"Unexpected error in apredict function: {str(e)}", exc_info=True)
+            return JsonResponse({"error": "An unexpected error occurred"}, status=500)
+
+    return render(request, "prediction/predict.html")
 
-            # Extract the response content
-            bot_response = response.choices[0].message.content
+async def _astream_chat(user_message):
+    try:
+        async for text in astream_chat(user_message):
+            yield _ndjson({"delta": text})
+        yield _ndjson({"done": True})
+    except Saturated:
+        raise
+    except Exception as e:
+        logging.error(f"Error in async chat stream: {str(e)}", exc_info=True)
+        yield _ndjson({"error": str(e)})
 
-            # Remove markdown formatting
-            cleaned_response = remove_markdown(bot_response)
+async def _aprepend(first, events):
+    yield first
+    async for event in events:
+        yield event
 
-            return JsonResponse({
+@csrf_exempt
+@rate_limit("chat")
+async def achat_api(request):
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+            user_message = data.get("message", "")
+
+            if not user_message:
+                return JsonResponse({"error": "No message provided"}, status=400)
+
+            if data.get("stream"):
+                events = _astream_chat(user_message)
+                first = await anext(events)
+                return _chat_stream_response(_aprepend(first, events))
+
+            cleaned_response, cache_status = await acomplete_chat(user_message)
+
+            response = JsonResponse({
                 "status": "success",
                 "response": cleaned_response
             })
+            response["X-Cache"] = cache_status
+            return response
 
+        except Saturated as e:
+            return upstream_busy_response(e)
         except Exception as e:
-            import logging
-            logging.error(f"Error in chat_api function: {str(e)}", exc_info=True)
+            logging.error(f"Error in achat_api function: {str(e)}", exc_info=True)
             return JsonResponse({"error": str(e)}, status=500)
 
     return JsonResponse({"error": "Method not allowed"}, status=405)
@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# ====================================================
+# Worker Warm-up
+# ====================================================
+# Nothing heavy is loaded at import time, so `manage.py` commands and worker
+# boot stay fast. The WSGI / ASGI entry points call ``start_warmup()``, which
+# (with PREDICTION_WARMUP on) imports the URLconf and loads the chat client,
+# the Hugging Face client, caches and any local models in a background thread,
+# then starts the prediction job workers.
+# /readyz answers 503 until that thread has finished. Failed steps are retried
+# with backoff until they succeed, so a database or upstream hiccup at boot does
+# not leave the worker unready for good; while only OPTIONAL_STEPS are failing
+# the worker is "degraded" but ready, since predictions still work without them.
+LAZY = "lazy"          # warm-up never started: everything loads on first use
+WARMING = "warming"
+READY = "ready"
+DEGRADED = "degraded"  # only optional steps failed; they keep being retried
+FAILED = "failed"      # a required step failed; it keeps being retried
+
+RETRY_DELAY = 1        # seconds before the first retry, doubling up to MAX_RETRY_DELAY
+MAX_RETRY_DELAY = 60
+
+
+def _warm_urlconf():
+    # Django imports the URLconf (and so every view module) on the first request
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+
+
+def _warm_chat_client():
+    from .chatbot import get_chat_client
+    if settings.OPENROUTER_API_KEY:
+        get_chat_client()
+    else:
+        import openai  # noqa: F401 - still worth paying the import cost up front
+
+
+def _warm_prediction_backends():
+    from .services import get_backend
+    for category, name in settings.PREDICTION_BACKENDS.items():
+        backend = get_backend(category)
+        if name == "remote":
+            from .upstream import get_hf_client
+            get_hf_client()
+        else:
+            # Loads the model and starts the category's batching thread
+            backend.batcher(category)
+
+
+def _warm_caches():
+    from .cache import get_chat_cache, get_prediction_cache
+    from .phash import get_perceptual_index
+    get_prediction_cache()
+    get_chat_cache()
+    get_perceptual_index()
+
+
+def _warm_disease_catalog():
+    from .catalog import get_disease_catalog
+    get_disease_catalog()
+
+
+def _start_job_workers():
+    # Also resumes jobs queued before a restart
+    from .jobs import get_job_pool
+    get_job_pool()
+
+
+WARMUP_STEPS = (
+    ("urlconf", _warm_urlconf),
+    ("chat_client", _warm_chat_client),
+    ("prediction_backends", _warm_prediction_backends),
+    ("caches", _warm_caches),
+    ("disease_catalog", _warm_disease_catalog),
+    ("job_workers", _start_job_workers),
+)
+# Steps whose failure only disables a feature (chat, catalog edits, background jobs)
+OPTIONAL_STEPS = frozenset({"chat_client", "disease_catalog", "job_workers"})
+
+
+class Warmup:
+    """Runs ``steps`` (``(name, callable)`` pairs) in a daemon thread and records the outcome.
+
+    Steps that raise are retried with backoff until they succeed; ``wait()``
+    returns after the first pass.
+    """
+
+    def __init__(self, steps=WARMUP_STEPS, optional=OPTIONAL_STEPS, retry_delay=RETRY_DELAY,
+                 max_retry_delay=MAX_RETRY_DELAY):
+        self.steps = steps
+        self.optional = frozenset(optional)
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.state = LAZY
+        self.results = {}
+        self.started_at = None
+        self.finished_at = None
+        self._attempts = {}
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.state = WARMING
+            self.started_at = time.perf_counter()
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def run(self):
+        pending = self._run_steps(self.steps)
+        self.finished_at = time.perf_counter()
+        self._update_state(pending)
+        self._done.set()
+        delay = self.retry_delay
+        while pending:
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+            pending = self._run_steps(pending)
+            self._update_state(pending)
+
+    def _run_steps(self, steps):
+        """Run ``steps`` in order; returns the ones that failed."""
+        failed = []
+        for name, step in steps:
+            attempts = self._attempts[name] = self._attempts.get(name, 0) + 1
+            start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                failed.append((name, step))
+                kind = "optional" if name in self.optional else "required"
+                logger.error(f"Warm-up step {name} ({kind}) failed, attempt {attempts}: {e}")
+                self.results[name] = {"status": FAILED, "error": str(e), "attempts": attempts}
+                continue
+            elapsed = (time.perf_counter() - start) * 1000
+            logger.info(f"Warm-up step {name} done in {elapsed:.1f} ms")
+            self.results[name] = {"status": READY, "ms": round(elapsed, 1)}
+            if attempts > 1:
+                self.results[name]["attempts"] = attempts
+        return failed
+
+    def _update_state(self, failed):
+        if any(name not in self.optional for name, _ in failed):
+            self.state = FAILED
+        else:
+            self.state = DEGRADED if failed else READY
+
+    def wait(self, timeout=None):
+        """Block until warm-up has finished; returns ``False`` on timeout."""
+        return self._done.wait(timeout)
+
+    @property
+    def ready(self):
+        # Without a warm-up the process still serves requests, loading lazily
+        return self.state in (LAZY, READY, DEGRADED)
+
+    def status(self):
+        status = {"state": self.state, "ready": self.ready, "steps": dict(self.results)}
+        if self.finished_at is not None:
+            status["ms"] = round((self.finished_at - self.started_at) * 1000, 1)
+        return status
+
+
+_warmup = Warmup()
+
+
+def get_warmup():
+    return _warmup
+
+
+def start_warmup():
+    """Start the background warm-up when PREDICTION_WARMUP is enabled."""
+    if getattr(settings, 'PREDICTION_WARMUP', True):
+        _warmup.start()
+    return _warmup